@@ -0,0 +1,327 @@
+"""Offline benchmarks against the fixture corpus.
+
+    python -m benchmarks.run extractors            # pages/sec per page type and section
+    python -m benchmarks.run crawl -n 100 --latency 0.05
+    python -m benchmarks.run cache -n 500          # HTTP cache storages: lookups and disk use
+    python -m benchmarks.run analysis              # post-crawl analysis of 1M menu items
+    python -m benchmarks.run all
+
+The crawl benchmark runs RestaurantsSpider against a local stand-in server
+(benchmarks/server.py) with the project settings, minus HTTP caching,
+throttling, the restaurant index and the export. Every run is appended to
+benchmarks/results.jsonl with the commit it ran on, and compared with the
+latest run of the same benchmark and parameters on a different commit.
+
+The cache benchmark stores every page of ``-n`` restaurants (and their
+listing pages) in Scrapy's FilesystemCacheStorage and in
+tabelog_scraper.httpcache.SqliteCacheStorage, then reads them back in random
+order.
+
+The analysis benchmark builds export tables for ``--menu-items`` menu items
+(25 per restaurant, prices as text like "¥3,000") and times
+tabelog_scraper.analysis on them.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+RESULTS = Path(__file__).parent / "results.jsonl"
+
+# Page -> sections extracted from it, as the spider does
+EXTRACTOR_CASES = {
+    "listing": ("/en/rstLst/?pcd=41", ["listing_cards"]),
+    "detail": ("/en/saga/A4104/A410401/41006451/",
+               ["specialities", "restaurant_information", "headline_description", "menu_tabs"]),
+    "party": ("/en/saga/A4104/A410401/41006451/party/", ["set_menu"]),
+    "dtlmenu": ("/en/saga/A4104/A410401/41006451/dtlmenu/", ["menu_items"]),
+    "drink": ("/en/saga/A4104/A410401/41006451/dtlmenu/drink/", ["menu_items"]),
+    "lunch": ("/en/saga/A4104/A410401/41006451/dtlmenu/lunch/", ["menu_items"]),
+    "dtlratings": ("/en/saga/A4104/A410401/41006451/dtlratings/", ["review_rating"]),
+    "photos": ("/en/saga/A4104/A410401/41006451/dtlphotolst/3/smp2/", ["interior_photos"]),
+}
+
+
+def commit():
+    try:
+        rev = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                             text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"],
+                               capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return rev + ("-dirty" if dirty else "")
+
+
+def pages_per_second(func, repeat, rounds=3):
+    # Best of a few rounds, to keep noise from other processes out of the comparison
+    best = float("inf")
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            func()
+        best = min(best, time.perf_counter() - start)
+    return repeat / best
+
+
+def bench_extractors(repeat):
+    from scrapy.http import HtmlResponse
+
+    from benchmarks.server import Corpus
+    from tabelog_scraper.extractors import extract_headline_description, extract_menu_tabs, extract_section
+
+    corpus = Corpus()
+    metrics = {}
+    for page, (path, sections) in EXTRACTOR_CASES.items():
+        url = "https://tabelog.com" + path
+        body = corpus.page(path).encode()
+
+        def parse():
+            return HtmlResponse(url, body=body, encoding="utf-8").selector
+
+        metrics[f"{page}/parse"] = pages_per_second(parse, repeat)
+
+        response = HtmlResponse(url, body=body, encoding="utf-8")
+        response.selector  # parsed once, like the spider does for all sections of a page
+        for section in sections:
+            if section == "headline_description":
+                func = lambda: extract_headline_description(response)  # noqa: E731
+            elif section == "menu_tabs":
+                func = lambda: extract_menu_tabs(response)  # noqa: E731
+            else:
+                func = lambda section=section: extract_section(response, section)  # noqa: E731
+            metrics[f"{page}/{section}"] = pages_per_second(func, repeat)
+    return {name: round(value, 1) for name, value in metrics.items()}
+
+
+def bench_crawl(restaurants, latency, jitter, listing_size):
+    from scrapy.crawler import CrawlerProcess
+    from scrapy.utils.project import get_project_settings
+
+    from benchmarks.server import StandInServer
+    from tabelog_scraper.spiders.restaurants import RestaurantsSpider
+
+    os.environ.setdefault("SCRAPY_SETTINGS_MODULE", "tabelog_scraper.settings")
+    settings = get_project_settings()
+    settings.setdict({
+        "HTTPCACHE_ENABLED": False,
+        "AUTOTHROTTLE_ENABLED": False,
+        "INDEX_ENABLED": False,
+        "EXPORT_DIR": "",
+        "JOBDIR": None,
+        "TELNETCONSOLE_ENABLED": False,
+        "LOG_LEVEL": "WARNING",
+    }, priority="cmdline")
+
+    with StandInServer(restaurants=listing_size, latency=latency, jitter=jitter) as server:
+        process = CrawlerProcess(settings)
+        crawler = process.create_crawler(RestaurantsSpider)
+        process.crawl(crawler, num_restaurants=restaurants, start_url=server.start_url)
+        process.start()
+
+    stats = crawler.stats.get_stats()
+    seconds = (stats["finish_time"] - stats["start_time"]).total_seconds()
+    items = stats.get("item_scraped_count", 0)
+    metrics = {
+        "seconds": round(seconds, 2),
+        "items": items,
+        "items_per_sec": round(items / seconds, 2) if seconds else 0,
+        "requests": stats.get("downloader/request_count", 0),
+        "renders": sum(value for key, value in stats.items() if key.startswith("browser/pages/")),
+    }
+    for key, value in stats.items():
+        if key.startswith("stages/") and key.rsplit("/", 1)[1] in ("p50", "p95"):
+            metrics[key] = value
+    return metrics
+
+
+def disk_usage(directory):
+    """(bytes allocated, files) under ``directory``."""
+    allocated, files = 0, 0
+    for path in Path(directory).rglob("*"):
+        if path.is_file():
+            allocated += path.stat().st_blocks * 512
+            files += 1
+    return allocated, files
+
+
+CACHE_STORAGES = {
+    "filesystem": "scrapy.extensions.httpcache.FilesystemCacheStorage",
+    "sqlite": "tabelog_scraper.httpcache.SqliteCacheStorage",
+}
+
+
+def bench_cache(restaurants):
+    from scrapy import Request, Spider
+    from scrapy.http import HtmlResponse
+    from scrapy.utils.misc import load_object
+    from scrapy.utils.test import get_crawler
+
+    from benchmarks.server import FIRST_RESTAURANT_ID, FIXTURE_AREA, RESTAURANT_PAGES, Corpus
+
+    corpus = Corpus(restaurants=restaurants)
+    paths = [f"/en/rstLst/{page}/?pcd=41" for page in range(1, -(-restaurants // corpus.per_page) + 1)]
+    paths += [f"{FIXTURE_AREA}{FIRST_RESTAURANT_ID + index}/{subpath}"
+              for index in range(restaurants) for subpath in RESTAURANT_PAGES]
+    pages = [(f"https://tabelog.com{path}", corpus.page(path).encode()) for path in paths]
+
+    metrics = {"responses": len(pages)}
+    for name, storage_path in CACHE_STORAGES.items():
+        with tempfile.TemporaryDirectory(prefix="tabelog-bench-") as cachedir:
+            crawler = get_crawler(Spider, {"HTTPCACHE_DIR": cachedir, "HTTPCACHE_STORAGE": storage_path})
+            spider = Spider.from_crawler(crawler, name="bench")
+            crawler.stats.open_spider(spider)
+            storage = load_object(storage_path)(crawler.settings)
+            storage.open_spider(spider)
+
+            start = time.perf_counter()
+            for url, body in pages:
+                response = HtmlResponse(url, body=body, headers={"Content-Type": "text/html; charset=utf-8"})
+                storage.store_response(spider, Request(url), response)
+            metrics[f"{name}/store_per_sec"] = round(len(pages) / (time.perf_counter() - start), 1)
+
+            latencies = []
+            for url, _ in random.Random(0).sample(pages, len(pages)):
+                start = time.perf_counter()
+                assert storage.retrieve_response(spider, Request(url)) is not None
+                latencies.append(time.perf_counter() - start)
+            latencies.sort()
+            metrics[f"{name}/lookup_p50_ms"] = round(latencies[len(latencies) // 2] * 1000, 3)
+            metrics[f"{name}/lookup_p95_ms"] = round(latencies[int(len(latencies) * 0.95)] * 1000, 3)
+
+            storage.close_spider(spider)
+            allocated, files = disk_usage(cachedir)
+            metrics[f"{name}/disk_kb"] = round(allocated / 1024)
+            metrics[f"{name}/files"] = files
+    return metrics
+
+
+def bench_analysis(menu_items):
+    import numpy as np
+    import pandas as pd
+
+    from tabelog_scraper.analysis import analyse
+
+    rng = np.random.default_rng(0)
+    restaurants = max(1, menu_items // 25)
+    ids = pd.Series(np.arange(41000000, 41000000 + restaurants)).astype(str)
+    areas = np.array([f"Area {n}" for n in range(200)])
+    genres = np.array(["Sushi", "Ramen", "Tempura, Japanese Cuisine", "Yakiniku", "Izakaya (Tavern)", "Cafe"])
+    days = np.array(["Mon, Tue, Wed, Thu, Fri", "Mon, Tue, Wed, Sat, Sun", "Tue, Wed, Thu, Fri, Sat, Sun"])
+    budgets = np.array(["JPY 1,000 - JPY 1,999", "JPY 3,000 - JPY 3,999", "JPY 10,000 - JPY 14,999", "～JPY 999"])
+    tables = {
+        "restaurants": pd.DataFrame({
+            "restaurant_id": ids,
+            "area": areas[rng.integers(0, len(areas), restaurants)],
+            "genre": genres[rng.integers(0, len(genres), restaurants)],
+            "rating": rng.normal(3.3, 0.25, restaurants).clip(3.0, 4.6).round(2),
+            "review_count": rng.integers(0, 2000, restaurants),
+            "average_ratings": [{"Overall": 3.5, "Food and taste": 4.0}] * restaurants,
+        }),
+        "menu_items": pd.DataFrame({
+            "restaurant_id": ids.repeat(25).to_numpy(),
+            "menu": np.tile(["Food", "Drink", "Lunch", "Set menu", "Food"], menu_items // 5 + 1)[:restaurants * 25],
+            "price": pd.Series(rng.integers(1, 300, restaurants * 25) * 100).map("¥{:,}".format).to_numpy(),
+        }),
+        "rating_distribution": pd.DataFrame({
+            "restaurant_id": ids.repeat(5).to_numpy(),
+            "range": np.tile(["5.0", "4.5 - 4.9", "4.0 - 4.4", "3.5 - 3.9", "3.0 - 3.4"], restaurants),
+            "percentage": rng.integers(0, 40, restaurants * 5),
+            "people": rng.integers(0, 100, restaurants * 5),
+        }),
+        "info_rows": pd.DataFrame({
+            "restaurant_id": ids.repeat(3).to_numpy(),
+            "field": np.tile(["Business hours", "Average price", "Number of seats"], restaurants),
+            "value": np.stack([
+                days[rng.integers(0, len(days), restaurants)].astype(object) + "\n 11:30 - 22:00",
+                budgets[rng.integers(0, len(budgets), restaurants)],
+                pd.Series(rng.integers(4, 120, restaurants)).astype(str).to_numpy() + " seats",
+            ], axis=1).ravel(),
+        }),
+    }
+
+    start = time.perf_counter()
+    frames = analyse(tables)
+    elapsed = time.perf_counter() - start
+    return {
+        "menu_items": len(frames["menu_items"]),
+        "restaurants": len(frames["restaurants"]),
+        "seconds": round(elapsed, 2),
+        "menu_items_per_sec": round(len(frames["menu_items"]) / elapsed),
+        "areas": len(frames["by_area"]),
+    }
+
+
+def previous_result(benchmark, params, current_commit):
+    if not RESULTS.exists():
+        return None
+    previous = None
+    with RESULTS.open() as f:
+        for line in f:
+            result = json.loads(line)
+            if (result["benchmark"] == benchmark and result["params"] == params
+                    and result["commit"] != current_commit):
+                previous = result
+    return previous
+
+
+def report(benchmark, params, metrics):
+    result = {
+        "benchmark": benchmark,
+        "commit": commit(),
+        "time": datetime.now(tz=timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "params": params,
+        "metrics": metrics,
+    }
+    previous = previous_result(benchmark, params, result["commit"])
+    with RESULTS.open("a") as f:
+        f.write(json.dumps(result) + "\n")
+
+    title = f"{benchmark} @ {result['commit']}"
+    if previous:
+        title += f" (vs {previous['commit']})"
+    print(title)
+    width = max(len(name) for name in metrics)
+    for name, value in metrics.items():
+        line = f"  {name:<{width}}  {value:>12}"
+        old = previous["metrics"].get(name) if previous else None
+        if old:
+            line += f"  {(value - old) / old:+8.1%}"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmarks against the fixture corpus.")
+    parser.add_argument("benchmark", choices=["extractors", "crawl", "cache", "analysis", "all"])
+    parser.add_argument("--repeat", type=int, default=200, help="extractor calls per round")
+    parser.add_argument("-n", "--restaurants", type=int, default=50,
+                        help="num_restaurants for the crawl, restaurants in the cache benchmark")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="up to this many more seconds")
+    parser.add_argument("--listing-size", type=int, default=1200, help="restaurants in the listing")
+    parser.add_argument("--menu-items", type=int, default=1_000_000, help="menu items in the analysis benchmark")
+    args = parser.parse_args()
+
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+    if args.benchmark in ("extractors", "all"):
+        report("extractors", {"repeat": args.repeat}, bench_extractors(args.repeat))
+    if args.benchmark in ("crawl", "all"):
+        params = {"restaurants": args.restaurants, "latency": args.latency, "jitter": args.jitter,
+                  "listing_size": args.listing_size}
+        report("crawl", params, bench_crawl(args.restaurants, args.latency, args.jitter, args.listing_size))
+    if args.benchmark in ("cache", "all"):
+        report("cache", {"restaurants": args.restaurants}, bench_cache(args.restaurants))
+    if args.benchmark in ("analysis", "all"):
+        report("analysis", {"menu_items": args.menu_items}, bench_analysis(args.menu_items))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+"""Local stand-in for Tabelog that serves the fixture corpus with Tabelog's URL layout.
+
+Listing pages (/en/rstLst/ and /en/rstLst/<page>/) list ``restaurants``
+synthetic restaurants, ``per_page`` to a page. Every restaurant serves the
+fixture pages of restaurant 41006451 with its own ID, so a crawl can be as
+large as needed. Each response is delayed by ``latency`` seconds plus up to
+``jitter`` seconds, to stand in for the network.
+
+    python -m benchmarks.server --port 8765 --latency 0.1
+"""
+import argparse
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from string import Template
+from urllib.parse import urlsplit
+
+FIXTURES_DIR = Path(__file__).parent / "fixtures"
+FIXTURE_RESTAURANT_ID = "41006451"
+FIXTURE_AREA = "/en/saga/A4104/A410401/"
+FIRST_RESTAURANT_ID = 41100001
+
+# Sub-page path under the restaurant URL -> fixture file
+RESTAURANT_PAGES = {
+    "": "detail.html",
+    "party/": "party.html",
+    "dtlmenu/": "dtlmenu.html",
+    "dtlmenu/drink/": "drink.html",
+    "dtlmenu/lunch/": "lunch.html",
+    "dtlratings/": "dtlratings.html",
+    "dtlphotolst/3/smp2/": "photos.html",
+}
+
+LISTING_RE = re.compile(r"^/en/rstLst/(?:(\d+)/)?$")
+RESTAURANT_RE = re.compile(r"^/en/\w+/A\d{4}/A\d{6}/(\d+)/(.*)$")
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        server = self.server.stand_in
+        server.delay()
+        body = server.page(self.path)
+        status = server.status(self.path) if body is not None else 404
+        body = (body or "Not found").encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class Corpus:
+    """The fixture pages, as served for ``path`` by a site at ``base_url``."""
+
+    def __init__(self, fixtures=FIXTURES_DIR, restaurants=1200, per_page=20):
+        self.fixtures = {name: (Path(fixtures) / name).read_text(encoding="utf-8")
+                         for name in set(RESTAURANT_PAGES.values())}
+        self.listing = Template((Path(fixtures) / "listing.html").read_text(encoding="utf-8"))
+        self.card = Template((Path(fixtures) / "listing_card.html").read_text(encoding="utf-8"))
+        self.restaurants = restaurants
+        self.per_page = per_page
+
+    def page(self, path, base_url="https://tabelog.com"):
+        parts = urlsplit(path)
+        match = LISTING_RE.match(parts.path)
+        if match:
+            return self.listing_page(int(match.group(1) or 1), parts.query, base_url)
+        match = RESTAURANT_RE.match(parts.path)
+        if match and match.group(2) in RESTAURANT_PAGES:
+            return self.restaurant_page(match.group(1), match.group(2), base_url)
+        return None
+
+    def restaurant_page(self, restaurant_id, subpath, base_url):
+        body = self.fixtures[RESTAURANT_PAGES[subpath]]
+        return body.replace(FIXTURE_RESTAURANT_ID, restaurant_id).replace("https://tabelog.com", base_url)
+
+    def listing_page(self, page, query, base_url):
+        last_page = max(1, -(-self.restaurants // self.per_page))
+        if page > last_page:
+            return None
+        first = (page - 1) * self.per_page
+        last = min(first + self.per_page, self.restaurants)
+        cards = []
+        for index in range(first, last):
+            restaurant_id = FIRST_RESTAURANT_ID + index
+            cards.append(self.card.substitute(
+                restaurant_id=restaurant_id,
+                url=f"{base_url}{FIXTURE_AREA}{restaurant_id}/",
+                name=f"Restaurant {restaurant_id}",
+                rating=f"{3 + restaurant_id % 100 / 100:.2f}",
+                reviews=restaurant_id % 500,
+            ))
+
+        query = f"?{query}" if query else ""
+        pagination = [f'<a class="c-pagination__num" href="/en/rstLst/{n}/{query}">{n}</a>'
+                      for n in range(max(1, page - 4), min(last_page, page + 5) + 1) if n != page]
+        if page < last_page:
+            pagination.append(f'<a class="c-pagination__arrow--next" href="/en/rstLst/{page + 1}/{query}">Next</a>')
+        return self.listing.substitute(
+            first=first + 1, last=last, total=f"{self.restaurants:,}",
+            cards="\n".join(cards), pagination="\n".join(pagination))
+
+
+class StandInServer:
+    def __init__(self, fixtures=FIXTURES_DIR, restaurants=1200, per_page=20, latency=0.0, jitter=0.0,
+                 host="127.0.0.1", port=0):
+        self.corpus = Corpus(fixtures, restaurants, per_page)
+        self.latency = latency
+        self.jitter = jitter
+        self.base_url = None
+        self._server = ThreadingHTTPServer((host, port), _Handler)
+        self._server.daemon_threads = True
+        self._server.stand_in = self
+
+    @property
+    def start_url(self):
+        return f"{self.base_url}/en/rstLst/?pcd=41"
+
+    def start(self):
+        host, port = self._server.server_address[:2]
+        self.base_url = f"http://{host}:{port}"
+        threading.Thread(target=self._server.serve_forever, name="stand-in", daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def delay(self):
+        if self.latency or self.jitter:
+            time.sleep(self.latency + random.uniform(0, self.jitter))
+
+    def page(self, path):
+        return self.corpus.page(path, self.base_url)
+
+    def status(self, path):
+        """Status of the page at ``path``; subclasses fail pages to test error handling."""
+        return 200
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--restaurants", type=int, default=1200)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = StandInServer(restaurants=args.restaurants, latency=args.latency, jitter=args.jitter,
+                           port=args.port).start()
+    print(f"Serving {args.restaurants} restaurants at {server.start_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
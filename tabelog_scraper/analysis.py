@@ -0,0 +1,216 @@
+# Post-crawl analysis of an export (see tabelog_scraper.export).
+#
+# Loads a crawl's tables into pandas, turns the text fields into typed
+# columns (menu prices in yen, rating histogram buckets, business days and
+# hours, budget and seats from the restaurant information) and computes
+# per-area and per-genre aggregates: menu price percentiles, rating
+# histograms and restaurant counts. Everything is done with column
+# operations, so a million menu items take seconds.
+#
+#   python -m tabelog_scraper.analysis export/restaurants/2026-01-01T00-00-00+00-00 -o analysis
+#
+# Needs `pip install pandas` (and pyarrow to read and write Parquet; without
+# it the JSON Lines shards are read and CSV is written).
+import argparse
+import json
+import logging
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from tabelog_scraper.export import TABLES, normalize
+from tabelog_scraper.specs import STATION_DISTANCE_RE
+
+logger = logging.getLogger(__name__)
+
+DAYS = ("Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun")
+PRICE_QUANTILES = (0.1, 0.25, 0.5, 0.75, 0.9)
+# Tabelog scores rarely leave 3.0-4.5; everything below 3.0 shares a bucket.
+# Buckets include their lower edge, so the last one, [5.0, 5.1), holds perfect scores
+RATING_BINS = np.array([0.0, *np.round(np.arange(3.0, 5.11, 0.1), 1)])
+
+NUMBER_PATTERN = r"(\d[\d,]*(?:\.\d+)?)"
+TIME_RANGE_PATTERN = r"(\d{1,2}):(\d{2})\s*[-~～－]\s*(\d{1,2}):(\d{2})"
+
+
+def load_tables(directory):
+    """DataFrames of every export table, from the Parquet parts if there are any, else the JSON Lines shards."""
+    directory = Path(directory)
+    parquet = directory / "parquet"
+    if parquet.is_dir():
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            logger.warning("pyarrow is not installed; reading the JSON Lines shards")
+        else:
+            return {table: (pd.read_parquet(parquet / table) if (parquet / table).is_dir()
+                            else pd.DataFrame()) for table in TABLES}
+
+    rows = {table: [] for table in TABLES}
+    for shard in sorted((directory / "jsonl").glob("*.jsonl")):
+        with shard.open(encoding="utf-8") as f:
+            for line in f:
+                for table, table_rows in normalize(json.loads(line)).items():
+                    rows[table].extend(table_rows)
+    return {table: pd.DataFrame(table_rows) for table, table_rows in rows.items()}
+
+
+def parse_numbers(values):
+    """First number of every value as float64 (e.g. "¥3,000" -> 3000.0); NaN where there is none."""
+    if pd.api.types.is_numeric_dtype(values):
+        return values.astype("float64")
+    # Prices repeat a lot: run the regex over the distinct values only
+    codes, uniques = pd.factorize(values)
+    if not len(uniques):
+        # All null (e.g. no restaurant lists its seats): no numbers to index into
+        return pd.Series(np.nan, index=values.index, dtype="float64")
+    numbers = pd.Series(uniques, dtype="string").str.extract(NUMBER_PATTERN, expand=False)
+    parsed = pd.to_numeric(numbers.str.replace(",", "", regex=False), errors="coerce")
+    parsed = parsed.to_numpy("float64", na_value=np.nan)
+    return pd.Series(np.where(codes >= 0, parsed[codes], np.nan), index=values.index)
+
+
+def info_field(info_rows, field):
+    """Value of ``field`` in each restaurant's information table, indexed by restaurant_id."""
+    rows = info_rows[info_rows["field"] == field]
+    return rows.drop_duplicates("restaurant_id").set_index("restaurant_id")["value"].astype("string")
+
+
+def business_hours(hours):
+    """Days open, opening and closing time (minutes after midnight) from business hours text."""
+    columns = {f"open_{day.lower()}": hours.str.contains(rf"\b{day}", regex=True).fillna(False).astype(bool)
+               for day in DAYS}
+    frame = pd.DataFrame(columns, index=hours.index)
+    frame["days_open"] = frame.sum(axis=1).astype("int8")
+    times = hours.str.extract(TIME_RANGE_PATTERN).apply(pd.to_numeric, errors="coerce")
+    frame["opens_at"] = (times[0] * 60 + times[1]).astype("Int16")
+    # Past midnight (e.g. "18:00 - 02:00") as minutes after the opening day's midnight
+    closes = times[2] * 60 + times[3]
+    frame["closes_at"] = closes.where(closes >= frame["opens_at"], closes + 24 * 60).astype("Int16")
+    return frame
+
+
+def normalize_tables(tables):
+    """Typed restaurants, menu_items and rating_distribution frames from the raw export tables."""
+    # A restaurant exported by two jobs into one directory counts once
+    restaurants = tables["restaurants"].drop_duplicates("restaurant_id", keep="last").reset_index(drop=True)
+    restaurants["rating"] = parse_numbers(restaurants["rating"])
+    restaurants["review_count"] = parse_numbers(restaurants["review_count"]).astype("Int64")
+    # Exports from before the listing card's station distance was dropped: "Tenjin 350m" -> "Tenjin"
+    restaurants["area"] = (restaurants["area"].astype("string")
+                           .str.replace(STATION_DISTANCE_RE.pattern, "", regex=True).astype("category"))
+    # Listing cards show several genres, e.g. "Tempura, Japanese Cuisine"; the first is the main one
+    restaurants["genre"] = (restaurants["genre"].astype("string").str.split(",").str[0]
+                            .str.strip().astype("category"))
+    # {"Food and taste": 4.58, ...} (a list of pairs when read from Parquet) -> score_food_and_taste, ...
+    scores = pd.DataFrame([dict(pairs) if pairs is not None else {} for pairs in restaurants.pop("average_ratings")],
+                          index=restaurants.index, dtype="float64")
+    scores.columns = ["score_" + "_".join(str(name).lower().split()) for name in scores.columns]
+    restaurants = restaurants.join(scores)
+
+    info_rows = tables["info_rows"]
+    if len(info_rows):
+        restaurants = restaurants.set_index("restaurant_id")
+        hours = info_field(info_rows, "Business hours").reindex(restaurants.index)
+        restaurants = restaurants.join(business_hours(hours))
+        budget = info_field(info_rows, "Average price").reindex(restaurants.index)
+        bounds = budget.str.extractall(NUMBER_PATTERN)[0].str.replace(",", "", regex=False)
+        bounds = pd.to_numeric(bounds, errors="coerce").unstack()
+        restaurants["budget_min"] = bounds.get(0)
+        restaurants["budget_max"] = bounds.get(1, bounds.get(0))
+        restaurants["seats"] = parse_numbers(
+            info_field(info_rows, "Number of seats").reindex(restaurants.index)).astype("Int32")
+        restaurants = restaurants.reset_index()
+
+    menu_items = tables["menu_items"].copy()
+    menu_items["price"] = parse_numbers(menu_items["price"])
+    menu_items["menu"] = menu_items["menu"].astype("category")
+    # Each item's restaurant area and genre, for the per-area and per-genre aggregates
+    rows = pd.Index(restaurants["restaurant_id"]).get_indexer(menu_items["restaurant_id"])
+    for column in ("area", "genre"):
+        categories = restaurants[column].cat
+        codes = np.where(rows >= 0, categories.codes.to_numpy()[rows], -1)
+        menu_items[column] = pd.Categorical.from_codes(codes, categories.categories)
+
+    distribution = tables["rating_distribution"].copy()
+    # "4.5 - 4.9" -> 4.5
+    distribution["score_from"] = parse_numbers(distribution["range"])
+    distribution["percentage"] = parse_numbers(distribution["percentage"]).astype("Int16")
+    distribution["people"] = parse_numbers(distribution["people"]).astype("Int32")
+    return {"restaurants": restaurants, "menu_items": menu_items, "rating_distribution": distribution}
+
+
+def aggregate(frames, by):
+    """Per-``by`` (e.g. "area" or "genre") restaurant counts, ratings, menu price percentiles and rating histogram."""
+    restaurants = frames["restaurants"]
+    groups = restaurants.groupby(by, observed=True)
+    result = pd.DataFrame({
+        "restaurants": groups.size(),
+        "rating_mean": groups["rating"].mean(),
+        "rating_median": groups["rating"].median(),
+        "reviews_median": groups["review_count"].median(),
+    })
+    if "budget_min" in restaurants:
+        result["budget_min_median"] = groups["budget_min"].median()
+
+    prices = frames["menu_items"].dropna(subset=["price"]).groupby(by, observed=True)["price"]
+    result["menu_items"] = prices.size()
+    percentiles = prices.quantile(list(PRICE_QUANTILES)).unstack()
+    percentiles.columns = [f"price_p{round(q * 100)}" for q in percentiles.columns]
+    result = result.join(percentiles)
+
+    buckets = pd.cut(restaurants["rating"], RATING_BINS, right=False)
+    labels = {interval: f"rating_{interval.left:.1f}" for interval in buckets.cat.categories}
+    histogram = (restaurants.assign(bucket=buckets.cat.rename_categories(labels))
+                 .groupby([by, "bucket"], observed=True).size().unstack(fill_value=0))
+    result = result.join(histogram).fillna({column: 0 for column in histogram.columns})
+    return result.sort_values("restaurants", ascending=False)
+
+
+def analyse(tables):
+    """Typed frames and the per-area and per-genre aggregates of a crawl's tables."""
+    frames = normalize_tables(tables)
+    frames["by_area"] = aggregate(frames, "area")
+    frames["by_genre"] = aggregate(frames, "genre")
+    return frames
+
+
+def write(frames, directory):
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        pyarrow = None
+    for name, frame in frames.items():
+        index = name.startswith("by_")
+        if pyarrow is not None:
+            frame.to_parquet(directory / f"{name}.parquet", index=index)
+        else:
+            frame.to_csv(directory / f"{name}.csv", index=index)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Typed tables and per-area/genre aggregates of a crawl export.")
+    parser.add_argument("export_dir")
+    parser.add_argument("-o", "--output", help="write the tables and aggregates here (Parquet, or CSV)")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    tables = load_tables(args.export_dir)
+    loaded = time.perf_counter()
+    frames = analyse(tables)
+    done = time.perf_counter()
+    print(f"{len(frames['restaurants'])} restaurants, {len(frames['menu_items'])} menu items: "
+          f"loaded in {loaded - start:.2f}s, analysed in {done - loaded:.2f}s")
+    with pd.option_context("display.max_columns", 12, "display.width", 160):
+        print(frames["by_area"].head(20))
+        print(frames["by_genre"].head(20))
+    if args.output:
+        write(frames, args.output)
+
+
+if __name__ == "__main__":
+    main()
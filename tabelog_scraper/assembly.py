@@ -0,0 +1,148 @@
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def merge_fields(item, fields):
+    # One level deep, so {"menu": {"Food": [...]}} fills a single menu tab
+    for key, value in fields.items():
+        if isinstance(item.get(key), dict) and isinstance(value, dict):
+            item[key].update(value)
+        else:
+            item[key] = value
+
+
+class ItemAssembler:
+    """Joins the partial results of a restaurant's sub-pages into one item.
+
+    ``start()`` registers the item built from the detail page together with the
+    names of the parts still outstanding. Each sub-page reports back through
+    ``add()`` or ``fail()``; the call that settles the last part returns the
+    finished item. ``retry()`` keeps a part outstanding while it is tried
+    again later. Items whose parts have not all arrived within ``timeout``
+    seconds are handed out incomplete by ``expired()``. Parts that failed or
+    timed out are listed in the item's ``failed_sections``. Parts are merged
+    into plain dicts; ``factory`` turns a finished dict into the emitted item.
+    Fields it rejects with a ValueError are emptied and listed in
+    ``failed_sections`` too, so one odd value doesn't lose the restaurant.
+    """
+
+    def __init__(self, timeout=180, factory=None, stats=None):
+        self.timeout = timeout
+        self.factory = factory
+        self.stats = stats
+        self._partials = {}
+
+    @classmethod
+    def from_settings(cls, settings, factory=None, stats=None):
+        return cls(timeout=settings.getfloat("ITEM_JOIN_TIMEOUT", 180), factory=factory, stats=stats)
+
+    def __len__(self):
+        return len(self._partials)
+
+    def start(self, restaurant_id, item, parts):
+        item.setdefault("failed_sections", [])
+        if not parts:
+            return self._finish(item)
+        self._partials[restaurant_id] = {
+            "item": item,
+            "pending": set(parts),
+            "deadline": time.monotonic() + self.timeout,
+        }
+        return None
+
+    def add(self, restaurant_id, part, fields):
+        partial = self._partials.get(restaurant_id)
+        if partial is None:
+            # Already emitted after timing out
+            logger.info(f"Dropping late part {part} of restaurant {restaurant_id}")
+            return None
+        merge_fields(partial["item"], fields)
+        return self._settle(restaurant_id, part)
+
+    def fail(self, restaurant_id, part):
+        if restaurant_id not in self._partials:
+            return None
+        logger.warning(f"Part {part} of restaurant {restaurant_id} failed")
+        self._partials[restaurant_id]["item"]["failed_sections"].append(part)
+        return self._settle(restaurant_id, part)
+
+    def retry(self, restaurant_id, part, delay):
+        """Keep ``part`` outstanding for another attempt in ``delay`` seconds; False if the item is gone."""
+        partial = self._partials.get(restaurant_id)
+        if partial is None:
+            return False
+        partial["pending"].add(part)
+        partial["deadline"] = max(partial["deadline"], time.monotonic() + delay + self.timeout)
+        return True
+
+    def _settle(self, restaurant_id, part):
+        partial = self._partials[restaurant_id]
+        partial["pending"].discard(part)
+        if partial["pending"]:
+            return None
+        del self._partials[restaurant_id]
+        return self._finish(partial["item"])
+
+    def expired(self):
+        now = time.monotonic()
+        expired_ids = [rid for rid, partial in self._partials.items() if partial["deadline"] <= now]
+        for rid in expired_ids:
+            partial = self._partials.pop(rid)
+            logger.warning(f"Restaurant {rid} timed out waiting for {', '.join(sorted(partial['pending']))}")
+            partial["item"]["failed_sections"].extend(sorted(partial["pending"]))
+            yield self._finish(partial["item"])
+
+    def dump(self):
+        """Outstanding items in a picklable form, for checkpoints."""
+        return {rid: {"item": partial["item"], "pending": sorted(partial["pending"])}
+                for rid, partial in self._partials.items()}
+
+    def load(self, partials):
+        for rid, partial in partials.items():
+            self.start(rid, partial["item"], partial["pending"])
+
+    def flush(self):
+        for rid in list(self._partials):
+            partial = self._partials.pop(rid)
+            partial["item"]["failed_sections"].extend(sorted(partial["pending"]))
+            yield self._finish(partial["item"])
+
+    def _finish(self, item):
+        if not self.factory:
+            return item
+        try:
+            return self.factory(item)
+        except ValueError as e:
+            return self._salvage(item, e)
+
+    def _salvage(self, item, error):
+        url = item.get("url")
+        logger.warning(f"Invalid item {url or item.get('name')}: {error}")
+        if url:
+            # Each field on its own, to find the ones the factory rejects
+            invalid = [key for key in item if key not in ("url", "failed_sections")
+                       and not self._valid({"url": url, key: item[key]})]
+            for key in invalid:
+                logger.warning(f"Dropping invalid {key} of {url}: {item[key]!r}")
+                item[key] = None
+                if key not in item["failed_sections"]:
+                    item["failed_sections"].append(key)
+            self._inc("items/invalid_fields", len(invalid))
+            if self._valid(item):
+                return self.factory(item)
+        logger.error(f"Dropping item {url or item.get('name')}: {error}")
+        self._inc("items/invalid")
+        return None
+
+    def _valid(self, data):
+        try:
+            self.factory(data)
+        except ValueError:
+            return False
+        return True
+
+    def _inc(self, key, count=1):
+        if self.stats is not None and count:
+            self.stats.inc_value(key, count)
@@ -0,0 +1,411 @@
+import itertools
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+from twisted.internet import threads
+from twisted.python.threadpool import ThreadPool
+
+logger = logging.getLogger(__name__)
+
+
+# URL patterns for Network.setBlockedURLs, per resource type
+RESOURCE_TYPE_PATTERNS = {
+    "image": ["*.jpg*", "*.jpeg*", "*.png*", "*.gif*", "*.webp*", "*.svg*", "*.ico*", "*.avif*"],
+    "font": ["*.woff*", "*.ttf*", "*.otf*", "*.eot*"],
+    "media": ["*.mp4*", "*.webm*", "*.mp3*", "*.m3u8*"],
+    "stylesheet": ["*.css*"],
+}
+
+
+class ResourceBlocker:
+    """Keeps Chrome from downloading resources the extractors never look at.
+
+    Resource types and domains in the deny lists are blocked through CDP's
+    Network.setBlockedURLs; when an allow list of domains is given, every other
+    host fails to resolve. To report what blocking saves, one job in every
+    ``sample_every`` runs unblocked, and bytes (from the performance log) and
+    render time per page are compared between the two groups.
+    """
+
+    def __init__(self, types=(), blocked_domains=(), allowed_domains=(), sample_every=0, stats=None):
+        self.types = list(types)
+        self.blocked_domains = list(blocked_domains)
+        self.allowed_domains = list(allowed_domains)
+        self.sample_every = sample_every
+        self.stats = stats
+        self._jobs = itertools.count(1)
+        self._lock = threading.Lock()
+        # group -> [pages, bytes, seconds], for pages rendered with and without blocking
+        self._totals = {"blocked": [0, 0, 0.0], "unblocked": [0, 0, 0.0]}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool("BROWSER_BLOCK_RESOURCES", True):
+            return None
+        return cls(
+            types=settings.getlist("BROWSER_BLOCKED_RESOURCE_TYPES", ["image", "font", "media"]),
+            blocked_domains=settings.getlist("BROWSER_BLOCKED_DOMAINS"),
+            allowed_domains=settings.getlist("BROWSER_ALLOWED_DOMAINS"),
+            sample_every=settings.getint("BROWSER_BLOCK_SAMPLE_EVERY", 50),
+            stats=crawler.stats,
+        )
+
+    @property
+    def url_patterns(self):
+        patterns = []
+        for resource_type in self.types:
+            patterns.extend(RESOURCE_TYPE_PATTERNS.get(resource_type, []))
+        for domain in self.blocked_domains:
+            patterns.extend([f"*://{domain}/*", f"*://*.{domain}/*"])
+        return patterns
+
+    def chrome_arguments(self, proxy=None):
+        if not self.allowed_domains:
+            return []
+        if proxy:
+            # Through a proxy Chrome never resolves the hosts it talks to
+            logger.warning("BROWSER_ALLOWED_DOMAINS is ignored when the cache proxy is enabled")
+            return []
+        excludes = ", ".join(f"EXCLUDE {d}, EXCLUDE *.{d}" for d in self.allowed_domains)
+        return [f"--host-resolver-rules=MAP * ~NOTFOUND, {excludes}"]
+
+    def set_blocking(self, driver, enabled):
+        driver.execute_cdp_cmd("Network.enable", {})
+        driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": self.url_patterns if enabled else []})
+        driver.resource_blocking = enabled
+
+    def before_job(self, driver):
+        sample = self.sample_every and next(self._jobs) % self.sample_every == 0
+        if getattr(driver, "resource_blocking", None) != (not sample):
+            self.set_blocking(driver, not sample)
+        # Drop whatever the previous job left in the performance log
+        driver.get_log("performance")
+
+    def after_job(self, driver, seconds):
+        transferred, blocked_requests = 0, 0
+        for entry in driver.get_log("performance"):
+            message = json.loads(entry["message"])["message"]
+            if message["method"] == "Network.loadingFinished":
+                transferred += message["params"].get("encodedDataLength", 0)
+            elif message["method"] == "Network.loadingFailed" and message["params"].get("blockedReason"):
+                blocked_requests += 1
+
+        group = "blocked" if driver.resource_blocking else "unblocked"
+        with self._lock:
+            totals = self._totals[group]
+            totals[0] += 1
+            totals[1] += int(transferred)
+            totals[2] += seconds
+        if self.stats is not None:
+            self.stats.inc_value(f"browser/pages/{group}")
+            self.stats.inc_value(f"browser/bytes/{group}", int(transferred))
+            self.stats.inc_value("browser/blocked_requests", blocked_requests)
+
+    def report(self):
+        blocked, unblocked = self._totals["blocked"], self._totals["unblocked"]
+        if self.stats is None or not blocked[0] or not unblocked[0]:
+            return
+        bytes_saved = unblocked[1] / unblocked[0] - blocked[1] / blocked[0]
+        seconds_saved = unblocked[2] / unblocked[0] - blocked[2] / blocked[0]
+        self.stats.set_value("browser/bytes_saved_per_page", int(bytes_saved))
+        self.stats.set_value("browser/render_seconds_saved_per_page", round(seconds_saved, 3))
+
+
+def build_chrome_options(headless=True, proxy=None, extra_arguments=()):
+    from selenium.webdriver.chrome.options import Options
+
+    chrome_options = Options()
+    # driver.get() returns at DOMContentLoaded; section waits take it from there
+    chrome_options.page_load_strategy = "eager"
+    if headless:
+        chrome_options.add_argument("--headless=new")
+    chrome_options.add_argument("--disable-gpu")
+    chrome_options.add_argument("--no-sandbox")
+    if proxy:
+        # The caching proxy terminates TLS with its own self-signed certificate
+        chrome_options.add_argument(f"--proxy-server={proxy}")
+        chrome_options.add_argument("--ignore-certificate-errors")
+    for argument in extra_arguments:
+        chrome_options.add_argument(argument)
+    # Network events are read back to measure bytes transferred per page
+    chrome_options.set_capability("goog:loggingPrefs", {"performance": "ALL"})
+    return chrome_options
+
+
+class BrowserCrashed(Exception):
+    """The driver a job ran on stopped responding; it has been replaced."""
+
+
+def process_tree_rss(pid):
+    """Resident memory in bytes of process ``pid`` and all its descendants (Linux only; else None)."""
+    try:
+        parents = {}
+        for entry in os.listdir("/proc"):
+            if entry.isdigit():
+                try:
+                    with open(f"/proc/{entry}/stat") as f:
+                        # The command name may contain spaces; fields after it are fixed
+                        parents[int(entry)] = int(f.read().rsplit(")", 1)[1].split()[1])
+                except (OSError, IndexError, ValueError):
+                    continue
+    except OSError:
+        return None
+    tree, pending = set(), [pid]
+    while pending:
+        current = pending.pop()
+        tree.add(current)
+        pending.extend(child for child, parent in parents.items() if parent == current and child not in tree)
+    rss, page_size = 0, os.sysconf("SC_PAGE_SIZE")
+    for member in tree:
+        try:
+            with open(f"/proc/{member}/statm") as f:
+                rss += int(f.read().split()[1]) * page_size
+        except (OSError, IndexError, ValueError):
+            continue
+    return rss
+
+
+class DriverPool:
+    """Up to ``size`` Chrome drivers, each used by one worker thread at a time.
+
+    Rendering work is submitted with ``run()``, which executes the given function
+    on a dedicated thread pool (never on the Twisted reactor thread) with an idle
+    driver as its first argument, and returns a Deferred with the result.
+    Drivers (and Selenium itself) are only started when a job finds none idle,
+    so crawls that never render never launch Chrome; ``prewarm()`` starts some
+    ahead of time in the background.
+
+    A driver is quit, and replaced by the next job that needs one, after
+    ``max_pages`` jobs or once Chrome's processes use more than ``max_rss``
+    bytes (checked every ``rss_check_every`` jobs). When a job fails and the
+    driver no longer answers a trivial script, it is discarded the same way and
+    the job fails with BrowserCrashed.
+    """
+
+    def __init__(self, size=1, headless=True, proxy=None, init_scripts=(), blocker=None, stats=None,
+                 max_pages=0, max_rss=0, rss_check_every=20):
+        self.size = max(1, int(size))
+        self.headless = headless
+        self.proxy = proxy
+        self.init_scripts = list(init_scripts)
+        self.blocker = blocker
+        self.stats = stats
+        self.max_pages = max_pages
+        self.max_rss = max_rss
+        self.rss_check_every = max(1, rss_check_every)
+
+        self._idle = queue.Queue()
+        self._drivers = []
+        # Drivers started or being started; guarded by _lock
+        self._started = 0
+        self._lock = threading.Lock()
+        self._closed = False
+
+        # One thread per driver, so a job never waits on a driver after it got a thread
+        self._threadpool = ThreadPool(minthreads=0, maxthreads=self.size, name="browser")
+        self._threadpool.start()
+
+    @classmethod
+    def from_crawler(cls, crawler, proxy=None, init_scripts=()):
+        settings = crawler.settings
+        return cls(
+            size=settings.getint("BROWSER_POOL_SIZE", 1),
+            headless=settings.getbool("BROWSER_HEADLESS", True),
+            proxy=proxy,
+            init_scripts=init_scripts,
+            blocker=ResourceBlocker.from_crawler(crawler),
+            stats=crawler.stats,
+            max_pages=settings.getint("BROWSER_MAX_PAGES", 0),
+            max_rss=settings.getint("BROWSER_MAX_RSS_MB", 0) * 1024 * 1024,
+            rss_check_every=settings.getint("BROWSER_RSS_CHECK_EVERY", 20),
+        )
+
+    def _create_driver(self):
+        from selenium import webdriver
+
+        extra_arguments = self.blocker.chrome_arguments(self.proxy) if self.blocker else []
+        driver = webdriver.Chrome(options=build_chrome_options(self.headless, self.proxy, extra_arguments))
+        if not self.headless:
+            driver.maximize_window()
+        # Scripts that run in every new document before the page's own scripts
+        for source in self.init_scripts:
+            try:
+                driver.execute_cdp_cmd("Page.addScriptToEvaluateOnNewDocument", {"source": source})
+            except Exception as e:
+                logger.warning(f"Failed to register init script: {e}")
+        if self.blocker:
+            self.blocker.set_blocking(driver, True)
+        return driver
+
+    def _start_driver(self):
+        """Start one more driver if the pool isn't full; returns it, or None if it is full."""
+        with self._lock:
+            if self._started >= self.size:
+                return None
+            self._started += 1
+        start = time.monotonic()
+        try:
+            driver = self._create_driver()
+        except Exception:
+            with self._lock:
+                self._started -= 1
+            raise
+        driver.pages_rendered = 0
+        with self._lock:
+            self._drivers.append(driver)
+        seconds = time.monotonic() - start
+        logger.info(f"Started browser driver {len(self._drivers)}/{self.size} in {seconds:.1f}s.")
+        if self.stats is not None:
+            self.stats.inc_value("browser/drivers_started")
+            self.stats.max_value("browser/driver_startup_max", round(seconds, 3))
+        return driver
+
+    def _warm(self):
+        if self._closed:
+            return
+        try:
+            driver = self._start_driver()
+        except Exception as e:
+            logger.warning(f"Failed to pre-start browser driver: {e}")
+            return
+        if driver is not None:
+            self._idle.put(driver)
+
+    def prewarm(self, count=None):
+        """Start ``count`` drivers (default: all) on the pool's threads, without waiting for them."""
+        for _ in range(min(self.size, self.size if count is None else count)):
+            self._threadpool.callInThread(self._warm)
+
+    def _acquire(self):
+        while True:
+            try:
+                return self._idle.get_nowait()
+            except queue.Empty:
+                pass
+            driver = self._start_driver()
+            if driver is not None:
+                return driver
+            # All started and busy; one may also be retired (and its place freed) meanwhile
+            try:
+                return self._idle.get(timeout=1)
+            except queue.Empty:
+                if self._closed:
+                    raise RuntimeError("Browser pool is closed")
+
+    @contextmanager
+    def driver(self):
+        driver = self._acquire()
+        try:
+            yield driver
+        finally:
+            self._release(driver)
+
+    def _release(self, driver):
+        if getattr(driver, "crashed", False):
+            self._retire(driver, "crashed")
+            return
+        driver.pages_rendered += 1
+        if self.max_pages and driver.pages_rendered >= self.max_pages:
+            self._retire(driver, "pages")
+            return
+        if self.max_rss and driver.pages_rendered % self.rss_check_every == 0:
+            rss = self._rss(driver)
+            if rss is not None:
+                if self.stats is not None:
+                    self.stats.max_value("browser/max_rss_mb", rss // (1024 * 1024))
+                if rss > self.max_rss:
+                    self._retire(driver, "memory")
+                    return
+        self._idle.put(driver)
+
+    @staticmethod
+    def _rss(driver):
+        try:
+            return process_tree_rss(driver.service.process.pid)
+        except AttributeError:
+            return None
+
+    @staticmethod
+    def _alive(driver):
+        try:
+            driver.execute_script("return 1")
+        except Exception:
+            return False
+        return True
+
+    def _retire(self, driver, reason):
+        """Quit ``driver`` and free its place in the pool for a new one."""
+        logger.info(f"Retiring browser driver after {driver.pages_rendered} page(s) ({reason})")
+        with self._lock:
+            if driver in self._drivers:
+                self._drivers.remove(driver)
+                self._started -= 1
+        if self.stats is not None:
+            stat = "browser/crashes" if reason == "crashed" else f"browser/recycled/{reason}"
+            self.stats.inc_value(stat)
+        try:
+            driver.quit()
+        except Exception as e:
+            logger.debug(f"Failed to quit browser driver: {e}")
+
+    def _run_with_driver(self, func, *args, **kwargs):
+        with self.driver() as driver:
+            try:
+                return self._run_job(driver, func, *args, **kwargs)
+            except Exception as e:
+                if self._alive(driver):
+                    raise
+                driver.crashed = True
+                raise BrowserCrashed(f"Browser driver stopped responding: {e!r}") from e
+
+    def _run_job(self, driver, func, *args, **kwargs):
+        if self.blocker is None:
+            return func(driver, *args, **kwargs)
+
+        self.blocker.before_job(driver)
+        start = time.monotonic()
+        try:
+            return func(driver, *args, **kwargs)
+        finally:
+            try:
+                self.blocker.after_job(driver, time.monotonic() - start)
+            except Exception as e:
+                logger.debug(f"Failed to measure resource blocking: {e}")
+
+    def run(self, func, *args, **kwargs):
+        """Call ``func(driver, *args, **kwargs)`` on a worker thread; returns a Deferred."""
+        # Imported here so that importing this module never installs a reactor
+        from twisted.internet import reactor
+
+        return threads.deferToThreadPool(
+            reactor, self._threadpool, self._run_with_driver, func, *args, **kwargs)
+
+    def set_limit(self, limit):
+        """Render with at most ``limit`` drivers at a time (between 1 and the pool size)."""
+        limit = min(self.size, max(1, int(limit)))
+        if limit != self._threadpool.max:
+            self._threadpool.adjustPoolsize(minthreads=0, maxthreads=limit)
+
+    def close(self):
+        """Stop the workers and quit the drivers off the reactor thread; returns a Deferred."""
+        self._closed = True
+        d = threads.deferToThread(self._shutdown)
+        if self.blocker:
+            d.addCallback(lambda _: self.blocker.report())
+        return d
+
+    def _shutdown(self):
+        # Joins the worker threads, which may be mid-render or quitting a driver
+        self._threadpool.stop()
+        for driver in self._drivers:
+            try:
+                driver.quit()
+            except Exception as e:
+                logger.warning(f"Failed to quit browser driver: {e}")
+        self._drivers = []
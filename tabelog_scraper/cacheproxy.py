@@ -0,0 +1,210 @@
+import datetime
+import http.client
+import logging
+import os
+import ssl
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+from scrapy import Request
+from scrapy.downloadermiddlewares.httpcache import HttpCacheMiddleware
+from scrapy.exceptions import NotConfigured
+from scrapy.http import Headers
+from scrapy.responsetypes import responsetypes
+
+logger = logging.getLogger(__name__)
+
+# Headers that only apply to a single connection and must not be forwarded
+HOP_BY_HOP_HEADERS = {
+    "connection", "keep-alive", "proxy-authenticate", "proxy-authorization",
+    "proxy-connection", "te", "trailers", "transfer-encoding", "upgrade",
+}
+
+
+def _self_signed_certificate(directory):
+    # Chrome is started with --ignore-certificate-errors, so one throwaway
+    # certificate is enough to terminate TLS for every host it tunnels to
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    from cryptography.x509.oid import NameOID
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "tabelog-scraper cache proxy")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(days=1))
+        .not_valid_after(now + datetime.timedelta(days=365))
+        .sign(key, hashes.SHA256())
+    )
+
+    certfile = os.path.join(directory, "proxy-cert.pem")
+    keyfile = os.path.join(directory, "proxy-key.pem")
+    with open(certfile, "wb") as f:
+        f.write(cert.public_bytes(serialization.Encoding.PEM))
+    with open(keyfile, "wb") as f:
+        f.write(key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.TraditionalOpenSSL,
+            serialization.NoEncryption(),
+        ))
+    return certfile, keyfile
+
+
+class _ProxyHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    origin = None  # scheme://host[:port] of a CONNECT tunnel, once TLS is terminated
+
+    def do_CONNECT(self):
+        host, _, port = self.path.partition(":")
+        self.send_response(200, "Connection Established")
+        self.end_headers()
+
+        tls = self.server.ssl_context.wrap_socket(self.connection, server_side=True)
+        self.connection = tls
+        self.rfile = tls.makefile("rb", self.rbufsize)
+        self.wfile = tls.makefile("wb", 0)
+        self.origin = f"https://{host}" if port in ("", "443") else f"https://{host}:{port}"
+        # The requests inside the tunnel are read by the handle() loop as usual
+        self.close_connection = False
+
+    def _proxy_request(self):
+        url = self.path if self.origin is None else self.origin + self.path
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        headers = [(k, v) for k, v in self.headers.items() if k.lower() not in HOP_BY_HOP_HEADERS]
+
+        status, headers, body = self.server.proxy.fetch(self.command, url, headers, body)
+
+        self.send_response(status)
+        for name, value in headers:
+            if name.lower() not in HOP_BY_HOP_HEADERS and name.lower() != "content-length":
+                self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    do_GET = do_POST = do_HEAD = do_PUT = do_DELETE = do_OPTIONS = do_PATCH = _proxy_request
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+
+class CachingProxy:
+    """Local HTTP(S) proxy that serves Chrome's traffic from Scrapy's HTTP cache.
+
+    Responses are looked up and stored with the storage and policy of the
+    crawl's HttpCacheMiddleware, so they share ``HTTPCACHE_DIR``, its size
+    limit and its expiration rules with Scrapy's own downloads (a page Scrapy
+    already fetched is a cache hit for the browser too). The middleware opens
+    and closes the storage. HTTPS is intercepted with a self-signed
+    certificate. Hits and misses are counted in the crawl stats under
+    ``browser_cache/``.
+    """
+
+    def __init__(self, storage, policy, settings, stats, timeout=30):
+        self.storage = storage
+        self.policy = policy
+        self.ignore_schemes = settings.getlist("HTTPCACHE_IGNORE_SCHEMES")
+        self.stats = stats
+        self.timeout = timeout
+        self.spider = None
+        self._server = None
+        self._tmpdir = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        # One storage per cache file: a second one would keep its own lock and size count
+        middleware = next((middleware for middleware in crawler.engine.downloader.middleware.middlewares
+                           if isinstance(middleware, HttpCacheMiddleware)), None)
+        if middleware is None:
+            raise NotConfigured("HttpCacheMiddleware is not enabled")
+        return cls(middleware.storage, middleware.policy, crawler.settings, crawler.stats,
+                   timeout=crawler.settings.getfloat("DOWNLOAD_TIMEOUT", 30))
+
+    @property
+    def address(self):
+        host, port = self._server.server_address[:2]
+        return f"{host}:{port}"
+
+    def start(self, spider):
+        self.spider = spider
+
+        self._tmpdir = tempfile.TemporaryDirectory(prefix="tabelog-proxy-")
+        ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        ssl_context.load_cert_chain(*_self_signed_certificate(self._tmpdir.name))
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), _ProxyHandler)
+        self._server.daemon_threads = True
+        self._server.proxy = self
+        self._server.ssl_context = ssl_context
+        threading.Thread(target=self._server.serve_forever, name="cache-proxy", daemon=True).start()
+        logger.info(f"Browser cache proxy listening on {self.address}")
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        if self._tmpdir is not None:
+            self._tmpdir.cleanup()
+            self._tmpdir = None
+
+    def fetch(self, method, url, headers, body):
+        request = Request(url, method=method, headers=headers, body=body)
+        cacheable = (urlsplit(url).scheme not in self.ignore_schemes
+                     and self.policy.should_cache_request(request))
+
+        if cacheable:
+            cached = self.storage.retrieve_response(self.spider, request)
+            if cached is not None and self.policy.is_cached_response_fresh(cached, request):
+                self.stats.inc_value("browser_cache/hit", spider=self.spider)
+                return cached.status, self._header_items(cached.headers), cached.body
+            self.stats.inc_value("browser_cache/miss", spider=self.spider)
+        else:
+            self.stats.inc_value("browser_cache/uncacheable", spider=self.spider)
+
+        try:
+            status, response_headers, response_body = self._fetch_upstream(method, url, headers, body)
+        except Exception as e:
+            logger.warning(f"Cache proxy failed to fetch {url}: {e}")
+            self.stats.inc_value("browser_cache/error", spider=self.spider)
+            return 502, [("Content-Type", "text/plain")], str(e).encode()
+
+        if cacheable:
+            scrapy_headers = Headers(response_headers)
+            respcls = responsetypes.from_args(headers=scrapy_headers, url=url, body=response_body)
+            response = respcls(url=url, status=status, headers=scrapy_headers,
+                               body=response_body, request=request)
+            if self.policy.should_cache_response(response, request):
+                self.storage.store_response(self.spider, request, response)
+                self.stats.inc_value("browser_cache/store", spider=self.spider)
+
+        return status, response_headers, response_body
+
+    def _fetch_upstream(self, method, url, headers, body):
+        parts = urlsplit(url)
+        connection_cls = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+        connection = connection_cls(parts.netloc, timeout=self.timeout)
+        try:
+            path = parts.path or "/"
+            if parts.query:
+                path += "?" + parts.query
+            connection.request(method, path, body=body or None, headers=dict(headers))
+            response = connection.getresponse()
+            return response.status, response.getheaders(), response.read()
+        finally:
+            connection.close()
+
+    @staticmethod
+    def _header_items(headers):
+        return [(name.decode("latin-1"), value.decode("latin-1"))
+                for name, values in headers.items() for value in values]
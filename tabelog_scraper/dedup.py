@@ -0,0 +1,115 @@
+import os
+import time
+from array import array
+from bisect import bisect_left
+from itertools import chain
+from pathlib import Path
+
+from scrapy.utils.job import job_dir
+
+
+class RestaurantIdSet:
+    """Set of Tabelog restaurant IDs stored as a sorted array of 64-bit integers.
+
+    Eight bytes per ID, so millions of restaurants fit in a few megabytes and
+    load from disk with a single read. New IDs go to a small buffer that is
+    merged into the sorted array once it grows past an eighth of it, which
+    keeps inserts amortized O(log n). With a ``path`` the set is loaded from and
+    saved to that file. With ``max_age`` (seconds) each ID also keeps when it
+    was added, in ``<path>.added``, and drops out of the set once it's older.
+    """
+
+    def __init__(self, path=None, min_buffer=4096, shared=False, max_age=0):
+        self.path = path
+        self.shared = shared
+        self.min_buffer = min_buffer
+        self.max_age = max_age
+        self._ids = array("Q")
+        # When each ID was added (Unix seconds), only with max_age
+        self._added = array("I")
+        # ID -> when it was added
+        self._buffer = {}
+        if path and os.path.exists(path):
+            with open(path, "rb") as f:
+                self._ids.frombytes(f.read())
+            if max_age:
+                self._load_added(path + ".added", int(os.path.getmtime(path)))
+
+    @classmethod
+    def from_settings(cls, settings, name):
+        # Kept for the whole job (so a resumed crawl doesn't repeat itself), or
+        # in DEDUP_DIR to share it between jobs, for DEDUP_MAX_AGE seconds
+        shared = bool(settings.get("DEDUP_DIR"))
+        directory = settings.get("DEDUP_DIR") or job_dir(settings)
+        return cls(str(Path(directory, f"{name}.ids")) if directory else None, shared=shared,
+                   max_age=settings.getint("DEDUP_MAX_AGE", 0) if shared else 0)
+
+    def _load_added(self, path, default):
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                self._added.frombytes(f.read())
+        if len(self._added) != len(self._ids):
+            # Saved without ages: count them from when the file was written
+            self._added = array("I", [default]) * len(self._ids)
+
+    def __len__(self):
+        return len(self._ids) + len(self._buffer)
+
+    def _fresh(self, added):
+        return not self.max_age or added >= time.time() - self.max_age
+
+    def __contains__(self, restaurant_id):
+        number = int(restaurant_id)
+        if number in self._buffer:
+            return self._fresh(self._buffer[number])
+        index = bisect_left(self._ids, number)
+        if index < len(self._ids) and self._ids[index] == number:
+            return not self.max_age or self._fresh(self._added[index])
+        return False
+
+    def add(self, restaurant_id):
+        """Add an ID; returns False if it was already in the set."""
+        if restaurant_id in self:
+            return False
+        self._buffer[int(restaurant_id)] = int(time.time())
+        if len(self._buffer) >= max(self.min_buffer, len(self._ids) // 8):
+            self._merge()
+        return True
+
+    def _merge(self):
+        # The array and the buffer (sorted here) are two sorted runs, which Timsort merges in linear time
+        if not self.max_age:
+            self._ids = array("Q", sorted(chain(self._ids, sorted(self._buffer))))
+        else:
+            # An ID re-added after it expired is in both; the later (larger) time wins.
+            # dict keeps the IDs in their sorted order
+            latest = dict(sorted(chain(zip(self._ids, self._added), sorted(self._buffer.items()))))
+            cutoff = time.time() - self.max_age
+            self._ids = array("Q", (number for number, added in latest.items() if added >= cutoff))
+            self._added = array("I", (added for added in latest.values() if added >= cutoff))
+        self._buffer = {}
+
+    def save(self):
+        if not self.path:
+            return
+        self._merge()
+        self._write(self.path, self._ids)
+        if self.max_age:
+            self._write(self.path + ".added", self._added)
+
+    @staticmethod
+    def _write(path, values):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(values.tobytes())
+        os.replace(tmp_path, path)
+
+    def close(self, reason):
+        """Save the set, or drop it once the job it belongs to has finished."""
+        if reason == "finished" and not self.shared:
+            for path in (self.path, self.path and self.path + ".added"):
+                if path and os.path.exists(path):
+                    os.remove(path)
+            return
+        self.save()
@@ -0,0 +1,228 @@
+# Streaming export of restaurant items.
+#
+# Every item is appended to a JSON Lines shard as it arrives, and split into
+# flat tables (restaurants, menu_items, rating_distribution, photos,
+# info_rows and media, all keyed by restaurant_id) that are written to Parquet in
+# bounded batches. Shards rotate after a number of items or bytes; shard N of
+# the JSON Lines files and part N of every table cover the same restaurants.
+#
+#   <dir>/jsonl/part-00000.jsonl
+#   <dir>/parquet/<table>/part-00000.parquet
+import json
+import logging
+from pathlib import Path
+
+from itemadapter import ItemAdapter
+
+from tabelog_scraper.utils import restaurant_id
+
+logger = logging.getLogger(__name__)
+
+TABLES = ("restaurants", "menu_items", "rating_distribution", "photos", "info_rows", "media")
+
+
+def normalize(item):
+    """Split one nested restaurant item into rows of the flat export tables."""
+    data = ItemAdapter(item).asdict()
+    url = data.get("url")
+    rid = restaurant_id(url) if url else None
+    overview = data.get("editorial_overview") or {}
+    review_rating = data.get("review_rating") or {}
+
+    tables = {table: [] for table in TABLES}
+    tables["restaurants"].append({
+        "restaurant_id": rid,
+        "url": url,
+        "name": data.get("name"),
+        "area": data.get("area"),
+        "genre": data.get("genre"),
+        "rating": data.get("rating"),
+        "review_count": data.get("review_count"),
+        "headline": overview.get("headline"),
+        "description": overview.get("description"),
+        "average_ratings": list((review_rating.get("average_ratings") or {}).items()),
+        "failed_sections": list(data.get("failed_sections") or []),
+    })
+    for menu, entries in (data.get("menu") or {}).items():
+        for entry in entries:
+            tables["menu_items"].append({
+                "restaurant_id": rid,
+                "menu": menu,
+                "title": entry.get("title"),
+                "price": entry.get("price"),
+                "description": entry.get("description"),
+                "image_src": entry.get("image_src"),
+                "link": entry.get("link"),
+                "available_time": entry.get("available_time"),
+            })
+    for bucket in review_rating.get("rating_distribution") or []:
+        tables["rating_distribution"].append({
+            "restaurant_id": rid,
+            "range": bucket.get("range"),
+            "percentage": bucket.get("percentage"),
+            "people": bucket.get("people"),
+        })
+    for speciality in data.get("specialities") or []:
+        tables["photos"].append({
+            "restaurant_id": rid,
+            "kind": "speciality",
+            "src": speciality.get("image_src"),
+            "title": speciality.get("title"),
+            "comment": speciality.get("comment"),
+            "label": speciality.get("label"),
+        })
+    for src in data.get("interior_photos") or []:
+        tables["photos"].append({
+            "restaurant_id": rid, "kind": "interior", "src": src,
+            "title": None, "comment": None, "label": None,
+        })
+    for section, rows in (data.get("restaurant_information") or {}).items():
+        for row in rows:
+            tables["info_rows"].append({
+                "restaurant_id": rid,
+                "section": section,
+                "field": row.get("field"),
+                "value": row.get("value"),
+            })
+    for media in data.get("media") or []:
+        tables["media"].append({
+            "restaurant_id": rid,
+            "url": media.get("url"),
+            "sha256": media.get("sha256"),
+            "path": media.get("path"),
+            "thumbnail": media.get("thumbnail"),
+        })
+    return tables
+
+
+def parquet_schemas(pa):
+    string, integer, double = pa.string(), pa.int64(), pa.float64()
+    return {
+        "restaurants": pa.schema([
+            ("restaurant_id", string), ("url", string), ("name", string), ("area", string),
+            ("genre", string), ("rating", double), ("review_count", integer),
+            ("headline", string), ("description", string),
+            ("average_ratings", pa.map_(string, double)),
+            ("failed_sections", pa.list_(string)),
+        ]),
+        "menu_items": pa.schema([
+            ("restaurant_id", string), ("menu", string), ("title", string), ("price", integer),
+            ("description", string), ("image_src", string), ("link", string),
+            ("available_time", string),
+        ]),
+        "rating_distribution": pa.schema([
+            ("restaurant_id", string), ("range", string), ("percentage", integer), ("people", integer),
+        ]),
+        "photos": pa.schema([
+            ("restaurant_id", string), ("kind", string), ("src", string), ("title", string),
+            ("comment", string), ("label", string),
+        ]),
+        "info_rows": pa.schema([
+            ("restaurant_id", string), ("section", string), ("field", string), ("value", string),
+        ]),
+        "media": pa.schema([
+            ("restaurant_id", string), ("url", string), ("sha256", string), ("path", string),
+            ("thumbnail", string),
+        ]),
+    }
+
+
+class ParquetTables:
+    """Buffers table rows and writes them to the current part as row groups of ``batch_size``."""
+
+    def __init__(self, directory, batch_size=5000):
+        import pyarrow
+        import pyarrow.parquet
+
+        self.pa = pyarrow
+        self.pq = pyarrow.parquet
+        self.directory = Path(directory)
+        self.batch_size = batch_size
+        self.schemas = parquet_schemas(pyarrow)
+        self._rows = {table: [] for table in TABLES}
+        self._writers = {}
+        self._part = 0
+
+    def add(self, tables):
+        for table, rows in tables.items():
+            self._rows[table].extend(rows)
+            if len(self._rows[table]) >= self.batch_size:
+                self._flush(table)
+
+    def _flush(self, table):
+        rows, self._rows[table] = self._rows[table], []
+        if not rows:
+            return
+        writer = self._writers.get(table)
+        if writer is None:
+            path = self.directory / table / f"part-{self._part:05d}.parquet"
+            path.parent.mkdir(parents=True, exist_ok=True)
+            writer = self._writers[table] = self.pq.ParquetWriter(
+                str(path), self.schemas[table], compression="zstd")
+        writer.write_table(self.pa.Table.from_pylist(rows, schema=self.schemas[table]))
+
+    def rotate(self, part):
+        self.close()
+        self._part = part
+
+    def close(self):
+        for table in TABLES:
+            self._flush(table)
+        for writer in self._writers.values():
+            writer.close()
+        self._writers = {}
+
+
+class ShardedExporter:
+    """Streams items to rotating JSON Lines shards and, with pyarrow installed, Parquet tables."""
+
+    def __init__(self, directory, max_items=10000, max_bytes=64 * 1024 * 1024,
+                 parquet=True, parquet_batch_size=5000):
+        self.directory = Path(directory)
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.shard = 0
+        self.rows = {table: 0 for table in TABLES}
+        self._file = None
+        self._items = self._bytes = 0
+
+        self.tables = None
+        if parquet:
+            try:
+                self.tables = ParquetTables(self.directory / "parquet", parquet_batch_size)
+            except ImportError:
+                logger.warning("pyarrow is not installed; exporting JSON Lines only")
+
+    def write(self, item):
+        if self._file is not None and (self._items >= self.max_items or self._bytes >= self.max_bytes):
+            self._rotate()
+        if self._file is None:
+            path = self.directory / "jsonl" / f"part-{self.shard:05d}.jsonl"
+            path.parent.mkdir(parents=True, exist_ok=True)
+            self._file = open(path, "wb")
+
+        line = json.dumps(ItemAdapter(item).asdict(), ensure_ascii=False).encode() + b"\n"
+        self._file.write(line)
+        self._items += 1
+        self._bytes += len(line)
+
+        tables = normalize(item)
+        for table, rows in tables.items():
+            self.rows[table] += len(rows)
+        if self.tables is not None:
+            self.tables.add(tables)
+
+    def _rotate(self):
+        self._file.close()
+        self._file = None
+        self._items = self._bytes = 0
+        self.shard += 1
+        if self.tables is not None:
+            self.tables.rotate(self.shard)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self.tables is not None:
+            self.tables.close()
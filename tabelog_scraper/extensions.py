@@ -0,0 +1,131 @@
+# Define here your Scrapy extensions
+#
+# See documentation in:
+# https://docs.scrapy.org/en/latest/topics/extensions.html
+import logging
+import os
+import pickle
+import random
+from collections import defaultdict
+from pathlib import Path
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from scrapy.utils.job import job_dir
+from twisted.internet import task
+
+from tabelog_scraper.signals import stage_timed
+
+logger = logging.getLogger(__name__)
+
+
+class SpiderStateCheckpoint:
+    """Writes ``spider.state`` to JOBDIR every CHECKPOINT_INTERVAL seconds.
+
+    Scrapy's SpiderState extension only saves the state on a clean shutdown;
+    this writes the same ``spider.state`` file while the crawl runs, so a job
+    that crashes or is killed restarts from its last checkpoint. Spiders may
+    define ``update_state()`` to copy their counters into the state first.
+    """
+
+    def __init__(self, jobdir, interval):
+        self.jobdir = jobdir
+        self.interval = interval
+        self.task = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        jobdir = job_dir(crawler.settings)
+        interval = crawler.settings.getfloat("CHECKPOINT_INTERVAL", 30)
+        if not jobdir or not interval:
+            raise NotConfigured
+
+        obj = cls(jobdir, interval)
+        crawler.signals.connect(obj.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(obj.spider_closed, signal=signals.spider_closed)
+        return obj
+
+    @property
+    def statefn(self):
+        return str(Path(self.jobdir, "spider.state"))
+
+    def spider_opened(self, spider):
+        self.task = task.LoopingCall(self.save, spider)
+        self.task.start(self.interval, now=False)
+
+    def spider_closed(self, spider):
+        # The final state is written by SpiderState
+        if self.task and self.task.running:
+            self.task.stop()
+
+    def save(self, spider):
+        if hasattr(spider, "update_state"):
+            spider.update_state()
+        tmpfn = self.statefn + ".tmp"
+        with open(tmpfn, "wb") as f:
+            pickle.dump(spider.state, f, protocol=4)
+        # Atomic, so a crash mid-write leaves the previous checkpoint intact
+        os.replace(tmpfn, self.statefn)
+        logger.debug(f"Checkpointed spider state to {self.statefn}")
+
+
+class StageLatencyStats:
+    """Latency histogram of every scraping stage the spider reports with ``stage_timed``.
+
+    At close, ``stages/<stage>/p50``, ``/p95``, ``/max`` and ``/count`` (seconds)
+    are set in the crawl stats and logged as a table, slowest stage first.
+    Percentiles are computed over a uniform sample of at most
+    STAGE_STATS_SAMPLES timings per stage.
+    """
+
+    def __init__(self, stats, max_samples=10000):
+        self.stats = stats
+        self.max_samples = max_samples
+        self.samples = defaultdict(list)
+        self.counts = defaultdict(int)
+        self.maxima = defaultdict(float)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool("STAGE_STATS_ENABLED", True):
+            raise NotConfigured
+        obj = cls(crawler.stats, crawler.settings.getint("STAGE_STATS_SAMPLES", 10000))
+        crawler.signals.connect(obj.stage_timed, signal=stage_timed)
+        crawler.signals.connect(obj.spider_closed, signal=signals.spider_closed)
+        return obj
+
+    def stage_timed(self, stage, seconds):
+        self.counts[stage] += 1
+        self.maxima[stage] = max(self.maxima[stage], seconds)
+        samples = self.samples[stage]
+        if len(samples) < self.max_samples:
+            samples.append(seconds)
+        else:
+            # Reservoir sampling keeps every timing equally likely to be in the sample
+            index = random.randrange(self.counts[stage])
+            if index < self.max_samples:
+                samples[index] = seconds
+
+    @staticmethod
+    def percentile(samples, percent):
+        return samples[min(len(samples) - 1, int(len(samples) * percent / 100))]
+
+    def spider_closed(self, spider):
+        rows = []
+        for stage, samples in self.samples.items():
+            samples = sorted(samples)
+            p50, p95 = self.percentile(samples, 50), self.percentile(samples, 95)
+            rows.append((stage, self.counts[stage], p50, p95, self.maxima[stage]))
+            self.stats.set_value(f"stages/{stage}/count", self.counts[stage], spider=spider)
+            self.stats.set_value(f"stages/{stage}/p50", round(p50, 3), spider=spider)
+            self.stats.set_value(f"stages/{stage}/p95", round(p95, 3), spider=spider)
+            self.stats.set_value(f"stages/{stage}/max", round(self.maxima[stage], 3), spider=spider)
+        if not rows:
+            return
+
+        rows.sort(key=lambda row: row[3], reverse=True)
+        width = max(len(row[0]) for row in rows)
+        lines = [f"{'stage':<{width}}  {'count':>7}  {'p50':>7}  {'p95':>7}  {'max':>7}"]
+        lines += [f"{stage:<{width}}  {count:>7}  {p50:>7.3f}  {p95:>7.3f}  {maximum:>7.3f}"
+                  for stage, count, p50, p95, maximum in rows]
+        logger.info("Stage latencies (seconds):\n" + "\n".join(lines))
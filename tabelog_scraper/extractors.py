@@ -0,0 +1,141 @@
+# Parsel extractors for the server-rendered parts of Tabelog pages.
+#
+# They work on a plain Scrapy response. Section extractors return None when the
+# markup they need is not in the document, so the spider knows to render the page
+# in a browser and try again; an empty list/dict means the section is genuinely
+# empty. The sections are declared in specs.py, which also compiles them into the
+# equivalent browser-side extractor.
+import re
+
+from tabelog_scraper.specs import SECTIONS, finish
+
+
+def _clean(text):
+    # Same normalisation as the browser-side `clean()` applied to textContent
+    if text is None:
+        return None
+    return re.sub(r"\s+", " ", text).strip() or None
+
+
+def _value(selector, spec_field):
+    if spec_field.attr:
+        value = selector.attrib.get(spec_field.attr)
+        value = value.strip() or None if value is not None else None
+    else:
+        value = _clean("".join(selector.xpath(".//text()").getall()))
+    if value is not None and spec_field.strip:
+        value = value.replace(spec_field.strip, "", 1)
+    if value is not None and spec_field.regex:
+        match = re.search(spec_field.regex, value)
+        value = (match.group(1) if match.groups() else match.group(0)) if match else None
+    if value is not None and spec_field.type:
+        try:
+            value = {"int": int, "float": float}[spec_field.type](value.replace(",", ""))
+        except ValueError:
+            value = None
+    return value
+
+
+def _field(record, spec_field):
+    scope = record
+    if spec_field.sibling:
+        siblings = record.xpath("following-sibling::*[1]")
+        scope = siblings[0] if siblings else None
+    if scope is None:
+        return [] if spec_field.many or spec_field.children else None
+    if spec_field.children:
+        return _records(scope, spec_field.children)
+    elements = scope.css(spec_field.selector) if spec_field.selector else [scope]
+    if spec_field.many:
+        return [v for v in (_value(el, spec_field) for el in elements) if v is not None]
+    return _value(elements[0], spec_field) if elements else None
+
+
+def _records(scope, spec):
+    if spec.heading:
+        heading_selector, heading_text = spec.heading
+        headings = [h for h in scope.css(heading_selector)
+                    if _clean("".join(h.xpath(".//text()").getall())) == heading_text]
+        scope = headings[0].xpath("following-sibling::*[1]") if headings else None
+        if not scope:
+            return []
+        scope = scope[0]
+
+    records = [{f.name: _field(el, f) for f in spec.fields} for el in scope.css(spec.root)]
+    if spec.required:
+        records = [r for r in records if r[spec.required] is not None]
+    if spec.flatten:
+        records = [r[spec.flatten] for r in records]
+    return records
+
+
+def extract_raw(response, spec):
+    if not response.css(spec.container or spec.root):
+        if spec.empty_if and response.css(spec.empty_if):
+            return []
+        if spec.empty_unless and not response.css(spec.empty_unless):
+            return []
+        return None
+    records = _records(response, spec)
+    return (records[0] if records else None) if spec.single else records
+
+
+def extract_section(response, name):
+    """Extract one section declared in specs.SECTIONS, or None if its markup is missing."""
+    return finish(name, extract_raw(response, SECTIONS[name]))
+
+
+def extract_headline_description(response):
+    # Extract the visible part of the description
+    visible_description = response.css('span.pr-comment__first::text').get()
+
+    # Extract hidden part of the description
+    hidden_description = response.css('span.pr-comment__over::text').get()
+
+    # Combine both parts into a meaningful full description
+    if visible_description and hidden_description:
+        full_description = visible_description.strip() + hidden_description.strip()
+    elif visible_description:
+        full_description = visible_description.strip()
+    else:
+        full_description = None
+
+    headline = response.css('h3.pr-comment-title.js-pr-title::text').get()
+    if headline:
+        headline = headline.strip()
+
+    return headline, full_description
+
+
+def extract_menu_tabs(response):
+    # Sub-tabs of the Menu page, with the item count Tabelog shows next to each
+    menu_tabs = {
+        "Set_Menu": "li.rstdtl-navi__sublist-item a[href*='/party/']",
+        "Food": "li.rstdtl-navi__sublist-item a[href*='/dtlmenu/']",
+        "Drink": "li.rstdtl-navi__sublist-item a[href*='/dtlmenu/drink/']",
+        "Lunch": "li.rstdtl-navi__sublist-item a[href*='/dtlmenu/lunch/']",
+    }
+    tabs = {}
+    for tab_name, tab_selector in menu_tabs.items():
+        tab_link = response.css(tab_selector)
+        href = tab_link.attrib.get('href') if tab_link else None
+        if not href:
+            continue
+        count = tab_link[0].css('.rstdtl-navi__sublist-item-count em::text').get()
+        count = int(count.strip()) if count and count.strip().isdigit() else None
+        tabs[tab_name] = (response.urljoin(href), count)
+    return tabs
+
+
+def extract_listing_pagination(response):
+    """(total results, results per page, last page linked) of a listing page; None where not shown."""
+    # "1 - 20 of 1,234"
+    numbers = [int(n.replace(",", "")) for n in response.css(".c-page-count__num strong::text").getall()
+               if n.replace(",", "").strip().isdigit()]
+    total = per_page = None
+    if len(numbers) == 3:
+        first, last, total = numbers
+        per_page = last - first + 1 if last >= first else None
+    pages = [int(n) for n in response.css("a.c-pagination__num::text, span.c-pagination__num::text").getall()
+             if n.strip().isdigit()]
+    return total, per_page, max(pages) if pages else None
@@ -0,0 +1,301 @@
+# Shared crawl frontier for running several workers on one crawl.
+#
+# Listing and detail requests (those with meta['frontier']) go to a SQLite
+# table shared by every worker instead of the worker's own queue. Workers
+# lease batches of them, optionally only from their own prefectures, and
+# acknowledge each one once it has been downloaded, or for detail pages
+# (meta['frontier'] == 'item') once the restaurant's item is done. Workers
+# renew their leases while they work on them; a lease that isn't renewed for
+# FRONTIER_LEASE_SECONDS (the worker died or hung) expires and the request
+# goes to the next worker that asks. A detail page whose download fails is
+# marked failed rather than handed out again. Sub-page requests stay in
+# the worker's local queue, since the partial item they complete lives in
+# that worker's memory.
+#
+#   scrapy crawl restaurants -a prefectures=13,14 \
+#       -s SCHEDULER=tabelog_scraper.frontier.FrontierScheduler \
+#       -s FRONTIER_PATH=/mnt/shared/tabelog-frontier.sqlite
+#
+#   python -m tabelog_scraper.frontier /mnt/shared/tabelog-frontier.sqlite
+import argparse
+import logging
+import os
+import pickle
+import socket
+import sqlite3
+import time
+from pathlib import Path
+
+from scrapy import signals
+from scrapy.utils.request import request_from_dict
+from twisted.internet import task
+
+from tabelog_scraper.scheduler import BoundedScheduler
+from tabelog_scraper.signals import frontier_request_done
+from tabelog_scraper.utils import area_codes
+
+logger = logging.getLogger(__name__)
+
+QUEUED, LEASED, DONE, FAILED = "queued", "leased", "done", "failed"
+
+
+class Frontier:
+    """Requests shared between workers, leased out in batches and partitioned by prefecture and area.
+
+    Every request is stored once per fingerprint, so a page found by two
+    workers is only crawled once. ``lease`` hands out queued requests and
+    requests whose lease expired, highest priority first and grouped by
+    area; a request leased ``max_attempts`` times without being acknowledged
+    is marked failed instead of being handed out again.
+    """
+
+    def __init__(self, path, lease_seconds=600, max_attempts=3):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        # Autocommit; leases take the write lock up front with BEGIN IMMEDIATE.
+        # The rollback journal rather than WAL, which doesn't work over network filesystems
+        self.db = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS requests ("
+            " id INTEGER PRIMARY KEY,"
+            " fingerprint TEXT UNIQUE,"
+            " prefecture TEXT,"
+            " area TEXT,"
+            " priority INTEGER,"
+            " data BLOB,"
+            " state TEXT,"
+            " lease_owner TEXT,"
+            " lease_expires REAL,"
+            " attempts INTEGER DEFAULT 0,"
+            " created REAL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS requests_state ON requests (state, prefecture, priority)")
+
+    def push(self, fingerprint, url, priority, data):
+        """Add a request; returns False if one with the same fingerprint was added before."""
+        prefecture, area = area_codes(url)
+        cursor = self.db.execute(
+            "INSERT OR IGNORE INTO requests (fingerprint, prefecture, area, priority, data, state, created)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (fingerprint, prefecture, area, priority, pickle.dumps(data, protocol=4), QUEUED, time.time()))
+        return cursor.rowcount > 0
+
+    def lease(self, worker, n, prefectures=()):
+        """Lease up to ``n`` requests to ``worker``; returns (id, request dict, attempt) tuples."""
+        now = time.time()
+        where = "(state = ? OR (state = ? AND lease_expires < ?))"
+        params = [QUEUED, LEASED, now]
+        if prefectures:
+            where += f" AND prefecture IN ({', '.join('?' * len(prefectures))})"
+            params += list(prefectures)
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            # Requests leased too often without an acknowledgement keep killing workers
+            self.db.execute(
+                f"UPDATE requests SET state = ?, lease_owner = NULL WHERE {where} AND attempts >= ?",
+                [FAILED, *params, self.max_attempts])
+            rows = self.db.execute(
+                f"SELECT id, data, attempts FROM requests WHERE {where}"
+                " ORDER BY priority DESC, prefecture, area, id LIMIT ?", [*params, n]).fetchall()
+            self.db.executemany(
+                "UPDATE requests SET state = ?, lease_owner = ?, lease_expires = ?, attempts = attempts + 1"
+                " WHERE id = ?", [(LEASED, worker, now + self.lease_seconds, row[0]) for row in rows])
+            self.db.execute("COMMIT")
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+        return [(id_, pickle.loads(data), attempts + 1) for id_, data, attempts in rows]
+
+    def ack(self, ids, worker):
+        """Mark leased requests done; a lease that expired and went to another worker is left alone."""
+        self.db.executemany(
+            "UPDATE requests SET state = ?, lease_owner = NULL WHERE id = ? AND state = ? AND lease_owner = ?",
+            [(DONE, id_, LEASED, worker) for id_ in ids])
+
+    def renew(self, ids, worker):
+        """Extend the leases ``worker`` still holds."""
+        expires = time.time() + self.lease_seconds
+        self.db.executemany(
+            "UPDATE requests SET lease_expires = ? WHERE id = ? AND state = ? AND lease_owner = ?",
+            [(expires, id_, LEASED, worker) for id_ in ids])
+
+    def fail(self, ids, worker):
+        """Mark leased requests failed, so no worker tries them again."""
+        self.db.executemany(
+            "UPDATE requests SET state = ?, lease_owner = NULL WHERE id = ? AND state = ? AND lease_owner = ?",
+            [(FAILED, id_, LEASED, worker) for id_ in ids])
+
+    def release(self, ids, worker, attempted=False):
+        """Give leased requests back without waiting for their leases to expire.
+
+        Requests that were never sent don't count as an attempt; ``attempted``
+        ones (sent, but their work unfinished) do, so one that keeps failing
+        reaches ``max_attempts``.
+        """
+        refund = 0 if attempted else 1
+        self.db.executemany(
+            "UPDATE requests SET state = ?, lease_owner = NULL, attempts = attempts - ?"
+            " WHERE id = ? AND state = ? AND lease_owner = ?",
+            [(QUEUED, refund, id_, LEASED, worker) for id_ in ids])
+
+    def has_work(self, worker, prefectures=()):
+        """Whether there are requests left: queued, or leased by other workers and possibly coming back."""
+        where = "(state = ? OR (state = ? AND lease_owner != ?))"
+        params = [QUEUED, LEASED, worker]
+        if prefectures:
+            where += f" AND prefecture IN ({', '.join('?' * len(prefectures))})"
+            params += list(prefectures)
+        return self.db.execute(f"SELECT 1 FROM requests WHERE {where} LIMIT 1", params).fetchone() is not None
+
+    def counts(self):
+        """Number of requests per (prefecture, state)."""
+        return self.db.execute(
+            "SELECT prefecture, state, COUNT(*) FROM requests GROUP BY prefecture, state"
+            " ORDER BY prefecture, state").fetchall()
+
+    def close(self):
+        self.db.close()
+
+
+def worker_id():
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class FrontierScheduler(BoundedScheduler):
+    """Scheduler that shares listing and detail requests with other workers through a Frontier.
+
+    Requests marked with ``meta['frontier']`` are pushed to the frontier, which
+    deduplicates them across workers; everything else (and retries or
+    redirects of leased requests) goes through the local queues. The local
+    queue is served first, and more is only leased while the work backlog is
+    below the cap, so a worker finishes the restaurants it started before
+    taking on new ones.
+    """
+
+    def __init__(self, *args, frontier=None, worker=None, batch_size=16, prefectures=(), **kwargs):
+        super().__init__(*args, **kwargs)
+        self.frontier = frontier
+        self.worker = worker
+        self.batch_size = batch_size
+        self.prefectures = tuple(prefectures)
+        self.leased = []
+        self.in_progress = set()
+        self.renew_task = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        scheduler = super().from_crawler(crawler)
+        scheduler.frontier = Frontier(
+            settings.get("FRONTIER_PATH", "frontier.sqlite"),
+            lease_seconds=settings.getfloat("FRONTIER_LEASE_SECONDS", 600),
+            max_attempts=settings.getint("FRONTIER_MAX_ATTEMPTS", 3))
+        scheduler.worker = settings.get("FRONTIER_WORKER_ID") or worker_id()
+        scheduler.batch_size = settings.getint("FRONTIER_BATCH_SIZE", 16)
+        scheduler.prefectures = tuple(str(p).zfill(2) for p in settings.getlist("FRONTIER_PREFECTURES"))
+        crawler.signals.connect(scheduler.request_left_downloader, signal=signals.request_left_downloader)
+        crawler.signals.connect(scheduler.request_done, signal=frontier_request_done)
+        return scheduler
+
+    def open(self, spider):
+        logger.info(f"Worker {self.worker} sharing frontier {self.frontier.path}"
+                    + (f" for prefectures {', '.join(self.prefectures)}" if self.prefectures else ""))
+        self.renew_task = task.LoopingCall(self.renew)
+        self.renew_task.start(self.frontier.lease_seconds / 3, now=False)
+        return super().open(spider)
+
+    def enqueue_request(self, request):
+        if not request.meta.get("frontier") or "frontier_id" in request.meta:
+            return super().enqueue_request(request)
+        fingerprint = self.crawler.request_fingerprinter.fingerprint(request).hex()
+        data = request.to_dict(spider=self.spider)
+        if not self.frontier.push(fingerprint, request.url, request.priority, data):
+            # Found before, by this worker or another one
+            self.stats.inc_value("frontier/duplicates", spider=self.spider)
+            return False
+        self.stats.inc_value("frontier/pushed", spider=self.spider)
+        return True
+
+    def next_request(self):
+        request = super().next_request()
+        if request is not None or super().__len__() or self.work_backlog() >= self.backlog:
+            return request
+        if not self.leased:
+            self.leased = self.frontier.lease(self.worker, self.batch_size, self.prefectures)
+            self.stats.inc_value("frontier/leased", len(self.leased), spider=self.spider)
+            reclaimed = sum(1 for _, _, attempt in self.leased if attempt > 1)
+            if reclaimed:
+                # Leases of a worker that died or hung
+                self.stats.inc_value("frontier/reclaimed", reclaimed, spider=self.spider)
+        if not self.leased:
+            return None
+        id_, data, _ = self.leased.pop(0)
+        request = request_from_dict(data, spider=self.spider)
+        request.meta["frontier_id"] = id_
+        self.in_progress.add(id_)
+        self.stats.inc_value("scheduler/dequeued/frontier", spider=self.spider)
+        return request
+
+    def request_left_downloader(self, request, spider):
+        # Retries and redirects of leased requests are queued locally from here on
+        if request.meta.get("frontier") != "item":
+            self.request_done(request.meta.get("frontier_id"))
+
+    def request_done(self, frontier_id, failed=False):
+        if frontier_id in self.in_progress:
+            self.in_progress.discard(frontier_id)
+            if failed:
+                self.frontier.fail([frontier_id], self.worker)
+                self.stats.inc_value("frontier/failed", spider=self.spider)
+            else:
+                self.frontier.ack([frontier_id], self.worker)
+                self.stats.inc_value("frontier/acked", spider=self.spider)
+
+    def renew(self):
+        self.frontier.renew([id_ for id_, _, _ in self.leased] + list(self.in_progress), self.worker)
+
+    def has_pending_requests(self):
+        # Other workers' leases count: if they expire, this worker picks the requests up
+        return (super().has_pending_requests() or bool(self.leased)
+                or self.frontier.has_work(self.worker, self.prefectures))
+
+    def __len__(self):
+        return super().__len__() + len(self.leased)
+
+    def close(self, reason):
+        if self.renew_task and self.renew_task.running:
+            self.renew_task.stop()
+        # Hand back what this worker leased but never finished; what it did send counts as an attempt
+        ids = [id_ for id_, _, _ in self.leased]
+        if ids:
+            self.frontier.release(ids, self.worker)
+        if self.in_progress:
+            self.frontier.release(list(self.in_progress), self.worker, attempted=True)
+        if ids or self.in_progress:
+            self.stats.inc_value("frontier/released", len(ids) + len(self.in_progress), spider=self.spider)
+        self.leased = []
+        self.in_progress.clear()
+        self.frontier.close()
+        return super().close(reason)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show the requests in a crawl frontier by prefecture and state.")
+    parser.add_argument("path")
+    args = parser.parse_args()
+
+    frontier = Frontier(args.path)
+    states = (QUEUED, LEASED, DONE, FAILED)
+    table = {}
+    for prefecture, state, count in frontier.counts():
+        table.setdefault(prefecture or "?", dict.fromkeys(states, 0))[state] = count
+    print(f"{'prefecture':<10}" + "".join(f"{state:>10}" for state in states))
+    for prefecture, row in table.items():
+        print(f"{prefecture:<10}" + "".join(f"{row[state]:>10}" for state in states))
+    frontier.close()
+
+
+if __name__ == "__main__":
+    main()
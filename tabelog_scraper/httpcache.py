@@ -0,0 +1,233 @@
+# HTTP cache storage in one SQLite file.
+#
+# FilesystemCacheStorage writes six files in a directory per response; after a
+# few prefectures that is millions of inodes. This storage keeps everything in
+# <HTTPCACHE_DIR>/<spider>.sqlite instead:
+#
+#   responses  one row per request fingerprint: URL, status, headers, page
+#              type, when it was stored and last read, and the hash of its body
+#   bodies     compressed bodies (zstd with `pip install zstandard`, zlib
+#              otherwise), stored once per content hash
+#
+# Responses expire per page type (HTTPCACHE_TTLS, see tabelog_scraper.utils.page_type),
+# and once bodies pass HTTPCACHE_MAX_BYTES the least recently read responses
+# are evicted. Only 200 responses are stored, and not block pages
+# (ADAPTIVE_BLOCK_MARKERS): a transient refusal mustn't outlive the crawl that
+# got it by a page type's TTL.
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+import zlib
+from pathlib import Path
+
+from scrapy.http import Headers
+from scrapy.responsetypes import responsetypes
+from scrapy.utils.project import data_path
+from w3lib.http import headers_dict_to_raw, headers_raw_to_dict
+
+from tabelog_scraper.utils import page_type
+
+logger = logging.getLogger(__name__)
+
+
+class Codec:
+    """Compresses with zstd if the zstandard package is installed, with zlib otherwise."""
+
+    def __init__(self, name="zstd", level=None):
+        self.zstd = None
+        try:
+            import zstandard
+        except ImportError:
+            zstandard = None
+        if zstandard is not None:
+            self.zstd = zstandard
+            self._zstd_compressor = zstandard.ZstdCompressor(level=level or 3)
+            self._zstd_decompressor = zstandard.ZstdDecompressor()
+        elif name == "zstd":
+            logger.warning("zstandard is not installed; compressing the HTTP cache with zlib")
+        self.name = name if self.zstd is not None else "zlib"
+        self.level = level
+
+    def compress(self, data):
+        if self.name == "zstd":
+            return self._zstd_compressor.compress(data)
+        return zlib.compress(data, self.level or 6)
+
+    def decompress(self, codec, data):
+        """Decompress ``data`` written with ``codec``; None if that codec isn't available."""
+        if codec == "zstd":
+            return self._zstd_decompressor.decompress(data) if self.zstd is not None else None
+        if codec == "zlib":
+            return zlib.decompress(data)
+        return data
+
+
+class SqliteCacheStorage:
+    """Scrapy HTTPCACHE_STORAGE keeping compressed, deduplicated responses in one SQLite file."""
+
+    def __init__(self, settings):
+        self.cachedir = data_path(settings["HTTPCACHE_DIR"], createdir=True)
+        self.expiration_secs = settings.getint("HTTPCACHE_EXPIRATION_SECS")
+        self.ttls = settings.getdict("HTTPCACHE_TTLS")
+        self.max_bytes = settings.getint("HTTPCACHE_MAX_BYTES", 0)
+        self.block_markers = [marker.encode() for marker in settings.getlist("ADAPTIVE_BLOCK_MARKERS")]
+        self.codec = Codec(settings.get("HTTPCACHE_COMPRESSION", "zstd"),
+                           settings.getint("HTTPCACHE_COMPRESSION_LEVEL") or None)
+        self.db = None
+        self.stats = None
+        self.size = 0
+        # Reads since the last write, recorded for LRU eviction with the next one
+        self._accessed = {}
+        # The cache proxy (tabelog_scraper.cacheproxy) uses its storage from its own threads
+        self._lock = threading.Lock()
+
+    def ttl(self, kind):
+        """Seconds a response of page type ``kind`` stays fresh; 0 never expires."""
+        return int(self.ttls.get(kind, self.expiration_secs))
+
+    def open_spider(self, spider):
+        self._fingerprinter = spider.crawler.request_fingerprinter
+        self.stats = spider.crawler.stats
+        path = Path(self.cachedir, f"{spider.name}.sqlite")
+        logger.debug(f"Using SQLite cache storage in {path}")
+        self.db = sqlite3.connect(str(path), timeout=60, check_same_thread=False)
+        # Only takes effect on a new file; lets evictions give space back
+        self.db.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS bodies ("
+            " sha256 TEXT PRIMARY KEY,"
+            " codec TEXT,"
+            " data BLOB,"
+            " size INTEGER)"
+        )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " fingerprint TEXT PRIMARY KEY,"
+            " url TEXT,"
+            " status INTEGER,"
+            " headers BLOB,"
+            " body_sha256 TEXT,"
+            " page_type TEXT,"
+            " stored REAL,"
+            " accessed REAL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS responses_body ON responses (body_sha256)")
+        self.db.commit()
+        with self._lock:
+            self._purge_expired()
+            self.size = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM bodies").fetchone()[0]
+
+    def close_spider(self, spider):
+        with self._lock:
+            self._flush_accessed()
+            self.db.commit()
+            self.db.close()
+
+    def retrieve_response(self, spider, request):
+        """Return the cached response, or None if it isn't cached or has expired."""
+        key = self._fingerprinter.fingerprint(request).hex()
+        with self._lock:
+            row = self.db.execute(
+                "SELECT r.url, r.status, r.headers, r.page_type, r.stored, b.codec, b.data"
+                " FROM responses r JOIN bodies b ON b.sha256 = r.body_sha256"
+                " WHERE r.fingerprint = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            url, status, raw_headers, kind, stored, codec, data = row
+            if 0 < self.ttl(kind) < time.time() - stored:
+                self.stats.inc_value(f"httpcache/expired/{kind}", spider=spider)
+                return None
+            body = self.codec.decompress(codec, data)
+            if body is None:
+                return None
+            self._accessed[key] = time.time()
+        headers = Headers(headers_raw_to_dict(raw_headers))
+        respcls = responsetypes.from_args(headers=headers, url=url, body=body)
+        return respcls(url=url, headers=headers, status=status, body=body)
+
+    def store_response(self, spider, request, response):
+        if response.status != 200:
+            self.stats.inc_value(f"httpcache/skipped/{response.status}", spider=spider)
+            return
+        body = response.body
+        if any(marker in body for marker in self.block_markers):
+            self.stats.inc_value("httpcache/skipped/block_page", spider=spider)
+            return
+        key = self._fingerprinter.fingerprint(request).hex()
+        sha256 = hashlib.sha256(body).hexdigest()
+        now = time.time()
+        with self._lock:
+            if self.db.execute("SELECT 1 FROM bodies WHERE sha256 = ?", (sha256,)).fetchone():
+                self.stats.inc_value("httpcache/duplicate_bodies", spider=spider)
+            else:
+                data = self.codec.compress(body)
+                self.db.execute("INSERT INTO bodies (sha256, codec, data, size) VALUES (?, ?, ?, ?)",
+                                (sha256, self.codec.name, data, len(data)))
+                self.size += len(data)
+                self.stats.inc_value("httpcache/stored_bytes", len(data), spider=spider)
+            self.db.execute(
+                "INSERT OR REPLACE INTO responses"
+                " (fingerprint, url, status, headers, body_sha256, page_type, stored, accessed)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, response.url, response.status, headers_dict_to_raw(response.headers), sha256,
+                 page_type(request.url), now, now))
+            self._flush_accessed()
+            if self.max_bytes and self.size > self.max_bytes:
+                self._evict()
+            self.db.commit()
+
+    def _flush_accessed(self):
+        if self._accessed:
+            self.db.executemany("UPDATE responses SET accessed = ? WHERE fingerprint = ?",
+                                [(accessed, key) for key, accessed in self._accessed.items()])
+            self._accessed.clear()
+
+    def _collect_bodies(self):
+        """Delete bodies no response refers to any more and recount the total size."""
+        self.db.execute("DELETE FROM bodies WHERE sha256 NOT IN (SELECT body_sha256 FROM responses)")
+        self.size = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM bodies").fetchone()[0]
+
+    def _purge_expired(self):
+        now = time.time()
+        kinds = [row[0] for row in self.db.execute("SELECT DISTINCT page_type FROM responses")]
+        purged = 0
+        for kind in kinds:
+            ttl = self.ttl(kind)
+            if ttl > 0:
+                purged += self.db.execute("DELETE FROM responses WHERE page_type = ? AND stored < ?",
+                                          (kind, now - ttl)).rowcount
+        if purged:
+            self._collect_bodies()
+            self.db.commit()
+            self.db.execute("PRAGMA incremental_vacuum")
+            logger.info(f"Purged {purged} expired responses from the HTTP cache")
+
+    def _evict(self):
+        # Down to 90% of the limit, so eviction doesn't run on every store
+        target = self.max_bytes * 0.9
+        evicted = 0
+        while self.size > target:
+            rows = self.db.execute(
+                "SELECT r.fingerprint, b.size FROM responses r JOIN bodies b ON b.sha256 = r.body_sha256"
+                " ORDER BY r.accessed")
+            victims, freed = [], 0
+            for key, size in rows:
+                victims.append((key,))
+                # A body shared with a response that stays isn't freed; the next round catches up
+                freed += size
+                if self.size - freed <= target:
+                    break
+            if not victims:
+                break
+            self.db.executemany("DELETE FROM responses WHERE fingerprint = ?", victims)
+            evicted += len(victims)
+            self._collect_bodies()
+        self.db.commit()
+        self.db.execute("PRAGMA incremental_vacuum")
+        self.stats.inc_value("httpcache/evicted", evicted)
+        logger.info(f"Evicted {evicted} least recently used responses from the HTTP cache")
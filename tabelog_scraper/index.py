@@ -0,0 +1,111 @@
+import hashlib
+import json
+import sqlite3
+import time
+from pathlib import Path
+
+from scrapy.utils.project import data_path
+
+
+def section_hash(value):
+    return hashlib.sha1(json.dumps(value, sort_keys=True, ensure_ascii=False).encode()).hexdigest()
+
+
+class RestaurantIndex:
+    """SQLite record of every restaurant scraped so far, keyed by Tabelog restaurant ID.
+
+    Stores when each restaurant was last scraped, the validators (ETag and
+    Last-Modified) of its detail page and a content hash per item section, so
+    later runs can skip restaurants that are still fresh, revalidate the rest
+    with conditional requests and tell which sections actually changed.
+    """
+
+    def __init__(self, path, max_age=7 * 24 * 3600):
+        self.path = path
+        self.max_age = max_age
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS restaurants ("
+            " restaurant_id TEXT PRIMARY KEY,"
+            " url TEXT,"
+            " scraped_at REAL,"
+            " etag TEXT,"
+            " last_modified TEXT,"
+            " section_hashes TEXT)"
+        )
+        self.db.commit()
+
+    @classmethod
+    def from_settings(cls, settings):
+        return cls(
+            data_path(settings.get("INDEX_PATH", "restaurant_index.sqlite")),
+            max_age=settings.getfloat("INDEX_MAX_AGE", 7 * 24 * 3600),
+        )
+
+    def get(self, restaurant_id):
+        row = self.db.execute(
+            "SELECT url, scraped_at, etag, last_modified, section_hashes"
+            " FROM restaurants WHERE restaurant_id = ?", (restaurant_id,)).fetchone()
+        if row is None:
+            return None
+        url, scraped_at, etag, last_modified, hashes = row
+        return {
+            "url": url,
+            "scraped_at": scraped_at,
+            "etag": etag,
+            "last_modified": last_modified,
+            "section_hashes": json.loads(hashes) if hashes else {},
+        }
+
+    def is_fresh(self, entry):
+        return (entry is not None and entry["scraped_at"] is not None
+                and time.time() - entry["scraped_at"] < self.max_age)
+
+    def conditional_headers(self, entry):
+        headers = {}
+        if entry and entry["scraped_at"] is None:
+            # Never scraped completely; a 304 would leave it incomplete
+            return headers
+        if entry and entry["etag"]:
+            headers["If-None-Match"] = entry["etag"]
+        if entry and entry["last_modified"]:
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def record_validators(self, restaurant_id, url, etag, last_modified):
+        self.db.execute(
+            "INSERT INTO restaurants (restaurant_id, url, etag, last_modified) VALUES (?, ?, ?, ?)"
+            " ON CONFLICT(restaurant_id) DO UPDATE SET"
+            " url = excluded.url, etag = excluded.etag, last_modified = excluded.last_modified",
+            (restaurant_id, url, etag, last_modified))
+        self.db.commit()
+
+    def touch(self, restaurant_id):
+        """Mark a restaurant as scraped now without changing its content (e.g. after a 304)."""
+        self.db.execute("UPDATE restaurants SET scraped_at = ? WHERE restaurant_id = ?",
+                        (time.time(), restaurant_id))
+        self.db.commit()
+
+    def record_sections(self, restaurant_id, url, sections, complete=True):
+        """Store the hash of each section; returns the names of the sections that changed.
+
+        An incomplete restaurant (sections failed) is not marked as scraped, so
+        the next crawl fetches it in full instead of skipping or revalidating it.
+        """
+        entry = self.get(restaurant_id)
+        old_hashes = entry["section_hashes"] if entry else {}
+        new_hashes = {name: section_hash(value) for name, value in sections.items()}
+        changed = [name for name, digest in new_hashes.items() if old_hashes.get(name) != digest]
+
+        self.db.execute(
+            "INSERT INTO restaurants (restaurant_id, url, scraped_at, section_hashes) VALUES (?, ?, ?, ?)"
+            " ON CONFLICT(restaurant_id) DO UPDATE SET"
+            " url = excluded.url, scraped_at = excluded.scraped_at, section_hashes = excluded.section_hashes",
+            (restaurant_id, url, time.time() if complete else None, json.dumps(new_hashes)))
+        self.db.commit()
+        return changed
+
+    def close(self):
+        self.db.close()
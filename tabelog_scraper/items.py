@@ -2,11 +2,173 @@
 #
 # See documentation in:
 # https://docs.scrapy.org/en/latest/topics/items.html
+#
+# Restaurants are dataclasses with __slots__: no per-record __dict__, values
+# coerced to numbers when the record is built, and nested values accepted as
+# the plain dicts the extractors return. Scrapy's exporters and itemadapter
+# serialize them like any other item.
+import re
+from dataclasses import dataclass, field, fields
+from typing import Optional
+
+NUMBER_RE = re.compile(r"\d[\d,]*(?:\.\d+)?")
+
+
+def _number(value, cast):
+    # First number in the value, e.g. "¥11,000～¥14,999" -> 11000; None if there isn't one
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return cast(value)
+    match = NUMBER_RE.search(str(value))
+    return cast(float(match.group().replace(",", ""))) if match else None
+
+
+def to_int(value):
+    return _number(value, int)
+
+
+def to_float(value):
+    return _number(value, float)
+
+
+def _build(cls, value):
+    if value is None or isinstance(value, cls):
+        return value
+    return cls.from_dict(value)
+
+
+def _build_list(cls, values):
+    return [_build(cls, value) for value in values or []]
+
+
+class Record:
+    __slots__ = ()
+
+    @classmethod
+    def from_dict(cls, data):
+        """Build from an extractor dict, ignoring keys the record doesn't have."""
+        return cls(**{f.name: data[f.name] for f in fields(cls) if f.name in data})
+
+
+@dataclass(slots=True)
+class MenuEntry(Record):
+    title: Optional[str] = None
+    price: Optional[int] = None  # yen
+    description: Optional[str] = None
+    image_src: Optional[str] = None
+    # Set menus (courses) only
+    link: Optional[str] = None
+    available_time: Optional[str] = None
+
+    def __post_init__(self):
+        self.price = to_int(self.price)
+
+
+@dataclass(slots=True)
+class Speciality(Record):
+    image_src: Optional[str] = None
+    title: Optional[str] = None
+    comment: Optional[str] = None
+    label: Optional[str] = None
+
+
+@dataclass(slots=True)
+class RatingBucket(Record):
+    range: Optional[str] = None
+    percentage: int = 0
+    people: int = 0
+
+    def __post_init__(self):
+        self.percentage = to_int(self.percentage) or 0
+        self.people = to_int(self.people) or 0
+        if not 0 <= self.percentage <= 100:
+            raise ValueError(f"Rating bucket percentage out of range: {self.percentage}")
+
+
+@dataclass(slots=True)
+class ReviewRating(Record):
+    average_ratings: dict = field(default_factory=dict)
+    rating_distribution: list = field(default_factory=list)
+
+    def __post_init__(self):
+        self.average_ratings = {title: score for title, score in
+                                ((title, to_float(score)) for title, score in (self.average_ratings or {}).items())
+                                if score is not None}
+        for title, score in self.average_ratings.items():
+            if not 0 <= score <= 5:
+                raise ValueError(f"{title} score out of range: {score}")
+        self.rating_distribution = _build_list(RatingBucket, self.rating_distribution)
+
+
+@dataclass(slots=True)
+class InfoRow(Record):
+    field: Optional[str] = None
+    value: Optional[str] = None
+
+
+@dataclass(slots=True)
+class RestaurantInformation(Record):
+    details: list = field(default_factory=list)
+    seats_facilities: list = field(default_factory=list)
+    menu: list = field(default_factory=list)
+    feature_related_info: list = field(default_factory=list)
+
+    def __post_init__(self):
+        self.details = _build_list(InfoRow, self.details)
+        self.seats_facilities = _build_list(InfoRow, self.seats_facilities)
+        self.menu = _build_list(InfoRow, self.menu)
+        self.feature_related_info = _build_list(InfoRow, self.feature_related_info)
+
+
+@dataclass(slots=True)
+class EditorialOverview(Record):
+    headline: Optional[str] = None
+    description: Optional[str] = None
+
+
+@dataclass(slots=True)
+class MediaFile(Record):
+    # Set by the MediaPipeline; paths are relative to MEDIA_STORE
+    url: Optional[str] = None
+    sha256: Optional[str] = None
+    path: Optional[str] = None
+    thumbnail: Optional[str] = None
 
-import scrapy
 
+@dataclass(slots=True)
+class Restaurant(Record):
+    # From the listing card
+    name: Optional[str] = None
+    area: Optional[str] = None
+    genre: Optional[str] = None
+    rating: Optional[float] = None
+    review_count: Optional[int] = None
+    # From the detail page and its sub-pages
+    editorial_overview: EditorialOverview = field(default_factory=EditorialOverview)
+    review_rating: ReviewRating = field(default_factory=ReviewRating)
+    specialities: list = field(default_factory=list)
+    menu: dict = field(default_factory=dict)  # tab -> [MenuEntry]
+    restaurant_information: RestaurantInformation = field(default_factory=RestaurantInformation)
+    interior_photos: list = field(default_factory=list)
+    media: list = field(default_factory=list)  # [MediaFile], downloaded images
+    # Parts (e.g. "Food", "review_rating") still missing after their retries
+    failed_sections: list = field(default_factory=list)
+    url: Optional[str] = None  # required
 
-class TabelogScraperItem(scrapy.Item):
-    # define the fields for your item here like:
-    # name = scrapy.Field()
-    pass
+    def __post_init__(self):
+        if not self.url:
+            raise ValueError("Restaurant without a URL")
+        self.rating = to_float(self.rating)
+        self.review_count = to_int(self.review_count)
+        if self.rating is not None and not 0 <= self.rating <= 5:
+            raise ValueError(f"Rating out of range: {self.rating}")
+        self.editorial_overview = _build(EditorialOverview, self.editorial_overview) or EditorialOverview()
+        self.review_rating = _build(ReviewRating, self.review_rating) or ReviewRating()
+        self.specialities = _build_list(Speciality, self.specialities)
+        self.menu = {tab: _build_list(MenuEntry, entries) for tab, entries in (self.menu or {}).items()}
+        self.restaurant_information = (_build(RestaurantInformation, self.restaurant_information)
+                                       or RestaurantInformation())
+        self.interior_photos = list(self.interior_photos or [])
+        self.media = _build_list(MediaFile, self.media)
+        self.failed_sections = list(self.failed_sections or [])
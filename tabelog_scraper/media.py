@@ -0,0 +1,101 @@
+# Content-addressed storage for restaurant images.
+#
+# Files are stored under the SHA-256 of their content, so an image served
+# under several URLs (the same photo on the detail page and in the menu) is
+# stored once. A small SQLite index maps URLs to hashes, so later crawls
+# don't download an image again.
+#
+#   <store>/full/ab/cd/abcd...ef.jpg
+#   <store>/thumbs/<size>/ab/cd/abcd...ef.jpg
+#   <store>/index.sqlite
+import hashlib
+import mimetypes
+import os
+import sqlite3
+import time
+from pathlib import Path, PurePosixPath
+from urllib.parse import urlsplit
+
+
+def media_urls(data):
+    """Image URLs of a restaurant item (as a dict): specialities, menu entries and interior photos."""
+    urls = [speciality.get("image_src") for speciality in data.get("specialities") or []]
+    urls += [entry.get("image_src") for entries in (data.get("menu") or {}).values() for entry in entries]
+    urls += data.get("interior_photos") or []
+    # In order of appearance, once each
+    return list(dict.fromkeys(url for url in urls if url))
+
+
+def extension(url, content_type=None):
+    suffix = PurePosixPath(urlsplit(url).path).suffix.lower()
+    if suffix in (".jpg", ".jpeg", ".png", ".gif", ".webp"):
+        return suffix
+    guessed = mimetypes.guess_extension((content_type or "").split(";")[0].strip())
+    return guessed or ".bin"
+
+
+def make_thumbnail(source, destination, size):
+    """Write a JPEG thumbnail of ``source`` that fits in ``size`` x ``size``; runs in a worker process."""
+    from PIL import Image
+
+    with Image.open(source) as image:
+        image.thumbnail((size, size))
+        Path(destination).parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = f"{destination}.{os.getpid()}.tmp"
+        image.convert("RGB").save(tmp_path, "JPEG", quality=85)
+        os.replace(tmp_path, destination)
+    return destination
+
+
+class MediaStore:
+    """Directory of content-addressed files with an index of the URLs they were downloaded from."""
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(str(self.directory / "index.sqlite"))
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS media ("
+            " url TEXT PRIMARY KEY,"
+            " sha256 TEXT,"
+            " path TEXT,"
+            " fetched_at REAL)"
+        )
+        self.db.commit()
+
+    @staticmethod
+    def relative_path(sha256, suffix, kind="full"):
+        return str(PurePosixPath(kind, sha256[:2], sha256[2:4], sha256 + suffix))
+
+    def thumbnail_path(self, sha256, size):
+        return self.relative_path(sha256, ".jpg", f"thumbs/{size}")
+
+    def get(self, url):
+        """(sha256, path) of a URL stored before, if its file is still there."""
+        row = self.db.execute("SELECT sha256, path FROM media WHERE url = ?", (url,)).fetchone()
+        if row is None or not (self.directory / row[1]).exists():
+            return None
+        return row
+
+    def put(self, url, body, content_type=None):
+        """Store ``body`` under its hash; returns (sha256, path, whether the content was new)."""
+        sha256 = hashlib.sha256(body).hexdigest()
+        path = self.relative_path(sha256, extension(url, content_type))
+        full_path = self.directory / path
+        new = not full_path.exists()
+        if new:
+            full_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = full_path.with_name(full_path.name + ".tmp")
+            tmp_path.write_bytes(body)
+            os.replace(tmp_path, full_path)
+        self.db.execute(
+            "INSERT OR REPLACE INTO media (url, sha256, path, fetched_at) VALUES (?, ?, ?, ?)",
+            (url, sha256, path, time.time()))
+        return sha256, path, new
+
+    def commit(self):
+        self.db.commit()
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
@@ -5,9 +5,237 @@
 
 
 # useful for handling different item types with a single interface
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+
+import scrapy
 from itemadapter import ItemAdapter
+from scrapy import signals
+from scrapy.exceptions import DropItem, NotConfigured
+from scrapy.utils.defer import maybe_deferred_to_future
+from twisted.internet.threads import deferToThread
+
+from tabelog_scraper.dedup import RestaurantIdSet
+from tabelog_scraper.export import TABLES, ShardedExporter
+from tabelog_scraper.media import MediaStore, make_thumbnail, media_urls
+from tabelog_scraper.spiders.restaurants import DETAIL_SECTIONS, MENU_TABS, SUBPAGES
+from tabelog_scraper.utils import restaurant_id
+
+logger = logging.getLogger(__name__)
+
+
+class DuplicatesPipeline:
+    """Drops items for a restaurant ID that was already exported in this job."""
+
+    def __init__(self, ids, stats):
+        self.ids = ids
+        self.stats = stats
 
+    @classmethod
+    def from_crawler(cls, crawler):
+        pipeline = cls(RestaurantIdSet.from_settings(crawler.settings, "exported_restaurants"), crawler.stats)
+        # Unlike close_spider, this gets the close reason
+        crawler.signals.connect(pipeline.spider_closed, signal=signals.spider_closed)
+        return pipeline
 
-class TabelogScraperPipeline:
     def process_item(self, item, spider):
+        rid = restaurant_id(ItemAdapter(item).get("url") or "")
+        if rid and not self.ids.add(rid):
+            self.stats.inc_value("dedup/items_dropped", spider=spider)
+            raise DropItem(f"Duplicate restaurant {rid}")
         return item
+
+    def spider_closed(self, spider, reason):
+        self.ids.close(reason)
+
+
+class MediaPipeline:
+    """Downloads the images of every item into a content-addressed MediaStore under MEDIA_STORE.
+
+    Images go through Scrapy's downloader, all of an item's at once, and an
+    image already in the store (from this crawl or an earlier one) isn't
+    downloaded again. The item gets the hash and path of each image in
+    ``media``, so it waits for its own images, which are only known once
+    downloaded; Scrapy processes up to CONCURRENT_ITEMS items at once, so
+    the other items are exported meanwhile. Thumbnails are made in a process
+    pool (with Pillow installed) and the item doesn't wait for them; their
+    paths are fixed by the hash.
+    """
+
+    def __init__(self, store, crawler, thumbnail_size=320, thumbnail_workers=2):
+        self.store = store
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.thumbnail_size = thumbnail_size
+        self.thumbnail_workers = thumbnail_workers
+        self.executor = None
+        # url -> download task, for images on several items of this crawl
+        self.downloading = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool("MEDIA_ENABLED"):
+            raise NotConfigured
+        return cls(MediaStore(settings.get("MEDIA_STORE", "media")), crawler,
+                   thumbnail_size=settings.getint("MEDIA_THUMBNAIL_SIZE", 320),
+                   thumbnail_workers=settings.getint("MEDIA_THUMBNAIL_WORKERS", 2))
+
+    def open_spider(self, spider):
+        if not self.thumbnail_size:
+            return
+        try:
+            import PIL  # noqa: F401
+        except ImportError:
+            logger.warning("Pillow is not installed; storing images without thumbnails")
+            return
+        # Spawned rather than forked from a process running the reactor and browser threads
+        self.executor = ProcessPoolExecutor(self.thumbnail_workers, mp_context=multiprocessing.get_context("spawn"))
+
+    async def process_item(self, item, spider):
+        urls = media_urls(ItemAdapter(item).asdict())
+        if not urls:
+            return item
+        results = await asyncio.gather(*(self.fetch(url) for url in urls), return_exceptions=True)
+        media = []
+        for url, result in zip(urls, results):
+            if isinstance(result, Exception):
+                logger.warning(f"Failed to download image {url}: {result}")
+                self.stats.inc_value("media/failed", spider=spider)
+                continue
+            sha256, path = result
+            media.append({
+                "url": url, "sha256": sha256, "path": path,
+                "thumbnail": self.store.thumbnail_path(sha256, self.thumbnail_size) if self.executor else None,
+            })
+        self.store.commit()
+        ItemAdapter(item)["media"] = media
+        return item
+
+    async def fetch(self, url):
+        stored = self.store.get(url)
+        if stored is not None:
+            self.stats.inc_value("media/cached")
+            return stored
+        if url not in self.downloading:
+            task = self.downloading[url] = asyncio.ensure_future(self.download(url))
+            task.add_done_callback(lambda _: self.downloading.pop(url, None))
+        return await self.downloading[url]
+
+    async def download(self, url):
+        # Image hosts aren't in allowed_domains; dont_filter keeps the offsite middleware out of it.
+        # The store keeps the image, so the HTTP cache doesn't need a second copy
+        request = scrapy.Request(url, dont_filter=True, meta={"media": True, "dont_cache": True})
+        response = await maybe_deferred_to_future(self.crawler.engine.download(request))
+        if response.status != 200:
+            raise ValueError(f"HTTP {response.status}")
+        content_type = response.headers.get("Content-Type", b"").decode() or None
+        sha256, path, new = self.store.put(url, response.body, content_type)
+        self.stats.inc_value("media/downloaded")
+        self.stats.inc_value("media/bytes", len(response.body))
+        if not new:
+            # Same content as an image stored under another URL
+            self.stats.inc_value("media/duplicates")
+        elif self.executor is not None:
+            # Imported here so that importing this module never installs a reactor
+            from twisted.internet import reactor
+
+            future = self.executor.submit(
+                make_thumbnail, str(self.store.directory / path),
+                str(self.store.directory / self.store.thumbnail_path(sha256, self.thumbnail_size)),
+                self.thumbnail_size)
+            future.add_done_callback(lambda f: reactor.callFromThread(self.thumbnail_done, f))
+        return sha256, path
+
+    def thumbnail_done(self, future):
+        if future.exception() is not None:
+            logger.warning(f"Failed to make thumbnail: {future.exception()}")
+            self.stats.inc_value("media/thumbnail_errors")
+        else:
+            self.stats.inc_value("media/thumbnails")
+
+    def close_spider(self, spider):
+        self.store.close()
+        if self.executor is not None:
+            # Let the queued thumbnails finish without blocking the reactor
+            return deferToThread(self.executor.shutdown, wait=True)
+
+
+def content_sections(data):
+    """The scraped sections of an item (as a dict) by part: detail page sections and sub-pages, one per menu tab."""
+    menu = data.get("menu") or {}
+    return {part: menu.get(part) if part in MENU_TABS else data.get(part) for part in (*DETAIL_SECTIONS, *SUBPAGES)}
+
+
+class RestaurantIndexPipeline:
+    """Records the content hash of every scraped section of an item in the spider's restaurant index.
+
+    Listing card fields (rating, review count), media and failed_sections
+    aren't sections, so a rating tick doesn't count as a changed section.
+    """
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler.stats)
+
+    def process_item(self, item, spider):
+        index = getattr(spider, "index", None)
+        if index is None:
+            return item
+
+        data = ItemAdapter(item).asdict()
+        url = data.get("url")
+        changed = index.record_sections(restaurant_id(url) or url, url, content_sections(data),
+                                        complete=not data.get("failed_sections"))
+
+        self.stats.inc_value("index/changed_items" if changed else "index/unchanged_items", spider=spider)
+        for name in changed:
+            self.stats.inc_value(f"index/changed_sections/{name}", spider=spider)
+        return item
+
+
+class ExportPipeline:
+    """Streams items to sharded JSON Lines and normalized Parquet tables under EXPORT_DIR."""
+
+    def __init__(self, directory, settings, stats):
+        self.directory = directory
+        self.settings = settings
+        self.stats = stats
+        self.exporter = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        directory = crawler.settings.get("EXPORT_DIR")
+        if not directory:
+            raise NotConfigured
+        return cls(directory, crawler.settings, crawler.stats)
+
+    def open_spider(self, spider):
+        # Same placeholders as FEEDS URIs
+        time = datetime.now(tz=timezone.utc).replace(microsecond=0).isoformat().replace(":", "-")
+        directory = self.directory % {"name": spider.name, "time": time}
+        self.exporter = ShardedExporter(
+            directory,
+            max_items=self.settings.getint("EXPORT_SHARD_MAX_ITEMS", 10000),
+            max_bytes=self.settings.getint("EXPORT_SHARD_MAX_BYTES", 64 * 1024 * 1024),
+            parquet=self.settings.getbool("EXPORT_PARQUET", True),
+            parquet_batch_size=self.settings.getint("EXPORT_PARQUET_BATCH_SIZE", 5000),
+        )
+        spider.logger.info(f"Exporting items to {directory}")
+
+    def process_item(self, item, spider):
+        self.exporter.write(item)
+        self.stats.inc_value("export/items", spider=spider)
+        return item
+
+    def close_spider(self, spider):
+        self.exporter.close()
+        self.stats.set_value("export/shards", self.exporter.shard + 1, spider=spider)
+        for table in TABLES:
+            self.stats.set_value(f"export/rows/{table}", self.exporter.rows[table], spider=spider)
@@ -0,0 +1,141 @@
+# Scheduler that keeps memory flat however large the crawl is.
+#
+# Requests are split into restaurant work (detail and sub-pages) and
+# discovery (listing pages, meta['discovery']). A listing page is only let
+# through while the work backlog, queued plus downloading, is below
+# SCHEDULER_BACKLOG_PER_BROWSER requests per browser in the pool: listing
+# pages are what create new restaurants, so the backlog stays at what the
+# renderer can get through.
+# Each queue keeps SCHEDULER_MEMORY_QUEUE_SIZE requests in memory and
+# spills the rest to disk queues, in JOBDIR or a temporary directory.
+import logging
+import shutil
+import tempfile
+from pathlib import Path
+
+from scrapy.core.scheduler import Scheduler
+from scrapy.utils.misc import build_from_crawler
+
+logger = logging.getLogger(__name__)
+
+
+class SpillQueue:
+    """Priority queue of requests, in memory up to ``memory_size`` and on disk past that."""
+
+    def __init__(self, memory, disk, memory_size):
+        self.memory = memory
+        self.disk = disk
+        self.memory_size = memory_size
+
+    def push(self, request):
+        """Queue ``request``; returns where it went, "memory" or "disk"."""
+        if len(self.memory) < self.memory_size:
+            self.memory.push(request)
+            return "memory"
+        try:
+            self.disk.push(request)
+        except ValueError:
+            # Not serializable (e.g. a callback that isn't a spider method)
+            self.memory.push(request)
+            return "memory"
+        return "disk"
+
+    def pop(self):
+        # Highest priority of both; curprio is the negated priority of each queue's head
+        memory_prio = getattr(self.memory, "curprio", None)
+        disk_prio = getattr(self.disk, "curprio", None)
+        if disk_prio is not None and (memory_prio is None or disk_prio < memory_prio):
+            return self.disk.pop()
+        return self.memory.pop() or self.disk.pop()
+
+    def close(self):
+        # The memory queue isn't persisted; move it to disk for a JOBDIR to resume from
+        while (request := self.memory.pop()) is not None:
+            try:
+                self.disk.push(request)
+            except ValueError:
+                pass
+        return self.disk.close()
+
+    def __len__(self):
+        return len(self.memory) + len(self.disk)
+
+
+class BoundedScheduler(Scheduler):
+    """Scheduler that serves restaurant work before discovery and bounds what it keeps in memory."""
+
+    def __init__(self, *args, memory_size=1000, backlog=32, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.memory_size = memory_size
+        self.backlog = backlog
+        self.spill_dir = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        scheduler = super().from_crawler(crawler)
+        scheduler.memory_size = settings.getint("SCHEDULER_MEMORY_QUEUE_SIZE", 1000)
+        scheduler.backlog = (settings.getint("SCHEDULER_BACKLOG_PER_BROWSER", 32)
+                             * max(1, settings.getint("BROWSER_POOL_SIZE", 1)))
+        if scheduler.dqdir is None:
+            # No JOBDIR: spill to a directory that goes away with the crawl
+            scheduler.dqdir = scheduler.spill_dir = tempfile.mkdtemp(prefix="tabelog-spill-")
+        return scheduler
+
+    def open(self, spider):
+        self.spider = spider
+        self.work = SpillQueue(self._mq(), self._disk_queue("work"), self.memory_size)
+        self.discovery = SpillQueue(self._mq(), self._disk_queue("discovery"), self.memory_size)
+        if len(self):
+            logger.info(f"Resuming crawl ({len(self)} requests scheduled)")
+        return self.df.open()
+
+    def _disk_queue(self, name):
+        path = Path(self.dqdir, name)
+        path.mkdir(parents=True, exist_ok=True)
+        return build_from_crawler(
+            self.pqclass, self.crawler, downstream_queue_cls=self.dqclass, key=str(path),
+            startprios=self._read_dqs_state(str(path)))
+
+    def enqueue_request(self, request):
+        if not request.dont_filter and self.df.request_seen(request):
+            self.df.log(request, self.spider)
+            return False
+        queue = self.discovery if request.meta.get("discovery") else self.work
+        where = queue.push(request)
+        self.stats.inc_value(f"scheduler/enqueued/{where}", spider=self.spider)
+        self.stats.inc_value("scheduler/enqueued", spider=self.spider)
+        return True
+
+    def work_backlog(self):
+        """Restaurant work requests queued or being downloaded."""
+        active = sum(1 for request in self.crawler.engine.downloader.active
+                     if not request.meta.get("discovery"))
+        return len(self.work) + active
+
+    def next_request(self):
+        backlog = self.work_backlog()
+        self.stats.max_value("scheduler/max_backlog", backlog, spider=self.spider)
+        request = None
+        if len(self.discovery) and backlog < self.backlog:
+            request = self.discovery.pop()
+            if request is not None:
+                self.stats.inc_value("scheduler/dequeued/discovery", spider=self.spider)
+        if request is None:
+            request = self.work.pop()
+            if request is None and len(self.discovery):
+                # Everything queued is discovery, held until the backlog drains
+                self.stats.inc_value("scheduler/discovery_held", spider=self.spider)
+        if request is not None:
+            self.stats.inc_value("scheduler/dequeued", spider=self.spider)
+        return request
+
+    def __len__(self):
+        return len(self.work) + len(self.discovery)
+
+    def close(self, reason):
+        for name, queue in (("work", self.work), ("discovery", self.discovery)):
+            self._write_dqs_state(str(Path(self.dqdir, name)), queue.close())
+        if self.spill_dir:
+            shutil.rmtree(self.spill_dir, ignore_errors=True)
+        return self.df.close(reason)
@@ -18,22 +18,150 @@ NEWSPIDER_MODULE = "tabelog_scraper.spiders"
 
 # Obey robots.txt rules
 ROBOTSTXT_OBEY = False
-AUTOTHROTTLE_ENABLED = True
-AUTOTHROTTLE_START_DELAY = 5
-AUTOTHROTTLE_MAX_DELAY = 60
-AUTOTHROTTLE_TARGET_CONCURRENCY = 1.0
+# Number of headless browsers rendering pages in parallel (one worker thread each)
+BROWSER_POOL_SIZE = 4
+BROWSER_HEADLESS = True
+# Browsers are started when a page first needs rendering; this many are
+# started in the background as soon as the crawl opens instead
+BROWSER_PREWARM = 0
+# A browser is replaced after rendering this many pages, or once its Chrome
+# processes use more than BROWSER_MAX_RSS_MB (checked every
+# BROWSER_RSS_CHECK_EVERY pages); 0 disables either limit. A page whose
+# browser crashed is rendered again on a new one up to BROWSER_CRASH_RETRIES times
+BROWSER_MAX_PAGES = 300
+BROWSER_MAX_RSS_MB = 1500
+BROWSER_RSS_CHECK_EVERY = 20
+BROWSER_CRASH_RETRIES = 2
+
+# Resources the browsers never download; the extractors only read markup and src attributes
+BROWSER_BLOCK_RESOURCES = True
+BROWSER_BLOCKED_RESOURCE_TYPES = ["image", "font", "media"]
+BROWSER_BLOCKED_DOMAINS = [
+    "google-analytics.com",
+    "googletagmanager.com",
+    "googlesyndication.com",
+    "doubleclick.net",
+    "facebook.net",
+    "criteo.com",
+]
+# If set, every other host fails to resolve (not applied through the cache proxy)
+BROWSER_ALLOWED_DOMAINS = []
+# Render one page in this many without blocking to report bytes and time saved per page
+BROWSER_BLOCK_SAMPLE_EVERY = 50
+
+# Browser waits: timeouts are learned per selector from observed latencies
+# (WAIT_TIMEOUT_PERCENTILE x WAIT_TIMEOUT_FACTOR, clamped to the min/max) once
+# WAIT_MIN_SAMPLES waits have succeeded; a settled page without the selector
+# gives up after WAIT_QUIET_MS
+WAIT_MIN_TIMEOUT = 1.0
+WAIT_MAX_TIMEOUT = 10.0
+WAIT_QUIET_MS = 500
+WAIT_TIMEOUT_PERCENTILE = 95
+WAIT_TIMEOUT_FACTOR = 2.0
+WAIT_MIN_SAMPLES = 20
+
+# Persistent per-restaurant index (under .scrapy/) used for incremental crawls:
+# restaurants scraped less than INDEX_MAX_AGE seconds ago are skipped, older
+# ones are revalidated with their ETag/Last-Modified
+INDEX_ENABLED = True
+INDEX_PATH = 'restaurant_index.sqlite'
+INDEX_MAX_AGE = 7 * 24 * 3600
+
+# Restaurant IDs already requested/exported are kept in JOBDIR for the whole
+# job; set a directory here to share them between jobs (e.g. across regions).
+# Shared IDs expire after DEDUP_MAX_AGE seconds, in step with INDEX_MAX_AGE,
+# so restaurants due for a refresh are requested and exported again
+DEDUP_DIR = None
+DEDUP_MAX_AGE = INDEX_MAX_AGE
+
+# Tabelog never serves more result pages than this for one search
+LISTING_MAX_PAGES = 60
+
+# Detail and sub-pages go before listing pages, and listing pages wait while
+# this many detail/sub-page requests per browser are queued or downloading.
+# Up to SCHEDULER_MEMORY_QUEUE_SIZE requests per queue stay in memory, the
+# rest spill to disk (JOBDIR, or a temporary directory)
+SCHEDULER = 'tabelog_scraper.scheduler.BoundedScheduler'
+SCHEDULER_BACKLOG_PER_BROWSER = 32
+SCHEDULER_MEMORY_QUEUE_SIZE = 1000
+
+# Several workers on one crawl: run each with
+# -s SCHEDULER=tabelog_scraper.frontier.FrontierScheduler and the same
+# FRONTIER_PATH (on storage every worker can lock, e.g. NFS). Listing and
+# detail requests are leased in batches; a lease not finished within
+# FRONTIER_LEASE_SECONDS goes to another worker, up to FRONTIER_MAX_ATTEMPTS times
+FRONTIER_PATH = 'frontier.sqlite'
+FRONTIER_LEASE_SECONDS = 600
+FRONTIER_MAX_ATTEMPTS = 3
+FRONTIER_BATCH_SIZE = 16
+# Only lease work from these prefectures (e.g. [13, 14]); empty takes any
+FRONTIER_PREFECTURES = []
+# Defaults to <hostname>-<pid>
+FRONTIER_WORKER_ID = None
+
+# Seconds to wait for all sub-pages of a restaurant before emitting it incomplete
+ITEM_JOIN_TIMEOUT = 180
+
+# A section (a sub-page, or a detail page section that needed rendering)
+# that failed is fetched again on its own, after SECTION_RETRY_DELAY seconds,
+# doubling per attempt, up to SECTION_RETRY_TIMES times; the restaurant is
+# emitted once every section succeeded or ran out of retries, with the ones
+# that didn't in `failed_sections`
+SECTION_RETRY_TIMES = 2
+SECTION_RETRY_DELAY = 30
+
+# Concurrency and delay of every download slot, and the number of browsers
+# rendering at once, are tuned every ADAPTIVE_INTERVAL seconds
+# (tabelog_scraper.throttle): doubled while healthy until the first back-off,
+# then raised one at a time; halved with a doubled delay (or Retry-After) on
+# 429/403/503 responses or block pages; cut by a quarter on errors above
+# ADAPTIVE_MAX_ERROR_RATE or latency over ADAPTIVE_LATENCY_FACTOR x the best
+# seen. Decisions are in the adaptive/<slot>/* stats. Replaces AutoThrottle,
+# which only sees download latency; enabling AutoThrottle turns this off
+AUTOTHROTTLE_ENABLED = False
+ADAPTIVE_CONCURRENCY_ENABLED = True
+ADAPTIVE_INTERVAL = 5.0
+ADAPTIVE_HTTP_START_CONCURRENCY = 2
+ADAPTIVE_HTTP_MAX_CONCURRENCY = 16
+ADAPTIVE_MAX_DELAY = 60
+ADAPTIVE_MAX_ERROR_RATE = 0.1
+ADAPTIVE_LATENCY_FACTOR = 2.0
+# Text of a 200 page that is Tabelog refusing service rather than content
+ADAPTIVE_BLOCK_MARKERS = [
+    "アクセスが集中しております",
+    "Access Denied",
+]
+# Changes kept per slot in the adaptive/<slot>/history stat
+ADAPTIVE_HISTORY = 100
 
 # Enable HTTP caching (default: False)
 HTTPCACHE_ENABLED = True
 HTTPCACHE_EXPIRATION_SECS = 0
 HTTPCACHE_DIR = 'httpcache'
-HTTPCACHE_IGNORE_HTTP_CODES = []
-HTTPCACHE_STORAGE = 'scrapy.extensions.httpcache.FilesystemCacheStorage'
+# Throttling and server errors are retried, not cached
+HTTPCACHE_IGNORE_HTTP_CODES = [403, 429, 500, 502, 503, 504]
+# One SQLite file per spider in HTTPCACHE_DIR, bodies compressed and stored
+# once per content hash
+HTTPCACHE_STORAGE = 'tabelog_scraper.httpcache.SqliteCacheStorage'
+# zstd needs `pip install zstandard` (zlib otherwise)
+HTTPCACHE_COMPRESSION = 'zstd'
+# Seconds each page type stays fresh (0: forever); other types use HTTPCACHE_EXPIRATION_SECS
+HTTPCACHE_TTLS = {
+    'listing': 24 * 3600,
+    'detail': 7 * 24 * 3600,
+    'menu': 14 * 24 * 3600,
+    'ratings': 3 * 24 * 3600,
+    'photos': 30 * 24 * 3600,
+}
+# Least recently read responses are evicted past this many (compressed) body bytes; 0 disables
+HTTPCACHE_MAX_BYTES = 4 * 1024 ** 3
+# Route Chrome through a local proxy that reads and writes the same HTTP cache
+BROWSER_CACHE_PROXY_ENABLED = False
 
 
 
-# Configure maximum concurrent requests performed by Scrapy (default: 16)
-#CONCURRENT_REQUESTS = 32
+# Upper bound over all slots; per-slot concurrency is set by the adaptive controller
+CONCURRENT_REQUESTS = 32
 
 # Configure a delay for requests for the same website (default: 0)
 # See https://docs.scrapy.org/en/latest/topics/settings.html#download-delay
@@ -63,21 +191,54 @@ HTTPCACHE_STORAGE = 'scrapy.extensions.httpcache.FilesystemCacheStorage'
 
 # Enable or disable downloader middlewares
 # See https://docs.scrapy.org/en/latest/topics/downloader-middleware.html
-# DOWNLOADER_MIDDLEWARES = {
-#    "tabelog_scraper.middlewares.TabelogScraperDownloaderMiddleware": 543,
-# }
+DOWNLOADER_MIDDLEWARES = {
+    # After RetryMiddleware (550) on the way back, so it sees every attempt
+    "tabelog_scraper.throttle.AdaptiveConcurrencyMiddleware": 560,
+}
 
 # Enable or disable extensions
 # See https://docs.scrapy.org/en/latest/topics/extensions.html
-#EXTENSIONS = {
-#    "scrapy.extensions.telnet.TelnetConsole": None,
-#}
+EXTENSIONS = {
+    "tabelog_scraper.extensions.SpiderStateCheckpoint": 500,
+    "tabelog_scraper.extensions.StageLatencyStats": 500,
+}
+
+# p50/p95/max of every scraping stage (stages/* stats), from up to this many timings per stage
+STAGE_STATS_ENABLED = True
+STAGE_STATS_SAMPLES = 10000
+
+# With JOBDIR set (e.g. `scrapy crawl restaurants -s JOBDIR=crawls/run-1`), save
+# the pagination cursor, link budget and outstanding restaurants this often, so
+# a crashed crawl resumes from its last checkpoint
+CHECKPOINT_INTERVAL = 30
 
 # Configure item pipelines
 # See https://docs.scrapy.org/en/latest/topics/item-pipeline.html
-#ITEM_PIPELINES = {
-#    "tabelog_scraper.pipelines.TabelogScraperPipeline": 300,
-#}
+ITEM_PIPELINES = {
+    "tabelog_scraper.pipelines.DuplicatesPipeline": 100,
+    "tabelog_scraper.pipelines.MediaPipeline": 300,
+    "tabelog_scraper.pipelines.RestaurantIndexPipeline": 800,
+    "tabelog_scraper.pipelines.ExportPipeline": 900,
+}
+
+# Download the images of every restaurant (specialities, menus, interior
+# photos) into MEDIA_STORE, stored once per content hash; items get their
+# hashes and paths in `media`. Thumbnails need `pip install Pillow`
+MEDIA_ENABLED = False
+MEDIA_STORE = 'media'
+# Longest side in pixels; 0 disables thumbnails
+MEDIA_THUMBNAIL_SIZE = 320
+MEDIA_THUMBNAIL_WORKERS = 2
+
+# Sharded JSON Lines and Parquet tables (restaurants, menu_items,
+# rating_distribution, photos, info_rows, media); Parquet needs `pip install pyarrow`.
+# %(name)s and %(time)s are replaced as in FEEDS URIs; empty disables the export
+EXPORT_DIR = 'export/%(name)s/%(time)s'
+EXPORT_SHARD_MAX_ITEMS = 10000
+EXPORT_SHARD_MAX_BYTES = 64 * 1024 * 1024
+EXPORT_PARQUET = True
+# Rows buffered per table before they are written as a Parquet row group
+EXPORT_PARQUET_BATCH_SIZE = 5000
 
 # Enable and configure the AutoThrottle extension (disabled by default)
 # See https://docs.scrapy.org/en/latest/topics/autothrottle.html
@@ -0,0 +1,14 @@
+# Signals sent by the spider, in addition to Scrapy's own (scrapy.signals)
+
+# A stage of scraping a restaurant finished. Args: stage (e.g.
+# "subpage/Food/extract"), seconds
+stage_timed = object()
+
+# The work of a request leased from the shared frontier is finished (see
+# tabelog_scraper.frontier). Args: frontier_id, failed (True if it was given
+# up on, e.g. its download failed after Scrapy's retries)
+frontier_request_done = object()
+
+# A page was rendered in a browser. Args: seconds (rendering only, not the
+# wait for a free driver; None if it failed), error (None on success)
+render_finished = object()
@@ -0,0 +1,312 @@
+# Declarative description of every section the spider extracts.
+#
+# A section spec is compiled two ways from the same definition:
+#   - compile_js() produces one script, registered in the browser once per
+#     document, that defines window.__tabelogExtract(names) and returns every
+#     requested section in a single WebDriver round-trip;
+#   - extractors.extract_section() interprets it with parsel on a plain Scrapy
+#     response.
+# Both return None for a section whose markup isn't in the document, and both
+# feed their raw records through the section's transform.
+import json
+import re
+from dataclasses import asdict, dataclass, field
+from typing import Callable, Optional
+
+
+@dataclass(frozen=True)
+class Field:
+    name: str
+    # CSS selector relative to the record; None means the record element itself
+    selector: Optional[str] = None
+    # Attribute to read; None means the element's text content
+    attr: Optional[str] = None
+    # Thumbnail size prefix removed from the value, e.g. '150x150_square_'
+    strip: Optional[str] = None
+    # Keep only the first group of this regular expression
+    regex: Optional[str] = None
+    # 'int' or 'float'; values that don't parse become None
+    type: Optional[str] = None
+    # Collect every match instead of the first one
+    many: bool = False
+    # Apply the selector (or children) to the record's next element sibling
+    sibling: bool = False
+    # Nested records
+    children: Optional["Section"] = None
+
+
+@dataclass(frozen=True)
+class Section:
+    # Selector of the repeated records
+    root: str
+    fields: tuple = ()
+    # Its absence means the markup is missing; defaults to root
+    container: Optional[str] = None
+    # When the container is missing, these decide the section is empty rather than missing
+    empty_if: Optional[str] = None
+    empty_unless: Optional[str] = None
+    # Only look inside the next sibling of the heading matching (selector, text)
+    heading: Optional[tuple] = None
+    # Drop records where this field is None
+    required: Optional[str] = None
+    # Return a list of this field's values instead of records
+    flatten: Optional[str] = None
+    # Return the first record instead of a list
+    single: bool = False
+    # Post-processing applied to the raw value on both paths
+    transform: Optional[Callable] = field(default=None, compare=False)
+
+
+def _group_restaurant_information(tables):
+    information = {
+        "details": [],
+        "seats_facilities": [],
+        "menu": [],
+        "feature_related_info": [],
+    }
+    for table in tables:
+        section = table["section"] or ""
+        if section == "Details":
+            information["details"] = table["rows"]
+        elif section == "Seats/facilities":
+            information["seats_facilities"] = table["rows"]
+        elif section == "Menu":
+            information["menu"] = table["rows"]
+        elif "Feature" in section:  # Matches "Feature - Related Information"
+            information["feature_related_info"] = table["rows"]
+    return information
+
+
+def _build_review_rating(ratings):
+    average_ratings = {
+        title: score for title, score in zip(ratings["titles"], ratings["scores"])
+        if title and score is not None
+    }
+    rating_distribution = [
+        {
+            "range": bucket["range"],
+            "percentage": bucket["percentage"] or 0,
+            "people": bucket["people"] or 0,
+        }
+        for bucket in ratings["rating_distribution"]
+    ]
+    return {
+        "average_ratings": average_ratings,
+        "rating_distribution": rating_distribution,
+    }
+
+
+# Walking distance from the station the card names as its area, e.g. " 350m", " 1.2km"
+STATION_DISTANCE_RE = re.compile(r"\s*[\d.,]+\s*k?m$")
+
+
+def _split_area_genre(cards):
+    # "Tenjin 350m / Sushi, Seafood" -> area "Tenjin", genre "Sushi, Seafood"
+    for card in cards:
+        area, _, genre = (card.pop("area_genre") or "").partition("/")
+        card["area"] = STATION_DISTANCE_RE.sub("", area.strip()) or None
+        card["genre"] = genre.strip() or None
+    return cards
+
+
+MENU_ITEM_FIELDS = (
+    Field("title", ".rstdtl-menu-lst__menu-title"),
+    Field("price", ".rstdtl-menu-lst__price"),
+    Field("description", ".rstdtl-menu-lst__ex"),
+    Field("image_src", ".rstdtl-menu-lst__img img", attr="src", strip="150x150_square_"),
+)
+
+SECTIONS = {
+    # Restaurant cards of an rstLst result page
+    "listing_cards": Section(
+        root=".list-rst",
+        required="url",
+        fields=(
+            Field("url", "a.list-rst__rst-name-target", attr="href"),
+            Field("name", "a.list-rst__rst-name-target"),
+            Field("area_genre", ".list-rst__area-genre"),
+            Field("rating", ".list-rst__rating-val", type="float"),
+            Field("review_count", ".list-rst__rvw-count-num", type="int"),
+        ),
+        transform=_split_area_genre,
+    ),
+    "specialities": Section(
+        root=".c-modal__contents",
+        # Cassettes without their modal markup need the browser; no cassettes means no section
+        empty_unless=".js-kodawari-cassete",
+        required="image_src",
+        fields=(
+            Field("image_src", ".rstdtl-top-kodawari__modal-photo img", attr="src", strip="320x320_square_"),
+            Field("title", ".rstdtl-top-kodawari__modal-title"),
+            Field("comment", ".rstdtl-top-kodawari__modal-comment"),
+            Field("label", ".rstdtl-top-kodawari__modal-label"),
+        ),
+    ),
+    "restaurant_information": Section(
+        root="h4.rstinfo-table__title",
+        fields=(
+            Field("section"),
+            Field("rows", sibling=True, children=Section(
+                root="tr",
+                fields=(
+                    Field("field", "th"),
+                    Field("value", "td span, td div span, td p"),
+                ),
+            )),
+        ),
+        transform=_group_restaurant_information,
+    ),
+    # Food, Drink and Lunch tabs share the same list markup; the restaurant
+    # navigation without a list means the tab is empty
+    "menu_items": Section(
+        root=".rstdtl-menu-lst__contents",
+        container=".rstdtl-menu-lst",
+        empty_if="li#rdnavi-menu",
+        required="image_src",
+        fields=MENU_ITEM_FIELDS,
+    ),
+    "set_menu": Section(
+        root=".rstdtl-course-list",
+        empty_if="li#rdnavi-menu",
+        required="image_src",
+        fields=(
+            Field("title", ".rstdtl-course-list__course-title-text"),
+            Field("description", ".rstdtl-course-list__desc"),
+            Field("price", ".rstdtl-course-list__price-num em"),
+            Field("link", ".rstdtl-course-list__target", attr="href"),
+            Field("image_src", ".rstdtl-course-list__img-target img", attr="src", strip="200x200_square_"),
+            Field("available_time", ".rstdtl-course-list__course-rule dd"),
+        ),
+    ),
+    "interior_photos": Section(
+        root=".rstdtl-thumb-list__item img",
+        container=".rstdtl-thumb-list",
+        empty_if="li#rdnavi-menu",
+        heading=(".c-heading3.rstdtl-photo__title", "Official photos"),
+        fields=(Field("src", attr="src", strip="150x150_square_"),),
+        required="src",
+        flatten="src",
+    ),
+    "review_rating": Section(
+        root="div.ratings-contents",
+        single=True,
+        fields=(
+            Field("titles", "dl.ratings-contents__table dt.ratings-contents__table-txt", many=True),
+            Field("scores", "dl.ratings-contents__table dd.ratings-contents__table-score",
+                  type="float", many=True),
+            Field("rating_distribution", children=Section(
+                root="li.ratings-contents__item",
+                required="range",
+                fields=(
+                    Field("range", "b.c-rating-v2__val.c-rating-v2__val--strong.ratings-contents__item-score"),
+                    Field("percentage", "span.ratings-contents__item-gauge", attr="style",
+                          regex=r"width:\s*(\d+)%", type="int"),
+                    Field("people", "strong.ratings-contents__item-num-strong", type="int"),
+                ),
+            )),
+        ),
+        transform=_build_review_rating,
+    ),
+}
+
+# What a section defaults to when it can't be extracted at all
+DEFAULTS = {
+    "restaurant_information": _group_restaurant_information([]),
+    "review_rating": {},
+}
+
+
+def default_for(name):
+    value = DEFAULTS.get(name, [])
+    return json.loads(json.dumps(value))  # fresh copy
+
+
+def spec_to_json(spec):
+    data = asdict(spec)
+
+    def drop_callables(value):
+        if isinstance(value, dict):
+            return {k: drop_callables(v) for k, v in value.items() if not callable(v)}
+        if isinstance(value, (list, tuple)):
+            return [drop_callables(v) for v in value]
+        return value
+
+    return drop_callables(data)
+
+
+EXTRACTOR_JS = """
+(function () {
+    const SPECS = %s;
+    const clean = s => s == null ? null : (s.replace(/\\s+/g, ' ').trim() || null);
+
+    function value(el, f) {
+        let v = f.attr ? el.getAttribute(f.attr) : el.textContent;
+        v = f.attr ? (v == null ? null : (v.trim() || null)) : clean(v);
+        if (v != null && f.strip) v = v.replace(f.strip, '');
+        if (v != null && f.regex) {
+            const m = v.match(new RegExp(f.regex));
+            v = m ? (m[1] !== undefined ? m[1] : m[0]) : null;
+        }
+        if (v != null && f.type === 'int') {
+            v = parseInt(v.replace(/,/g, ''), 10);
+            if (isNaN(v)) v = null;
+        } else if (v != null && f.type === 'float') {
+            v = parseFloat(v.replace(/,/g, ''));
+            if (isNaN(v)) v = null;
+        }
+        return v;
+    }
+
+    function field(record, f) {
+        const scope = f.sibling ? record.nextElementSibling : record;
+        if (!scope) return (f.many || f.children) ? [] : null;
+        if (f.children) return records(scope, f.children);
+        const els = f.selector ? Array.from(scope.querySelectorAll(f.selector)) : [scope];
+        if (f.many) return els.map(el => value(el, f)).filter(v => v != null);
+        return els.length ? value(els[0], f) : null;
+    }
+
+    function records(scope, spec) {
+        if (spec.heading) {
+            const heading = Array.from(scope.querySelectorAll(spec.heading[0]))
+                .find(el => clean(el.textContent) === spec.heading[1]);
+            scope = heading ? heading.nextElementSibling : null;
+            if (!scope) return [];
+        }
+        let out = Array.from(scope.querySelectorAll(spec.root)).map(el => {
+            const record = {};
+            for (const f of spec.fields) record[f.name] = field(el, f);
+            return record;
+        });
+        if (spec.required) out = out.filter(r => r[spec.required] != null);
+        if (spec.flatten) out = out.map(r => r[spec.flatten]);
+        return out;
+    }
+
+    function section(spec) {
+        if (!document.querySelector(spec.container || spec.root)) {
+            if (spec.empty_if && document.querySelector(spec.empty_if)) return [];
+            if (spec.empty_unless && !document.querySelector(spec.empty_unless)) return [];
+            return null;
+        }
+        const out = records(document, spec);
+        return spec.single ? (out[0] || null) : out;
+    }
+
+    window.__tabelogExtract = names => Object.fromEntries(
+        names.map(name => [name, SPECS[name] ? section(SPECS[name]) : null]));
+})();
+"""
+
+
+def compile_js(sections=SECTIONS):
+    """The browser-side extractor for ``sections`` as a self-registering script."""
+    return EXTRACTOR_JS % json.dumps({name: spec_to_json(spec) for name, spec in sections.items()})
+
+
+def finish(name, raw):
+    """Apply the section's transform to a raw value from either path."""
+    if raw is None:
+        return None
+    transform = SECTIONS[name].transform
+    return transform(raw) if transform else raw
@@ -1,14 +1,32 @@
-from venv import logger
-
 import scrapy
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support import expected_conditions as EC
-from scrapy.http import HtmlResponse
-import time
+from itemadapter import ItemAdapter
+from scrapy import signals
+from scrapy.exceptions import DontCloseSpider, NotConfigured
+from scrapy.spidermiddlewares.httperror import HttpError
+from scrapy.utils.defer import maybe_deferred_to_future
 import logging
+import math
+import time
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+from w3lib.url import add_or_replace_parameter
+
+from tabelog_scraper.assembly import ItemAssembler
+from tabelog_scraper.browser import BrowserCrashed, DriverPool
+from tabelog_scraper.cacheproxy import CachingProxy
+from tabelog_scraper.dedup import RestaurantIdSet
+from tabelog_scraper.index import RestaurantIndex
+from tabelog_scraper.items import Restaurant
+from tabelog_scraper.signals import frontier_request_done, render_finished, stage_timed
+from tabelog_scraper.extractors import (
+    extract_headline_description, extract_listing_pagination, extract_menu_tabs, extract_section,
+)
+from tabelog_scraper.specs import SECTIONS, compile_js, default_for, finish
+from tabelog_scraper.utils import listing_page_url, restaurant_id, restaurant_url
+from tabelog_scraper.waits import AdaptiveWaiter
+
+logger = logging.getLogger(__name__)
 
 # Set Selenium logging level to WARNING
 logging.getLogger('selenium').setLevel(logging.WARNING)
@@ -16,89 +34,266 @@ logging.getLogger('selenium').setLevel(logging.WARNING)
 # Set Scrapy logging level to WARNING
 logging.getLogger('scrapy').setLevel(logging.WARNING)
 
+MENU_TABS = ("Set_Menu", "Food", "Drink", "Lunch")
+
+# Sub-pages of every restaurant: part -> (path under the restaurant URL, section in specs.SECTIONS)
+SUBPAGES = {
+    "Set_Menu": ("party/", "set_menu"),
+    "Food": ("dtlmenu/", "menu_items"),
+    "Drink": ("dtlmenu/drink/", "menu_items"),
+    "Lunch": ("dtlmenu/lunch/", "menu_items"),
+    "interior_photos": ("dtlphotolst/3/smp2/", "interior_photos"),
+    "review_rating": ("dtlratings/", "review_rating"),
+}
+
+# Sections of the detail page itself: part -> section in specs.SECTIONS
+DETAIL_SECTIONS = {
+    "specialities": "specialities",
+    "restaurant_information": "restaurant_information",
+}
+
+LISTING_CARD_FIELDS = ("name", "area", "genre", "rating", "review_count")
+
+# Finish the restaurants already started before starting new ones, and both
+# before discovering more (see tabelog_scraper.scheduler)
+SUBPAGE_PRIORITY = 20
+DETAIL_PRIORITY = 10
+LISTING_PRIORITY = 0
+
+# Calls the extractor the pool registers in every document
+EXTRACT_CALL = "return window.__tabelogExtract ? window.__tabelogExtract(arguments[0]) : null;"
+
+
+def parse_prefectures(value):
+    """Prefecture codes from e.g. '13,14' or '1-47'."""
+    codes = []
+    for part in str(value).split(','):
+        first, _, last = part.strip().partition('-')
+        codes.extend(range(int(first), int(last or first) + 1))
+    return codes
+
+
+def subpage_fields(part, value):
+    # Menu tabs are nested under "menu", everything else is a top-level field
+    if part in MENU_TABS:
+        return {"menu": {part: value}}
+    return {part: value}
+
 class RestaurantsSpider(scrapy.Spider):
     name = "restaurants"
     allowed_domains = ["tabelog.com"]
     start_urls = ['https://tabelog.com/en/rstLst/?utf8=%E2%9C%93&svd=&svt=1900&svps=2&vac_net=1&pcd=41']
 
-    def __init__(self, num_restaurants=1, *args, **kwargs):
+    def __init__(self, num_restaurants=1, start_url=None, prefectures=None, *args, **kwargs):
         super(RestaurantsSpider, self).__init__(*args, **kwargs)
         # Desired number of restaurant links
         self.num_restaurants = int(num_restaurants)
+        if start_url:
+            # Another listing, or a stand-in site (see benchmarks/)
+            self.start_urls = [start_url]
+            self.allowed_domains = [urlsplit(start_url).hostname]
+        if prefectures:
+            # The same search in each prefecture, e.g. -a prefectures=1-47 or -a prefectures=13,14
+            self.start_urls = [add_or_replace_parameter(url, 'pcd', str(pcd))
+                               for url in self.start_urls for pcd in parse_prefectures(prefectures)]
         self.collected_links = 0  # Counter for collected links
 
         # Timing variables
         self.total_scraping_time = 0
         self.processed_links = 0
+        # When each restaurant's detail page arrived, for the item/total stage
+        self.detail_started = {}
+        # Frontier leases of detail pages, held until the restaurant's item is done
+        self.frontier_ids = {}
+        # Section retries waiting out their backoff (reactor.callLater calls)
+        self.delayed_requests = set()
+
+        # Crawl progress; persisted in JOBDIR by the SpiderState and
+        # SpiderStateCheckpoint extensions so an interrupted crawl can resume
+        self.state = {}
+        # Restaurants whose detail page was requested but whose item wasn't scraped yet
+        self.pending_restaurants = {}
+        # Result pages of each listing, keyed by its first page URL, once its size is known
+        self.listings = {}
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super(RestaurantsSpider, cls).from_crawler(crawler, *args, **kwargs)
+        spider.waiter = AdaptiveWaiter.from_settings(crawler.settings)
+        # Collects the sub-page results of each restaurant into one item
+        spider.assembler = ItemAssembler.from_settings(crawler.settings, factory=Restaurant.from_dict,
+                                                       stats=crawler.stats)
+        # Restaurants already requested; the same restaurant shows up on several listing pages
+        spider.requested = RestaurantIdSet.from_settings(crawler.settings, "requested_restaurants")
+        # What earlier runs already scraped, for incremental crawls
+        spider.index = None
+        if crawler.settings.getbool('INDEX_ENABLED'):
+            spider.index = RestaurantIndex.from_settings(crawler.settings)
+        crawler.signals.connect(spider.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(spider.spider_idle, signal=signals.spider_idle)
+        crawler.signals.connect(spider.item_done, signal=signals.item_scraped)
+        crawler.signals.connect(spider.item_done, signal=signals.item_dropped)
+        return spider
+
+    def spider_opened(self, spider):
+        # Created here rather than in from_crawler because they report to the
+        # stats collector, which only exists once the crawl starts.
+
+        # Optionally route the browsers through a proxy backed by Scrapy's HTTP cache
+        self.cache_proxy = None
+        settings = self.crawler.settings
+        if settings.getbool('HTTPCACHE_ENABLED') and settings.getbool('BROWSER_CACHE_PROXY_ENABLED'):
+            try:
+                self.cache_proxy = CachingProxy.from_crawler(self.crawler)
+            except NotConfigured as e:
+                logger.warning(f"Not starting the browser cache proxy: {e}")
+            else:
+                self.cache_proxy.start(self)
+
+        # Pool of browsers; all Selenium work runs on its worker threads, off the reactor.
+        # Drivers start with the first page that needs rendering, or now in the
+        # background with BROWSER_PREWARM
+        self.extractor_js = compile_js()
+        self.driver_pool = DriverPool.from_crawler(
+            self.crawler, proxy=self.cache_proxy.address if self.cache_proxy else None,
+            init_scripts=[self.extractor_js])
+        prewarm = settings.getint('BROWSER_PREWARM', 0)
+        if prewarm:
+            self.driver_pool.prewarm(prewarm)
+
+    def start_requests(self):
+        # spider.state is loaded from JOBDIR by the time the first start request is pulled
+        previous = dict(self.state)
+        self.state['closed_reason'] = None
+        if not previous or previous.get('closed_reason') == 'finished':
+            self.state.clear()
+            self.state['closed_reason'] = None
+            yield from self.listing_start_requests()
+            return
+
+        self.collected_links = previous.get('collected_links', 0)
+        self.pending_restaurants = dict(previous.get('pending_restaurants', {}))
+        self.listings = previous.get('listings', {})
+        logger.info(f"Resuming crawl: {self.collected_links} restaurants collected, "
+                    f"{len(self.pending_restaurants)} pending")
+        self.crawler.stats.set_value('resume/pending_restaurants', len(self.pending_restaurants))
+
+        if previous.get('closed_reason') is not None:
+            # Clean shutdown: the outstanding requests are in JOBDIR's request queue
+            # and the start URLs are filtered out as already seen
+            self.assembler.load(previous.get('partial_items', {}))
+            yield from self.listing_start_requests(dont_filter=False)
+            return
+
+        # The previous run died without saving its queue; pick up from the last
+        # checkpoint instead; partial items are rebuilt from their detail pages
+        if self.listings:
+            for listing in self.listings.values():
+                unfinished = [page for page in range(2, listing['issued'] + 1)
+                              if page not in listing['done']]
+                for page in unfinished:
+                    yield self.listing_request(listing, page, dont_filter=True)
+                if not unfinished:
+                    yield from self.listing_requests(listing)
+        else:
+            cursor = previous.get('listing_cursor', self.start_urls[0] if self.start_urls else None)
+            if cursor and self.collected_links < self.num_restaurants:
+                yield self.listing_page_request(cursor, dont_filter=True)
+        for rid, url in list(self.pending_restaurants.items()):
+            yield self.detail_request(url, self.index.get(rid) if self.index else None, dont_filter=True)
+
+    def listing_start_requests(self, dont_filter=True):
+        for url in self.start_urls:
+            yield self.listing_page_request(url, dont_filter=dont_filter)
+
+    def update_state(self):
+        """Copy the crawl progress into ``self.state``; called before every checkpoint."""
+        self.state['collected_links'] = self.collected_links
+        self.state['pending_restaurants'] = dict(self.pending_restaurants)
+        self.state['partial_items'] = self.assembler.dump()
+        self.state['listings'] = {key: dict(listing, done=set(listing['done']))
+                                  for key, listing in self.listings.items()}
+
+    def item_done(self, item, response, spider, **kwargs):
+        url = ItemAdapter(item).get('url')
+        rid = restaurant_id(url) if url else None
+        self.pending_restaurants.pop(rid, None)
+        self.frontier_done(self.frontier_ids.pop(rid, None))
+        started = self.detail_started.pop(rid, None)
+        if started is not None:
+            elapsed = time.monotonic() - started
+            self.total_scraping_time += elapsed
+            self.processed_links += 1
+            self.stage_done('item/total', elapsed)
+
+    def frontier_done(self, frontier_id, failed=False):
+        if frontier_id is not None:
+            self.crawler.signals.send_catch_log(signal=frontier_request_done, frontier_id=frontier_id,
+                                                failed=failed)
+
+    def stage_done(self, stage, seconds):
+        # Collected into stages/* stats by the StageLatencyStats extension
+        self.crawler.signals.send_catch_log(signal=stage_timed, stage=stage, seconds=seconds)
+
+    @contextmanager
+    def timed(self, stage):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.stage_done(stage, time.monotonic() - start)
 
-        chrome_options = Options()
-        # chrome_options.add_argument("--headless")  # Uncomment if you don't need GUI
-        chrome_options.add_argument("--disable-gpu")
-        chrome_options.add_argument("--no-sandbox")
-        self.driver = webdriver.Chrome(options=chrome_options)
-        self.driver.maximize_window()
-
-        # Wait times for different operations
-        self.wait_general = 10
-        self.wait_modal = 5
-        self.wait_menu = 10
-        self.wait_photos = 10
+    def download_timed(self, stage, response):
+        if 'download_latency' in response.meta:
+            self.stage_done(stage, response.meta['download_latency'])
 
     def parse(self, response):
-        self.driver.get(response.url)
-
-# try:
-        #     # Wait for the modal to appear (up to 10 seconds)
-        #     WebDriverWait(self.driver, 10).until(
-        #         EC.presence_of_element_located(
-        #             (By.CSS_SELECTOR, 'div.c-lang-switch__inner.js-lang-change-text-en'))
-        #     )
-
-        #     # Find and click the "Switch to English" button
-        #     switch_to_english_button = WebDriverWait(self.driver, 10).until(
-        #         EC.element_to_be_clickable(
-        #             (By.CSS_SELECTOR, 'a.c-btn.c-lang-switch__btn.js-inbound-link.js-analytics-lang-switch'))
-        #     )
-        #     switch_to_english_button.click()
-
-        #     # Wait for the page to reload (adjust wait time depending on network speed)
-        #     WebDriverWait(self.driver, 10).until(
-        #         EC.presence_of_element_located(
-        #             (By.CSS_SELECTOR, 'a.list-rst__rst-name-target'))
-        #         # Example element after reload
-        #     )
-        # except Exception as e:
-        #     self.logger.info(
-        #         f"Language switch modal not found or already handled: e")
-
-        body = self.driver.page_source
-        response = HtmlResponse(
-            self.driver.current_url, body=body, encoding='utf-8', request=response.request)
-
-        # Extract links to restaurant detail pages
-        restaurant_links = response.css(
-            'a.list-rst__rst-name-target::attr(href)').getall()
-
-        print(f"Found {len(restaurant_links)} restaurant links on the page.")
-        print(restaurant_links)
-        # just for debugging, append all links to a file and also the number of links found
-        with open('restaurant_links.txt', 'a') as f:
-            f.write(f"Found {self.collected_links} restaurant links on the previous.\n")
-            for link in restaurant_links:
-                f.write(link + '\n')
-        # Log the number of links found
+        # Listing pages are server-rendered; they never need the browser
+        page = response.meta.get('listing_page')
+        key = response.meta.get('listing') or listing_page_url(response.url, 1)
+        listing = self.listings.get(key)
+        if page is not None and self.collected_links >= self.num_restaurants:
+            # Fanned out before the earlier pages covered the budget
+            if listing is not None:
+                listing['done'].add(page)
+            return
+        self.download_timed('listing/download', response)
+
+        # Extract the restaurant cards and their links to the detail pages
+        cards = extract_section(response, "listing_cards") or []
+        restaurant_links = [card['url'] for card in cards]
+
         self.logger.info(
             f"Found {len(restaurant_links)} restaurant links on the page.")
+        logger.debug(f"Restaurant links on {response.url}: {restaurant_links}")
 
         # Process links in batches of 5
         batch_size = 5
         for i in range(0, len(restaurant_links), batch_size):
-            batch_links = restaurant_links[i:i + batch_size]
-
-            for link in batch_links:
+            batch_cards = cards[i:i + batch_size]
+
+            for card in batch_cards:
+                link = response.urljoin(card.pop('url'))
+                rid = restaurant_id(link)
+                if rid:
+                    # Canonical URL, without the tracking query strings listing links carry
+                    link = restaurant_url(link)
                 if self.collected_links < self.num_restaurants:
+                    if rid and rid in self.requested:
+                        # Already requested; doesn't count towards the budget
+                        self.crawler.stats.inc_value('dedup/requests_dropped')
+                        continue
+                    entry = self.index.get(rid) if self.index else None
+                    if self.index and self.index.is_fresh(entry):
+                        # Scraped recently enough; doesn't count towards the budget. Not
+                        # recorded as requested, so a later job refreshes it once it's stale
+                        self.crawler.stats.inc_value('index/skipped_fresh')
+                        continue
+                    if rid:
+                        self.requested.add(rid)
                     self.collected_links += 1
-                    yield scrapy.Request(link, callback=self.parse_detail)
+                    self.pending_restaurants[rid or link] = link
+                    yield self.detail_request(link, entry, card=card)
                 else:
                     break
 
@@ -106,549 +301,331 @@ class RestaurantsSpider(scrapy.Spider):
             if self.collected_links >= self.num_restaurants:
                 break
 
+        if listing is None and page is None:
+            listing = self.listing_from(response)
+            if listing is not None:
+                self.listings[key] = listing
+        if listing is not None:
+            listing['done'].add(page or 1)
+            # Once every page issued so far is parsed, fan out more if the budget isn't covered yet
+            if all(p in listing['done'] for p in range(1, listing['issued'] + 1)):
+                for request in self.listing_requests(listing):
+                    yield request
+            return
+        if page is not None:
+            # Fanned out by another worker sharing the frontier, which follows the listing
+            return
+
         # Handle next page if more links are needed
+        self.state['listing_cursor'] = None
         if self.collected_links < self.num_restaurants:
             next_page = response.css(
                 'a.c-pagination__arrow--next::attr(href)').get()
             if next_page:
-                print(f"Found next page: {next_page}")
-                yield scrapy.Request(response.urljoin(next_page), callback=self.parse)
-
-    def parse_detail(self, response):
-        start_time = time.time()  # Start timing
-
-        self.driver.get(response.url)
-        body = self.driver.page_source
-        response = HtmlResponse(
-            self.driver.current_url, body=body, encoding='utf-8', request=response.request)
-
-        headline, full_description = self.get_headline_description(response)
-        specialities = self.fetch_specialities_data()
-        setmenu = self.navigate_to_menu()
-        restaurant_information = self.parse_restaurant_information()
-        interior_photos = self.navigate_and_get_interior_official_photos()
-
+                logger.debug(f"Found next page: {next_page}")
+                self.state['listing_cursor'] = response.urljoin(next_page)
+                yield self.listing_page_request(response.urljoin(next_page))
+
+    def listing_from(self, response):
+        """How many result pages the listing at ``response`` has, or None to follow it page by page."""
+        total, per_page, last_linked = extract_listing_pagination(response)
+        next_page = response.css('a.c-pagination__arrow--next::attr(href)').get()
+        # Only fan out when the page URLs we'd build are the ones Tabelog links to
+        if not (per_page and (total or last_linked) and next_page
+                and response.urljoin(next_page) == listing_page_url(response.url, 2)):
+            return None
+        last_page = math.ceil(total / per_page) if total else last_linked
+        last_page = min(last_page, self.settings.getint('LISTING_MAX_PAGES', 60))
+        logger.info(f"Listing has {total or '?'} restaurants on {last_page} pages of {per_page}")
+        return {'url': response.url, 'per_page': per_page, 'last_page': last_page,
+                'issued': 1, 'done': set()}
+
+    def listing_requests(self, listing):
+        # Enough result pages to cover what's left of the budget, all at once
+        remaining = self.num_restaurants - self.collected_links
+        if remaining <= 0:
+            return
+        first = listing['issued'] + 1
+        last = min(listing['last_page'], listing['issued'] + math.ceil(remaining / listing['per_page']))
+        for page in range(first, last + 1):
+            listing['issued'] = page
+            yield self.listing_request(listing, page)
+
+    def listing_request(self, listing, page, dont_filter=False):
+        return self.listing_page_request(
+            listing_page_url(listing['url'], page), dont_filter=dont_filter,
+            meta={'listing_page': page, 'listing': listing_page_url(listing['url'], 1)})
+
+    def listing_page_request(self, url, dont_filter=False, meta=None):
+        # Listing pages are discovery, held back while the restaurant backlog is full.
+        # With the FrontierScheduler, listing and detail pages are shared with other workers
+        return scrapy.Request(url, callback=self.parse, priority=LISTING_PRIORITY, dont_filter=dont_filter,
+                              meta={**(meta or {}), 'discovery': True, 'frontier': True})
+
+    def detail_request(self, url, entry=None, dont_filter=False, card=None):
+        # Restaurants seen before are revalidated, and wait behind ones never scraped
+        headers = self.index.conditional_headers(entry) if self.index else {}
+        return scrapy.Request(
+            url, callback=self.parse_detail, errback=self.detail_failed, headers=headers,
+            priority=DETAIL_PRIORITY - 1 if entry else DETAIL_PRIORITY,
+            meta={'handle_httpstatus_list': [304], 'frontier': 'item'}, dont_filter=dont_filter,
+            cb_kwargs={'card': card})
+
+    async def parse_detail(self, response, card=None):
+        rid = restaurant_id(response.url) or response.url
+        self.download_timed('detail/download', response)
+        if response.status == 304:
+            logger.info(f"Restaurant {rid} not modified since last scrape")
+            self.crawler.stats.inc_value('index/not_modified')
+            self.index.touch(rid)
+            self.pending_restaurants.pop(rid, None)
+            self.frontier_done(response.meta.get('frontier_id'))
+            return
+        if self.index:
+            self.index.record_validators(
+                rid, response.url,
+                response.headers.get('ETag', b'').decode() or None,
+                response.headers.get('Last-Modified', b'').decode() or None)
+
+        self.detail_started[rid] = time.monotonic()
+        if 'frontier_id' in response.meta:
+            self.frontier_ids[rid] = response.meta['frontier_id']
+        headline, full_description = extract_headline_description(response)
+
+        sections, failed = await self.extract_sections(response, DETAIL_SECTIONS, stage='detail')
+
+        # Name, area, genre, rating and review count as shown on the listing card
+        card = card or {}
         data = {
+            **{field: card.get(field) for field in LISTING_CARD_FIELDS},
             "editorial_overview": {
                 "headline": headline,
                 "description": full_description,
             },
             "review_rating": {},
-            "specialities": specialities,
-            "menu": setmenu,
-            "restaurant_information": restaurant_information,
-            "interior_photos": interior_photos,
+            "specialities": sections["specialities"],
+            "menu": {tab_name: [] for tab_name in MENU_TABS},
+            "restaurant_information": sections["restaurant_information"],
+            "interior_photos": [],
             'url': response.url
         }
 
-        try:
-            # Additional scraping logic for ratings (if applicable)
-            ratings_url = response.css('a#rating::attr(href)').get()
-            if ratings_url:
-                self.driver.get(ratings_url)
-                WebDriverWait(self.driver, 3).until(EC.presence_of_element_located(
-                    (By.CSS_SELECTOR, 'div.ratings-contents')))
-                body = self.driver.page_source
-                ratings_response = HtmlResponse(self.driver.current_url, body=body, encoding='utf-8',
-                                                request=response.request)
-                
-                # logger.info("Extracting average ratings...")
-
-                # Extract Average Ratings
-                average_ratings = {}
-
-                # Extract titles and scores for average ratings
-                rating_titles = ratings_response.css(
-                    'dl.ratings-contents__table dt.ratings-contents__table-txt::text').getall()
-                rating_scores = ratings_response.css(
-                    'dl.ratings-contents__table dd.ratings-contents__table-score::text').getall()
-
-                if not rating_titles or not rating_scores:
-                    logger.warning("Rating titles or scores are missing!")
-                else:
-                    # Combine titles and scores into a dictionary
-                    for title, score in zip(rating_titles, rating_scores):
-                        average_ratings[title.strip()] = float(score.strip())
-                    # logger.info(f"Extracted average ratings: {average_ratings}")
-
-                # Extract Rating Distribution
-                rating_distribution = []
-
-                # Find all distribution items
-                distribution_items = ratings_response.css(
-                    'li.ratings-contents__item')
-
-                if not distribution_items:
-                    logger.warning(
-                        "No distribution items found! Check the page structure.")
-                else:
-                    # Loop through each item and extract details
-                    for index, item in enumerate(distribution_items, start=1):
-                        try:
-                            # Get the range (e.g., "5.0", "4.5 - 4.9")
-                            rating_range = item.css(
-                                'b.c-rating-v2__val.c-rating-v2__val--strong.ratings-contents__item-score::text'
-                            ).get()
-                            rating_range = rating_range.strip() if rating_range else None
-
-                            # Extract percentage width (e.g., "7%") from inline style
-                            percentage_width = item.css(
-                                'span.ratings-contents__item-gauge::attr(style)'
-                            ).re_first(r'width:\s*(\d+)%')
-                            percentage_width = int(
-                                percentage_width) if percentage_width else 0
-
-                            # Get people count (number of individuals who gave this rating)
-                            people_count = item.css(
-                                'strong.ratings-contents__item-num-strong::text'
-                            ).get()
-                            people_count = int(
-                                people_count.strip()) if people_count else 0
-
-                            # Append the extracted data to the list
-                            if rating_range:
-                                rating_distribution.append({
-                                    "range": rating_range,
-                                    "percentage": percentage_width,
-                                    "people": people_count
-                                })
-                        except Exception as e:
-                            logger.error(
-                                f"Error extracting distribution item {index}: e")
-
-                # Add extracted data to review_rating
-                data["review_rating"] = {
-                    "average_ratings": average_ratings,
-                    "rating_distribution": rating_distribution
-                }
-
-                # Log the final structured data
-                # logger.info(f"Final extracted ratings data: {data['review_rating']}")
-        except Exception as e:
-            self.logger.error(f"Error navigating to Ratings page: e")
-
-        # Yield the final result
-        yield data
-
-    def switch_to_english(self):
-        try:
-            # Wait for the modal to appear
-            WebDriverWait(self.driver, self.wait_modal).until(
-                EC.presence_of_element_located(
-                    (By.CSS_SELECTOR, 'div.c-lang-switch__inner.js-lang-change-text-en'))
-            )
-
-            # Find and click the "Switch to English" button
-            switch_to_english_button = WebDriverWait(self.driver, self.wait_modal).until(
-                EC.element_to_be_clickable(
-                    (By.CSS_SELECTOR, 'a.c-btn.c-lang-switch__btn.js-inbound-link.js-analytics-lang-switch'))
-            )
-            switch_to_english_button.click()
-
-            # Wait for the page to reload
-            WebDriverWait(self.driver, self.wait_general).until(
-                EC.presence_of_element_located(
-                    (By.CSS_SELECTOR, 'a.list-rst__rst-name-target'))
-            )
-        except Exception as e:
-            self.logger.info(
-                f"Language switch modal not found or already handled: e")
-
-    def get_headline_description(self, response):
-        # Extract the visible part of the description
-        visible_description = response.css(
-            'span.pr-comment__first::text').get()
-
-        # Extract hidden part of the description
-        hidden_description = response.css('span.pr-comment__over::text').get()
-
-        # Combine both parts into a meaningful full description
-        if visible_description and hidden_description:
-            full_description = visible_description.strip() + hidden_description.strip()
-        elif visible_description:
-            full_description = visible_description.strip()
-        else:
-            full_description = None
-
-        # Extract and log the headline for debugging
-        headline = response.css('h3.pr-comment-title.js-pr-title::text').get()
-        if headline:
-            headline = headline.strip()
-
-        return headline, full_description
-
-    def fetch_specialities_data(self):
-        try:
-            # Wait for the 'Specialities' section to load
-            specialities_section = WebDriverWait(self.driver, self.wait_general).until(
-                EC.presence_of_all_elements_located((By.CLASS_NAME, "js-kodawari-cassete"))
-            )
-
-            if not specialities_section:
-                logger.warning("No specialities section found!")
-                return []
-
-            # logger.info(f"Found {len(specialities_section)} specialities.")
-
-            # Click on the first speciality item to open the modal
-            first_item = specialities_section[0]
-            self.driver.execute_script("arguments[0].scrollIntoView(true);", first_item)
-            first_item.click()
-            # logger.info("Clicked on the first speciality item.")
-
-            # Force rendering of all modal contents
-            self.driver.execute_script(
-                "document.querySelectorAll('.c-modal__contents').forEach(modal => modal.classList.remove('is-hidden'));"
-            )
-
-            # Use JavaScript to get all modal contents
-            modal_contents = self.driver.execute_script(
-                "return Array.from(document.querySelectorAll('.c-modal__contents')).map(modal => {"
-                "    return {"
-                "        image_src: modal.querySelector('.rstdtl-top-kodawari__modal-photo img')?.getAttribute('src')?.replace('320x320_square_', '') || null,"
-                "        title: modal.querySelector('.rstdtl-top-kodawari__modal-title')?.innerText.trim() || null,"
-                "        comment: modal.querySelector('.rstdtl-top-kodawari__modal-comment')?.innerText.trim() || null,"
-                "        label: modal.querySelector('.rstdtl-top-kodawari__modal-label')?.innerText.trim() || null"
-                "    };"
-                "}).filter(item => item.image_src !== null);"
-            )
-
-            # logger.info(f"Extracted {len(modal_contents)} modal contents.")
-
-            # Close the modal at the end
-            try:
-                close_button = WebDriverWait(self.driver, self.wait_modal).until(
-                    EC.element_to_be_clickable((By.CLASS_NAME, "js-modal-close"))
-                )
-                close_button.click()
-                logger.info("Closed the modal.")
-            except Exception as e:
-                logger.warning(f"Failed to close the modal: e")
-
-            return modal_contents
-
-        except Exception as e:
-            logger.error(f"Failed to retrieve 'Specialities' data: e")
-            return []
-
-    def navigate_to_menu(self):
-        try:
-            # Wait for the Menu tab to appear
-            menu_tab = WebDriverWait(self.driver, self.wait_menu).until(
-                EC.presence_of_element_located(
-                    (By.CSS_SELECTOR, "li#rdnavi-menu a.mainnavi"))
-            )
-
-            # Check if an overlay is present and close it
+        # All sub-pages live at predictable paths under the restaurant URL, so they are
+        # requested in parallel and joined back into one item by restaurant ID
+        base_url = restaurant_url(response.url)
+        tab_counts = {tab_name: count for tab_name, (_, count) in extract_menu_tabs(response).items()}
+
+        requests = []
+        for part, (path, _) in SUBPAGES.items():
+            if tab_counts.get(part) == 0:
+                logger.info(f"Skipping {part} tab as item count is 0.")
+                continue
+            url = base_url + path
+            if part == "review_rating":
+                url = response.urljoin(response.css('a#rating::attr(href)').get() or url)
+            requests.append(scrapy.Request(
+                url, callback=self.parse_subpage, errback=self.subpage_failed, dont_filter=True,
+                priority=SUBPAGE_PRIORITY,
+                cb_kwargs={"restaurant_id": rid, "part": part}))
+
+        # Detail sections that failed stay outstanding while they are retried
+        parts = [request.cb_kwargs["part"] for request in requests] + sorted(failed)
+        item = self.assembler.start(rid, data, parts)
+        if item is not None:
+            yield item
+        for part in sorted(failed):
+            # With SECTION_RETRY_TIMES = 0 this fails the part at once, which may finish the item
+            item = self.retry_section(rid, part, response.url, attempt=0)
+            if item is not None:
+                yield item
+        for request in requests:
+            yield request
+
+    def detail_failed(self, failure):
+        # After Scrapy's own retries; the restaurant is picked up again by the next crawl
+        request = failure.request
+        logger.error(f"Failed to fetch {request.url}: {failure.value!r}")
+        self.crawler.stats.inc_value('detail/failed')
+        self.pending_restaurants.pop(restaurant_id(request.url) or request.url, None)
+        self.frontier_done(request.meta.get('frontier_id'), failed=True)
+
+    def section_request(self, url, restaurant_id, part, attempt):
+        callback = self.parse_detail_section if part in DETAIL_SECTIONS else self.parse_subpage
+        # From the server, not the HTTP cache, which may hold the page that failed
+        return scrapy.Request(
+            url, callback=callback, errback=self.subpage_failed, dont_filter=True,
+            priority=SUBPAGE_PRIORITY, meta={"dont_cache": True},
+            cb_kwargs={"restaurant_id": restaurant_id, "part": part, "attempt": attempt})
+
+    def retry_section(self, restaurant_id, part, url, attempt):
+        """Request ``part`` again after a backoff, or give up on it; returns the item if that finished it."""
+        settings = self.crawler.settings
+        if attempt >= settings.getint('SECTION_RETRY_TIMES', 2):
+            self.crawler.stats.inc_value(f'sections/failed/{part}')
+            return self.assembler.fail(restaurant_id, part)
+        delay = settings.getfloat('SECTION_RETRY_DELAY', 30) * 2 ** attempt
+        if not self.assembler.retry(restaurant_id, part, delay):
+            return None
+        logger.info(f"Retrying {part} of restaurant {restaurant_id} in {delay:.0f}s")
+        self.crawler.stats.inc_value(f'sections/retried/{part}')
+        self.crawl_later(self.section_request(url, restaurant_id, part, attempt + 1), delay)
+        return None
+
+    def crawl_later(self, request, delay):
+        from twisted.internet import reactor
+
+        def crawl():
+            self.delayed_requests.discard(call)
+            self.crawler.engine.crawl(request)
+
+        call = reactor.callLater(delay, crawl)
+        self.delayed_requests.add(call)
+
+    def render_sections(self, driver, url, sections):
+        """Values of ``sections`` rendered in ``driver``, and the seconds it took."""
+        start = time.monotonic()
+        driver.get(url)
+        # Each section once it's there, or once the page shows it's empty; the
+        # ones after the first have usually arrived by then
+        for name in sections:
+            spec = SECTIONS[name]
+            self.waiter.wait(driver, spec.container or spec.root, absent_if=spec.empty_if)
+
+        # Every requested section comes back from one script call
+        values = driver.execute_script(EXTRACT_CALL, sections)
+        if values is None:
+            # The extractor wasn't registered in this document (e.g. no CDP support)
+            values = driver.execute_script(self.extractor_js + EXTRACT_CALL, sections)
+        return values, time.monotonic() - start
+
+    async def render(self, response, sections):
+        """Values of ``sections`` rendered from ``response.url``; None if rendering failed.
+
+        A render whose browser crashed goes back to the pool, which has replaced
+        that browser, up to BROWSER_CRASH_RETRIES times.
+        """
+        retries = self.crawler.settings.getint('BROWSER_CRASH_RETRIES', 2)
+        for attempt in range(retries + 1):
             try:
-                overlay = WebDriverWait(self.driver, self.wait_modal).until(
-                    EC.presence_of_element_located(
-                        (By.CSS_SELECTOR, "div.c-overlay.js-overlay.js-modal-overlay-clickarea.is-closeable"))
-                )
-                if overlay:
-                    logger.info("Closing overlay...")
-                    self.driver.execute_script("arguments[0].click();", overlay)
-                    WebDriverWait(self.driver, self.wait_modal).until(
-                        EC.invisibility_of_element(overlay))
-                    logger.info("Overlay closed.")
+                rendered, seconds = await maybe_deferred_to_future(self.driver_pool.run(
+                    self.render_sections, response.url, sections))
+            except BrowserCrashed as e:
+                self.crawler.signals.send_catch_log(signal=render_finished, seconds=None, error=e)
+                if attempt < retries:
+                    logger.warning(f"{e}; rendering {response.url} again")
+                    self.crawler.stats.inc_value('browser/render_retries')
+                    continue
+                logger.error(f"Giving up rendering {response.url} after {attempt + 1} browser crashes")
+                self.crawler.stats.inc_value('browser/render_crash_failures')
+                return None
             except Exception as e:
-                logger.info("No overlay found or already handled.")
-
-            # Log the href attribute of the Menu tab
-            menu_tab_url = menu_tab.get_attribute('href')
-            logger.info(f"Navigating to Menu tab: {menu_tab_url}")
-
-            # Scroll to the Menu tab and click it
-            self.driver.execute_script("arguments[0].scrollIntoView(true);", menu_tab)
-            menu_tab.click()
-
-            # Define a dictionary to store menu data from all tabs
-            menu_data = {}
-
-            # Define the tabs to navigate (Set Menu, Food, Drink, Lunch)
-            menu_tabs = {
-                "Set_Menu": "li.rstdtl-navi__sublist-item a[href*='/party/']",
-                "Food": "li.rstdtl-navi__sublist-item a[href*='/dtlmenu/']",
-                "Drink": "li.rstdtl-navi__sublist-item a[href*='/nu/drink/']",
-                "Lunch": "li.rstdtl-navi__sublist-item a[href*='/dtlmenu/nu]"
-            }
-
-            for tab_name, tab_selector in menu_tabs.items():
-                try:
-                    # logger.info(f"Looking for {tab_name} tab using selector: {tab_selector}")
-
-                    # Locate the item count for the tab
-                    item_count_element = self.driver.find_element(
-                        By.CSS_SELECTOR, f"{tab_selector} .rstdtl-navi__sublist-item-count em"
-                    )
-                    item_count = int(item_count_element.text.strip())
-                    # logger.info(f"Item count for {tab_name}: {item_count}")
-                    if item_count == 0:
-                        logger.info(f"Skipping {tab_name} tab as item count is 0.")
-                        menu_data[tab_name] = []
-                        continue
-
-                    # Wait for the tab link to appear
-                    tab_link = WebDriverWait(self.driver, self.wait_menu).until(
-                        EC.presence_of_element_located(
-                            (By.CSS_SELECTOR, tab_selector))
-                    )
-
-                    # Log the href attribute of the tab
-                    tab_url = tab_link.get_attribute('href')
-                    # logger.info(f"Navigating to {tab_name} tab: {tab_url}")
-
-                    # Scroll to the tab link and click it
-                    self.driver.execute_script("arguments[0].scrollIntoView(true);", tab_link)
-                    tab_link.click()
-
-                    # logger.info(f"Clicked on {tab_name} tab.")
-
-                    # Delay to allow the page to load
-                    time.sleep(1)
-
-                    if tab_name == "Set_Menu":
-                        # Wait for the Set Menu section to load
-                        WebDriverWait(self.driver, self.wait_menu).until(
-                            EC.presence_of_element_located(
-                                (By.CLASS_NAME, "rstdtl-course-list"))
-                        )
-                    else:
-                        # Wait for the menu section to load
-                        WebDriverWait(self.driver, self.wait_menu).until(
-                            EC.presence_of_element_located(
-                                (By.CLASS_NAME, "rstdtl-menu-lst"))
-                        )
-
-                    # Call the appropriate method based on the tab
-                    if tab_name == "Set_Menu":
-                        tab_menu_data = self.extract_set_menu()
-                    elif tab_name == "Food":
-                        tab_menu_data = self.extract_food_menu()
-                    elif tab_name == "Drink":
-                        tab_menu_data = self.extract_drink_menu()
-                    elif tab_name == "Lunch":
-                        tab_menu_data = self.extract_lunch_menu()
-                    else:
-                        tab_menu_data = []
-
-                    # logger.info(f"Extracted {len(tab_menu_data)} items from {tab_name} tab.")
-                    menu_data[tab_name] = tab_menu_data
-
-                except Exception as e:
-                    logger.warning(f"Failed to navigate to {tab_name} tab or extract data: e")
-                    menu_data[tab_name] = []
-
-            return menu_data
-        except Exception as e:
-            logger.error(f"Failed to navigate to Menu tab: e")
-            return {}
-
-    def extract_food_menu(self):
-        try:
-            # Extract food menu items
-            food_menu_data = self.driver.execute_script(
-                "return Array.from(document.querySelectorAll('.rstdtl-menu-lst__contents')).map(item => {"
-                "    const title = item.querySelector('.rstdtl-menu-lst__menu-title')?.innerText.trim() || null;"
-                "    const price = item.querySelector('.rstdtl-menu-lst__price')?.innerText.trim() || null;"
-                "    const description = item.querySelector('.rstdtl-menu-lst__ex')?.innerText.trim() || null;"
-                "    const image_src = item.querySelector('.rstdtl-menu-lst__img img')?.getAttribute('src')?.replace('150x150_square_', '') || null;"
-                "    return { title, price, description, image_src };"
-                "}).filter(item => item.image_src !== null);"
-            )
-
-            # logger.info(f"Extracted {len(food_menu_data)} food menu items with valid images.")
-            return food_menu_data
-
-        except Exception as e:
-            logger.error(f"Failed to extract food menu data: e")
-            return []
-
-    def extract_set_menu(self):
-        try:
-            # Extract set menu items
-            set_menu_data = self.driver.execute_script(
-                "return Array.from(document.querySelectorAll('.rstdtl-course-list')).map(menu => {"
-                "    return {"
-                "        title: menu.querySelector('.rstdtl-course-list__course-title-text')?.innerText.trim() || null,"
-                "        description: menu.querySelector('.rstdtl-course-list__desc')?.innerText.trim() || null,"
-                "        price: menu.querySelector('.rstdtl-course-list__price-num em')?.innerText.trim() || null,"
-                "        link: menu.querySelector('.rstdtl-course-list__target')?.getAttribute('href') || null,"
-                "        image_src: menu.querySelector('.rstdtl-course-list__img-target img')?.getAttribute('src')?.replace('200x200_square_', '') || null,"
-                "        available_time: menu.querySelector('.rstdtl-course-list__course-rule dd')?.innerText.trim() || null"
-                "    };"
-                "}).filter(item => item.image_src !== null);"
-            )
-
-            logger.info(
-                f"Extracted {len(set_menu_data)} set menu items with valid images.")
-            return set_menu_data
-
-        except Exception as e:
-            logger.error(f"Failed to extract set menu data: e")
-            return []
-
-    def extract_drink_menu(self):
-        try:
-            # Extract drink menu items
-            drink_menu_data = self.driver.execute_script(
-                "return Array.from(document.querySelectorAll('.rstdtl-menu-lst__contents')).map(item => {"
-                "    const title = item.querySelector('.rstdtl-menu-lst__menu-title')?.innerText.trim() || null;"
-                "    const price = item.querySelector('.rstdtl-menu-lst__price')?.innerText.trim() || null;"
-                "    const description = item.querySelector('.rstdtl-menu-lst__ex')?.innerText.trim() || null;"
-                "    const image_src = item.querySelector('.rstdtl-menu-lst__img img')?.getAttribute('src')?.replace('150x150_square_', '') || null;"
-                "    return { title, price, description, image_src };"
-                "}).filter(item => item.image_src !== null);"
-            )
-
-            logger.info(f"Extracted {len(drink_menu_data)} drink menu items with valid images.")
-            return drink_menu_data
-
-        except Exception as e:
-            logger.error(f"Failed to extract drink menu data: e")
-            return []
-
-    def extract_lunch_menu(self):
-        try:
-            # Extract lunch menu items
-            lunch_menu_data = self.driver.execute_script(
-                "return Array.from(document.querySelectorAll('.rstdtl-menu-lst__contents')).map(item => {"
-                "    const title = item.querySelector('.rstdtl-menu-lst__menu-title')?.innerText.trim() || null;"
-                "    const price = item.querySelector('.rstdtl-menu-lst__price')?.innerText.trim() || null;"
-                "    const description = item.querySelector('.rstdtl-menu-lst__ex')?.innerText.trim() || null;"
-                "    const image_src = item.querySelector('.rstdtl-menu-lst__img img')?.getAttribute('src')?.replace('150x150_square_', '') || null;"
-                "    return { title, price, description, image_src };"
-                "}).filter(item => item.image_src !== null);"
-            )
-
-            logger.info(
-                f"Extracted {len(lunch_menu_data)} lunch menu items with valid images.")
-            return lunch_menu_data
-
-        except Exception as e:
-            logger.error(f"Failed to extract lunch menu data: e")
-            return []
-
-    def parse_restaurant_information(self):
-        try:
-            # Wait for the restaurant information section to load
-            WebDriverWait(self.driver, 15).until(
-                EC.presence_of_element_located(
-                    (By.CLASS_NAME, 'rstinfo-table__table'))
-            )
-
-            # Extract all tables under the "Details", "Seats/facilities", "Menu", and "Feature - Related Information" sections
-            tables_data = self.driver.execute_script(
-                "return Array.from(document.querySelectorAll('h4.rstinfo-table__title')).map(title => {"
-                "    const section = title.innerText.trim();"
-                "    const rows = Array.from(title.nextElementSibling.querySelectorAll('tr')).map(row => {"
-                "        const field = row.querySelector('th')?.innerText.trim() || null;"
-                "        const value = row.querySelector('td span, td div span, td p')?.innerText.trim() || null;"
-                "        return { field, value };"
-                "    });"
-                "    return { section, rows };"
-                "});"
-            )
-
-            # Organize data into separate lists for each section
-            details = []
-            seats_facilities = []
-            menu = []
-            feature_related_info = []
-
-            for table in tables_data:
-                section = table['section']
-                rows = table['rows']
-
-                if section == "Details":
-                    details = rows
-                elif section == "Seats/facilities":
-                    seats_facilities = rows
-                elif section == "Menu":
-                    menu = rows
-                elif "Feature" in section:  # Matches "Feature - Related Information"
-                    feature_related_info = rows
-
-            # logger.info(f"Extracted {len(details)} details items.")
-            # logger.info(f"Extracted {len(seats_facilities)} seats/facilities items.")
-            # logger.info(f"Extracted {len(menu)} menu items.")
-            # logger.info(f"Extracted {len(feature_related_info)} feature-related information items.")
-
-            # Return all extracted data as a dictionary
-            return {
-                "details": details,
-                "seats_facilities": seats_facilities,
-                "menu": menu,
-                "feature_related_info": feature_related_info
-            }
-
-        except Exception as e:
-            logger.error(f"Failed to retrieve restaurant information: e")
-            return {
-                "details": [],
-                "seats_facilities": [],
-                "menu": [],
-                "feature_related_info": []
-            }
-
-    def navigate_and_get_interior_official_photos(self):
-        try:
-            # Wait for the Photos link in the navigation menu to appear
-            photos_link = WebDriverWait(self.driver, self.wait_photos).until(
-                EC.presence_of_element_located(
-                    (By.CSS_SELECTOR, "li#rdnavi-photo a.mainnavi"))
-            )
-
-            # Log the href attribute of the Photos link
-            photos_url = photos_link.get_attribute('href')
-            # logger.info(f"Navigating to Photos page: {photos_url}")
-
-            # Click the Photos link
-            self.driver.execute_script(
-                "arguments[0].scrollIntoView(true);", photos_link)
-            photos_link.click()
-
-            # Wait for the Photos page to load
-            WebDriverWait(self.driver, self.wait_photos).until(
-                EC.presence_of_element_located((By.CLASS_NAME, "rstdtl-photo"))
-            )
-
-            # Navigate to the Interior tab
-            interior_tab_link = self.driver.find_element(
-                By.CSS_SELECTOR, "a[href*='/dtlphotolst/3/smp2/']")
-            interior_tab_url = interior_tab_link.get_attribute('href')
-            # logger.info(f"Navigating to Interior tab: {interior_tab_url}")
-            self.driver.execute_script(
-                "arguments[0].click();", interior_tab_link)
-
-            # Wait for the Interior tab to load
-            WebDriverWait(self.driver, self.wait_photos).until(
-                EC.presence_of_element_located(
-                    (By.CLASS_NAME, "rstdtl-thumb-list"))
-            )
-
-            # Extract only the Interior Photos URLs
-            interior_photo_urls = self.driver.execute_script(
-                """
-                const officialPhotosSection = Array.from(document.querySelectorAll('.c-heading3.rstdtl-photo__title'))
-                    .find(title => title.innerText.trim() === 'Official photos');
-                if (officialPhotosSection) {
-                    const photoList = officialPhotosSection.nextElementSibling;
-                    return Array.from(photoList.querySelectorAll('.rstdtl-thumb-list__item img')).map(img => {
-                        let src = img.getAttribute('src');
-                        return src.replace('150x150_square_', '');
-                    });
-                }
-                return [];
-                """
-            )
-
-            # logger.info(f"Extracted {len(interior_photo_urls)} interior photo URLs.")
-            return interior_photo_urls
-
-        except Exception as e:
-            logger.error(f"Failed to navigate to Interior Photos page: e")
-            return []
+                logger.error(f"Failed to render {response.url}: {e}")
+                self.crawler.signals.send_catch_log(signal=render_finished, seconds=None, error=e)
+                return None
+            self.crawler.signals.send_catch_log(signal=render_finished, seconds=seconds, error=None)
+            return rendered
+
+    async def extract_sections(self, response, sections, stage):
+        """Extract ``sections`` (part -> spec name) statically, rendering once for any that need it.
+
+        Returns the values by part, and the parts that needed rendering and
+        are still missing, because the render failed or the section never
+        appeared (their values are the defaults). Times the
+        ``<stage>/extract`` and ``<stage>/render`` stages.
+        """
+        with self.timed(f'{stage}/extract'):
+            values = {part: extract_section(response, name) for part, name in sections.items()}
+        missing = {part: sections[part] for part, value in values.items() if value is None}
+        failed = set()
+        if missing:
+            logger.info(f"Rendering {response.url} for {', '.join(missing)}")
+            with self.timed(f'{stage}/render'):
+                rendered = await self.render(response, sorted(set(missing.values())))
+            for part, name in missing.items():
+                value = finish(name, (rendered or {}).get(name))
+                if value is None:
+                    # Rendering failed, or the wait timed out before the section (or a sign it's empty) appeared
+                    failed.add(part)
+                    value = default_for(name)
+                values[part] = value
+        return values, failed
+
+    async def parse_subpage(self, response, restaurant_id, part, attempt=0):
+        _, section = SUBPAGES[part]
+        self.download_timed(f'subpage/{part}/download', response)
+        sections, failed = await self.extract_sections(response, {part: section}, stage=f'subpage/{part}')
+
+        if failed:
+            item = self.retry_section(restaurant_id, part, response.url, attempt)
+        else:
+            if attempt:
+                self.crawler.stats.inc_value(f'sections/recovered/{part}')
+            item = self.assembler.add(restaurant_id, part, subpage_fields(part, sections[part]))
+        if item is not None:
+            yield item
+        for item in self.assembler.expired():
+            yield item
+
+    async def parse_detail_section(self, response, restaurant_id, part, attempt):
+        # A detail page section that failed before; only it is extracted (and rendered) again
+        sections, failed = await self.extract_sections(
+            response, {part: DETAIL_SECTIONS[part]}, stage=f'detail/{part}')
+        if failed:
+            item = self.retry_section(restaurant_id, part, response.url, attempt)
+        else:
+            self.crawler.stats.inc_value(f'sections/recovered/{part}')
+            item = self.assembler.add(restaurant_id, part, {part: sections[part]})
+        if item is not None:
+            yield item
+        for item in self.assembler.expired():
+            yield item
+
+    def subpage_failed(self, failure):
+        request = failure.request
+        rid, part = request.cb_kwargs["restaurant_id"], request.cb_kwargs["part"]
+        if failure.check(HttpError) and failure.value.response.status == 404:
+            # The restaurant has no such page (e.g. no party/ page without set menus): the section is empty
+            logger.info(f"No {part} page for restaurant {rid} at {request.url}")
+            self.crawler.stats.inc_value(f'sections/not_found/{part}')
+            if part in DETAIL_SECTIONS:
+                fields = {part: default_for(DETAIL_SECTIONS[part])}
+            else:
+                fields = subpage_fields(part, default_for(SUBPAGES[part][1]))
+            item = self.assembler.add(rid, part, fields)
+        else:
+            logger.error(f"Failed to fetch {request.url}: {failure.value!r}")
+            item = self.retry_section(rid, part, request.url, request.cb_kwargs.get("attempt", 0))
+        if item is not None:
+            yield item
+        for item in self.assembler.expired():
+            yield item
+
+    def spider_idle(self):
+        if self.delayed_requests:
+            # Section retries are waiting out their backoff
+            raise DontCloseSpider
+        # Nothing left that could complete the outstanding partial items
+        if len(self.assembler):
+            self.crawler.engine.crawl(
+                scrapy.Request("data:,", callback=self.flush_partial_items, dont_filter=True))
+            raise DontCloseSpider
+
+    def flush_partial_items(self, response):
+        for item in self.assembler.flush():
+            yield item
 
     def closed(self, reason):
-        self.driver.quit()
+        # Runs before SpiderState writes the final state to JOBDIR
+        self.update_state()
+        self.state['closed_reason'] = reason
+        for call in self.delayed_requests:
+            if call.active():
+                call.cancel()
+        # Browsers quit off the reactor; the crawl finishes closing once they have
+        browsers_closed = self.driver_pool.close()
+        self.requested.close(reason)
+        if self.index is not None:
+            self.index.close()
+        if self.cache_proxy is not None:
+            self.cache_proxy.stop()
+        return browsers_closed
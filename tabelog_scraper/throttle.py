@@ -0,0 +1,237 @@
+# Adaptive concurrency for Scrapy's downloader slots and the browser pool.
+#
+# Every ADAPTIVE_INTERVAL seconds each slot (one per download host, plus one
+# for the browsers) looks at what happened since the last decision:
+#
+#   throttled  a 429/403/503 or a block page    -> halve concurrency, double the delay
+#   congested  errors or latency well above the best seen -> concurrency x 3/4
+#   healthy                                       -> halve the delay, then add concurrency:
+#                                                    doubling until the first back-off,
+#                                                    one at a time after that
+#
+# so a slot ramps up quickly on a healthy site and backs off exponentially
+# when Tabelog pushes back. A throttling response backs its slot off at once
+# instead of at the next decision, but only if its request was sent after the
+# slot last changed: the responses to a burst sent before a back-off don't
+# back off again. Decisions are counted in adaptive/<slot>/* stats,
+# with the last ADAPTIVE_HISTORY changes per slot in adaptive/<slot>/history
+# as [seconds since start, decision, concurrency, delay].
+import logging
+import time
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from twisted.internet import task
+
+from tabelog_scraper.signals import render_finished
+
+logger = logging.getLogger(__name__)
+
+THROTTLE_STATUSES = (429, 403, 503)
+
+
+class SlotController:
+    """AIMD control of one slot's concurrency and delay from a window of observations."""
+
+    def __init__(self, name, concurrency, minimum=1, maximum=16, max_delay=60.0,
+                 max_error_rate=0.1, latency_factor=2.0):
+        self.name = name
+        self.concurrency = concurrency
+        self.minimum = minimum
+        self.maximum = maximum
+        self.delay = 0.0
+        self.max_delay = max_delay
+        self.max_error_rate = max_error_rate
+        self.latency_factor = latency_factor
+        self.slow_start = True
+        # Lowest mean latency of any window: what this slot does when it isn't congested
+        self.best_latency = None
+        # When concurrency or delay last changed
+        self.changed = time.monotonic()
+        self._reset()
+
+    def _reset(self):
+        self.count = self.timed = self.errors = self.throttled = 0
+        self.latency = 0.0
+        self.retry_after = 0.0
+
+    def observe(self, latency=None, error=False, throttled=False, retry_after=0.0):
+        self.count += 1
+        if latency is not None:
+            self.timed += 1
+            self.latency += latency
+        self.errors += bool(error)
+        self.throttled += bool(throttled)
+        self.retry_after = max(self.retry_after, retry_after)
+
+    def decide(self):
+        """Adjust concurrency and delay; returns the decision, or None without observations."""
+        if not self.count:
+            return None
+        before = (self.concurrency, self.delay)
+        mean_latency = self.latency / self.timed if self.timed else 0.0
+        if self.throttled:
+            decision = "backoff"
+            self.slow_start = False
+            self.concurrency = max(self.minimum, self.concurrency // 2)
+            self.delay = min(self.max_delay, max(self.delay * 2, 1.0, self.retry_after))
+        elif (self.errors / self.count > self.max_error_rate
+              or (self.best_latency and mean_latency > self.best_latency * self.latency_factor)):
+            decision = "decrease"
+            self.slow_start = False
+            self.concurrency = max(self.minimum, self.concurrency * 3 // 4)
+        else:
+            decision = "increase"
+            if self.delay:
+                self.delay = self.delay / 2 if self.delay > 0.25 else 0.0
+            elif self.slow_start:
+                self.concurrency = min(self.maximum, self.concurrency * 2)
+            else:
+                self.concurrency = min(self.maximum, self.concurrency + 1)
+            if mean_latency and (self.best_latency is None or mean_latency < self.best_latency):
+                self.best_latency = mean_latency
+        if (self.concurrency, self.delay) != before:
+            self.changed = time.monotonic()
+        self._reset()
+        return decision
+
+
+class AdaptiveConcurrencyMiddleware:
+    """Downloader middleware that tunes each download slot and the browser pool with a SlotController."""
+
+    def __init__(self, crawler, interval=5.0, history=100, block_markers=(), http=None, browser=None):
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.interval = interval
+        self.history = history
+        self.block_markers = [marker.encode() for marker in block_markers]
+        self.http_options = http or {}
+        self.browser_options = browser or {}
+        self.controllers = {}
+        self.browser = None
+        self.task = None
+        self.started = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool("ADAPTIVE_CONCURRENCY_ENABLED"):
+            raise NotConfigured
+        if settings.getbool("AUTOTHROTTLE_ENABLED"):
+            logger.warning("AutoThrottle is enabled; adaptive concurrency is off")
+            raise NotConfigured
+        common = {
+            "max_delay": settings.getfloat("ADAPTIVE_MAX_DELAY", 60.0),
+            "max_error_rate": settings.getfloat("ADAPTIVE_MAX_ERROR_RATE", 0.1),
+            "latency_factor": settings.getfloat("ADAPTIVE_LATENCY_FACTOR", 2.0),
+        }
+        pool_size = max(1, settings.getint("BROWSER_POOL_SIZE", 1))
+        middleware = cls(
+            crawler,
+            interval=settings.getfloat("ADAPTIVE_INTERVAL", 5.0),
+            history=settings.getint("ADAPTIVE_HISTORY", 100),
+            block_markers=settings.getlist("ADAPTIVE_BLOCK_MARKERS"),
+            http=dict(common, maximum=settings.getint("ADAPTIVE_HTTP_MAX_CONCURRENCY", 16),
+                      concurrency=settings.getint("ADAPTIVE_HTTP_START_CONCURRENCY", 2)),
+            # Every browser in the pool is started anyway; begin with all of them rendering
+            browser=dict(common, maximum=pool_size, concurrency=pool_size),
+        )
+        crawler.signals.connect(middleware.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(middleware.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(middleware.request_reached_downloader,
+                                signal=signals.request_reached_downloader)
+        crawler.signals.connect(middleware.render_finished, signal=render_finished)
+        return middleware
+
+    def spider_opened(self, spider):
+        self.started = time.monotonic()
+        self.task = task.LoopingCall(self.decide)
+        self.task.start(self.interval, now=False)
+
+    def spider_closed(self, spider):
+        if self.task and self.task.running:
+            self.task.stop()
+
+    def request_reached_downloader(self, request, spider):
+        # The slot exists by now, and nothing has been sent from it yet
+        key = request.meta["download_slot"]
+        if key not in self.controllers:
+            self.controllers[key] = SlotController(key, **self.http_options)
+            self.apply(key)
+        request.meta["adaptive_sent"] = time.monotonic()
+
+    def process_response(self, request, response, spider):
+        controller = self.controllers.get(request.meta.get("download_slot"))
+        if controller is None or "cached" in response.flags:
+            return response
+        blocked = self.is_block_page(response)
+        if blocked:
+            self.stats.inc_value("adaptive/block_pages", spider=spider)
+        throttled = blocked or response.status in THROTTLE_STATUSES
+        if throttled and request.meta.get("adaptive_sent", 0) < controller.changed:
+            # Sent before the last change; that change already answered this
+            self.stats.inc_value("adaptive/throttled_ignored", spider=spider)
+            return response
+        retry_after = response.headers.get("Retry-After", b"").decode()
+        controller.observe(
+            latency=request.meta.get("download_latency"),
+            error=response.status >= 500,
+            throttled=throttled,
+            retry_after=float(retry_after) if retry_after.isdigit() else 0.0)
+        if throttled:
+            self.record(controller, controller.decide())
+            self.apply(controller.name)
+        return response
+
+    def process_exception(self, request, exception, spider):
+        controller = self.controllers.get(request.meta.get("download_slot"))
+        if controller is not None:
+            controller.observe(error=True)
+
+    def is_block_page(self, response):
+        if not self.block_markers or response.status != 200:
+            return False
+        if b"html" not in response.headers.get("Content-Type", b"html"):
+            return False
+        return any(marker in response.body for marker in self.block_markers)
+
+    def render_finished(self, seconds, error=None):
+        if self.browser is None:
+            self.browser = SlotController("browser", **self.browser_options)
+        self.browser.observe(latency=seconds, error=error is not None)
+
+    def decide(self):
+        for key, controller in self.controllers.items():
+            self.record(controller, controller.decide())
+            self.apply(key)
+        if self.browser is not None:
+            self.record(self.browser, self.browser.decide())
+            pool = getattr(self.crawler.spider, "driver_pool", None)
+            if pool is not None:
+                pool.set_limit(self.browser.concurrency)
+
+    def apply(self, key):
+        slot = self.crawler.engine.downloader.slots.get(key)
+        if slot is not None:
+            controller = self.controllers[key]
+            slot.concurrency = controller.concurrency
+            slot.delay = controller.delay
+
+    def record(self, controller, decision):
+        if decision is None:
+            return
+        prefix = f"adaptive/{controller.name}"
+        self.stats.inc_value(f"{prefix}/{decision}")
+        changed = ((controller.concurrency, controller.delay)
+                   != (self.stats.get_value(f"{prefix}/concurrency"), self.stats.get_value(f"{prefix}/delay")))
+        if not changed:
+            return
+        self.stats.set_value(f"{prefix}/concurrency", controller.concurrency)
+        self.stats.set_value(f"{prefix}/delay", controller.delay)
+        history = self.stats.get_value(f"{prefix}/history") or []
+        history.append([round(time.monotonic() - self.started, 1), decision, controller.concurrency,
+                        round(controller.delay, 2)])
+        self.stats.set_value(f"{prefix}/history", history[-self.history:])
+        if decision != "increase":
+            logger.info(f"{controller.name}: {decision} to concurrency {controller.concurrency}, "
+                        f"delay {controller.delay:.2f}s")
@@ -0,0 +1,73 @@
+import re
+from urllib.parse import urlsplit, urlunsplit
+
+# e.g. https://tabelog.com/en/saga/A4104/A410401/41006451/dtlmenu/
+RESTAURANT_URL_RE = re.compile(r'^(?P<base>.*?/A\d{4}/A\d{6}/(?P<id>\d+))(?:/|$)')
+
+
+def restaurant_id(url):
+    """Tabelog restaurant ID (e.g. '41006451') from any restaurant or sub-page URL."""
+    match = RESTAURANT_URL_RE.match(urlsplit(url).path)
+    return match.group('id') if match else None
+
+
+def restaurant_url(url):
+    """The restaurant's top page URL, without sub-page path, query string or fragment."""
+    parts = urlsplit(url)
+    match = RESTAURANT_URL_RE.match(parts.path)
+    path = match.group('base') + '/' if match else parts.path
+    return urlunsplit((parts.scheme, parts.netloc, path, '', ''))
+
+
+# e.g. https://tabelog.com/en/rstLst/2/?pcd=41, https://tabelog.com/en/tokyo/A1301/rstLst/
+LISTING_PAGE_RE = re.compile(r'(/rstLst/)(?:\d+/)?')
+
+
+def listing_page_url(url, page):
+    """URL of result page ``page`` of the listing at ``url``, keeping its search conditions."""
+    parts = urlsplit(url)
+    segment = r'\g<1>' if page == 1 else rf'\g<1>{page}/'
+    path = LISTING_PAGE_RE.sub(segment, parts.path, count=1)
+    return urlunsplit(parts._replace(path=path))
+
+
+# e.g. /en/saga/A4104/A410401/41006451/ -> prefecture 41, area A4104
+AREA_RE = re.compile(r'/(A(\d{2})\d{2})(?:/|$)')
+PREFECTURE_RE = re.compile(r'(?:^|&)pcd=(\d+)(?:&|$)')
+
+
+def area_codes(url):
+    """(prefecture, area) of a restaurant or listing URL, e.g. ('41', 'A4104'); None where unknown."""
+    parts = urlsplit(url)
+    match = AREA_RE.search(parts.path)
+    if match:
+        return match.group(2), match.group(1)
+    match = PREFECTURE_RE.search(parts.query)
+    return (match.group(1).zfill(2) if match else None), None
+
+
+# Sub-page path under the restaurant URL -> page type
+SUBPAGE_TYPES = (
+    ('dtlmenu/', 'menu'),
+    ('party/', 'menu'),
+    ('dtlratings/', 'ratings'),
+    ('dtlrvwlst/', 'ratings'),
+    ('dtlphotolst/', 'photos'),
+)
+
+
+def page_type(url):
+    """'listing', 'detail', 'menu', 'ratings', 'photos' or 'other', from a Tabelog URL."""
+    path = urlsplit(url).path
+    match = RESTAURANT_URL_RE.match(path)
+    if match:
+        subpath = path[match.end():]
+        if not subpath:
+            return 'detail'
+        for prefix, kind in SUBPAGE_TYPES:
+            if subpath.startswith(prefix):
+                return kind
+        return 'other'
+    if LISTING_PAGE_RE.search(path):
+        return 'listing'
+    return 'other'
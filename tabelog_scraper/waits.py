@@ -0,0 +1,98 @@
+import logging
+import threading
+from collections import defaultdict, deque
+
+logger = logging.getLogger(__name__)
+
+# Resolves from inside the page instead of polling over WebDriver:
+#   "found"   - the selector matched
+#   "absent"  - a selector proving the section isn't on this page matched
+#   "quiet"   - the document is parsed and the DOM stopped changing for quiet_ms
+#   "timeout" - none of the above within timeout_ms
+WAIT_SCRIPT = """
+const [selector, absentIf, timeoutMs, quietMs, done] = arguments;
+const start = performance.now();
+let finished = false, observer = null, quietTimer = null, timer = null;
+function finish(state) {
+    if (finished) return;
+    finished = true;
+    if (observer) observer.disconnect();
+    clearTimeout(quietTimer);
+    clearTimeout(timer);
+    done([state, (performance.now() - start) / 1000]);
+}
+function check() {
+    if (document.querySelector(selector)) return finish('found');
+    if (absentIf && document.querySelector(absentIf)) return finish('absent');
+    if (document.readyState !== 'loading') {
+        clearTimeout(quietTimer);
+        quietTimer = setTimeout(() => finish('quiet'), quietMs);
+    }
+}
+check();
+if (!finished) {
+    observer = new MutationObserver(check);
+    observer.observe(document.documentElement, {childList: true, subtree: true});
+    document.addEventListener('readystatechange', check);
+    timer = setTimeout(() => finish('timeout'), timeoutMs);
+}
+"""
+
+
+class AdaptiveWaiter:
+    """Waits for a selector with a MutationObserver and learns how long to wait for it.
+
+    Every selector starts with ``max_timeout``. Once ``min_samples`` successful
+    waits have been seen, its timeout becomes the chosen latency percentile times
+    ``factor``, clamped to ``[min_timeout, max_timeout]``. Pages that are fully
+    parsed and have stopped changing resolve after ``quiet_ms`` without the
+    selector, so sections a restaurant doesn't have cost well under a second.
+    """
+
+    def __init__(self, min_timeout=1.0, max_timeout=10.0, quiet_ms=500,
+                 percentile=95, factor=2.0, min_samples=20, window=200):
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.quiet_ms = quiet_ms
+        self.percentile = percentile
+        self.factor = factor
+        self.min_samples = min_samples
+        self._latencies = defaultdict(lambda: deque(maxlen=window))
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls, settings):
+        return cls(
+            min_timeout=settings.getfloat("WAIT_MIN_TIMEOUT", 1.0),
+            max_timeout=settings.getfloat("WAIT_MAX_TIMEOUT", 10.0),
+            quiet_ms=settings.getint("WAIT_QUIET_MS", 500),
+            percentile=settings.getfloat("WAIT_TIMEOUT_PERCENTILE", 95),
+            factor=settings.getfloat("WAIT_TIMEOUT_FACTOR", 2.0),
+            min_samples=settings.getint("WAIT_MIN_SAMPLES", 20),
+        )
+
+    def timeout_for(self, selector):
+        with self._lock:
+            samples = sorted(self._latencies[selector])
+        if len(samples) < self.min_samples:
+            return self.max_timeout
+        index = min(len(samples) - 1, int(len(samples) * self.percentile / 100))
+        return min(self.max_timeout, max(self.min_timeout, samples[index] * self.factor))
+
+    def wait(self, driver, selector, absent_if=None):
+        """Block until ``selector`` is in the page or known not to be; returns True if found."""
+        timeout = self.timeout_for(selector)
+        driver.set_script_timeout(timeout + 1)
+        try:
+            state, elapsed = driver.execute_async_script(
+                WAIT_SCRIPT, selector, absent_if, int(timeout * 1000), self.quiet_ms)
+        except Exception as e:
+            logger.info(f"Wait for '{selector}' failed: {e}")
+            return False
+
+        if state == "found":
+            with self._lock:
+                self._latencies[selector].append(elapsed)
+        else:
+            logger.info(f"'{selector}' {state} after {elapsed:.2f}s (timeout {timeout:.2f}s)")
+        return state == "found"
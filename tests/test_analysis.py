@@ -0,0 +1,34 @@
+import pytest
+
+pd = pytest.importorskip("pandas")
+
+from tabelog_scraper.analysis import analyse, parse_numbers  # noqa: E402
+
+
+def test_parse_numbers_of_all_null_column():
+    values = pd.Series([None, None], index=[3, 5], dtype="object")
+    parsed = parse_numbers(values)
+    assert parsed.dtype == "float64"
+    assert list(parsed.index) == [3, 5]
+    assert parsed.isna().all()
+
+
+def test_parse_numbers_of_empty_column():
+    assert parse_numbers(pd.Series([], dtype="object")).empty
+
+
+def test_analyse_without_prices_or_seats():
+    tables = {
+        "restaurants": pd.DataFrame([
+            {"restaurant_id": "1", "url": "u1", "name": "A", "area": "Tenjin 350m", "genre": "Ramen",
+             "rating": "3.52", "review_count": "12", "average_ratings": None},
+        ]),
+        "menu_items": pd.DataFrame([{"restaurant_id": "1", "menu": "Food", "name": "Ramen", "price": None}]),
+        "info_rows": pd.DataFrame([{"restaurant_id": "1", "field": "Business hours", "value": "Mon 11:00 - 15:00"}]),
+        "rating_distribution": pd.DataFrame(columns=["restaurant_id", "range", "percentage", "people"]),
+    }
+    frames = analyse(tables)
+    restaurants = frames["restaurants"]
+    assert restaurants["seats"].isna().all()
+    assert frames["menu_items"]["price"].isna().all()
+    assert list(frames["by_area"].index) == ["Tenjin"]
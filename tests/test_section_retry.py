@@ -0,0 +1,132 @@
+import json
+import multiprocessing
+import os
+from collections import Counter
+
+from scrapy.crawler import CrawlerProcess
+from scrapy.utils.project import get_project_settings
+
+from benchmarks.server import StandInServer
+from tabelog_scraper.spiders.restaurants import RestaurantsSpider
+
+
+class FlakyRatingsServer(StandInServer):
+    """Answers the first request for each ratings page with a 503."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.hits = Counter()
+
+    def status(self, path):
+        if not path.endswith("/dtlratings/"):
+            return 200
+        self.hits[path] += 1
+        return 503 if self.hits[path] == 1 else 200
+
+
+class NoSetMenuServer(StandInServer):
+    """Restaurants without set menus, which have no party/ page."""
+
+    def page(self, path):
+        return None if path.endswith("/party/") else super().page(path)
+
+
+class LateRatingsServer(StandInServer):
+    """Serves each ratings page without its ratings the first time, as if they hadn't loaded."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.hits = Counter()
+
+    def page(self, path):
+        body = super().page(path)
+        if body is not None and path.endswith("/dtlratings/"):
+            self.hits[path] += 1
+            if self.hits[path] == 1:
+                body = body.replace("ratings-contents", "ratings-loading")
+        return body
+
+
+class TimingOutSpider(RestaurantsSpider):
+    """Renders like a browser whose wait times out: the page loads but the sections never appear."""
+
+    async def render(self, response, sections):
+        return {name: None for name in sections}
+
+
+def run_crawl(spider_cls, start_url, restaurants, settings, results):
+    os.environ.setdefault("SCRAPY_SETTINGS_MODULE", "tabelog_scraper.settings")
+    crawl_settings = get_project_settings()
+    crawl_settings.setdict(settings, priority="cmdline")
+    process = CrawlerProcess(crawl_settings)
+    crawler = process.create_crawler(spider_cls)
+    process.crawl(crawler, num_restaurants=restaurants, start_url=start_url)
+    process.start()
+    results.put(crawler.stats.get_stats())
+
+
+def crawl(server, tmp_path, spider_cls=RestaurantsSpider, **settings):
+    """Items and stats of a crawl of every restaurant ``server`` lists.
+
+    Each crawl runs in a process of its own, as the reactor can't be restarted.
+    """
+    feed = tmp_path / "items.jsonl"
+    settings = {
+        "HTTPCACHE_DIR": str(tmp_path / "httpcache"),
+        "INDEX_ENABLED": False,
+        "EXPORT_DIR": "",
+        "JOBDIR": None,
+        "TELNETCONSOLE_ENABLED": False,
+        "LOG_LEVEL": "WARNING",
+        "FEEDS": {str(feed): {"format": "jsonlines"}},
+        **settings,
+    }
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(target=run_crawl, args=(
+        spider_cls, server.start_url, server.corpus.restaurants, settings, results))
+    process.start()
+    stats = results.get(timeout=120)
+    process.join()
+    items = [json.loads(line) for line in feed.read_text().splitlines()]
+    return items, stats
+
+
+def test_failed_section_is_downloaded_again(tmp_path):
+    with FlakyRatingsServer(restaurants=2) as server:
+        items, stats = crawl(
+            server, tmp_path,
+            # The cache must not answer the retry with the 503 it saw first
+            HTTPCACHE_ENABLED=True,
+            # Leave the 503 to the section retry
+            RETRY_ENABLED=False,
+            SECTION_RETRY_DELAY=0.1,
+        )
+
+    assert len(items) == 2
+    assert list(server.hits.values()) == [2, 2]
+    assert stats["sections/retried/review_rating"] == 2
+    assert stats["sections/recovered/review_rating"] == 2
+    assert all(item["failed_sections"] == [] and item["review_rating"] for item in items)
+
+
+def test_missing_sub_page_is_an_empty_section(tmp_path):
+    with NoSetMenuServer(restaurants=2) as server:
+        items, stats = crawl(server, tmp_path, HTTPCACHE_ENABLED=False, SECTION_RETRY_DELAY=0.1)
+
+    assert len(items) == 2
+    assert stats["sections/not_found/Set_Menu"] == 2
+    assert "sections/retried/Set_Menu" not in stats
+    assert all(item["failed_sections"] == [] and item["menu"]["Set_Menu"] == [] for item in items)
+
+
+def test_section_missing_after_render_is_retried(tmp_path):
+    with LateRatingsServer(restaurants=2) as server:
+        items, stats = crawl(server, tmp_path, spider_cls=TimingOutSpider,
+                             HTTPCACHE_ENABLED=False, SECTION_RETRY_DELAY=0.1)
+
+    assert len(items) == 2
+    assert list(server.hits.values()) == [2, 2]
+    assert stats["sections/retried/review_rating"] == 2
+    assert stats["sections/recovered/review_rating"] == 2
+    assert all(item["failed_sections"] == [] and item["review_rating"] for item in items)